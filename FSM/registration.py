@@ -1,19 +1,14 @@
-import asyncio, os
+import asyncio
 from aiogram import types, Router, F, Bot, BaseMiddleware
 from aiogram.filters import Command
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
 from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
 from aiogram.utils.chat_action import ChatActionSender
-from dotenv import load_dotenv, find_dotenv
+from common.profile_store import profile_store
 import re
-import pandas as pd
 from typing import Callable, Dict, Any, Awaitable
 
-load_dotenv(find_dotenv())
-
-bot = Bot(token=os.getenv('TOKEN_API'))
-
 # extracts only first one number from all text (included other numbers)
 def extract_number(text):
     match = re.search(r'\b(\d+)\b', text)
@@ -32,7 +27,7 @@ class Recording(StatesGroup):
     target_distance = State()
     training_frequency = State()
 
-reg_router = Router()
+reg_router = Router(name="registration")
 
 # Inline keyboard for registration
 registration_keyboard = InlineKeyboardMarkup(
@@ -58,14 +53,10 @@ class RegistrationMiddleware(BaseMiddleware):
     ) -> Any:
         if event.data == "start_registration":
             user_id = event.from_user.id
-            try:
-                df = pd.read_excel("user_registration_data.xlsx")
-                if user_id in df['user_id'].values:
-                    await event.answer()
-                    await event.message.answer("Вы уже зарегистрированы!")
-                    return  # Прерываем дальнейшее выполнение
-            except FileNotFoundError:
-                pass  # Файл не найден, продолжаем регистрацию
+            if user_id in profile_store:
+                await event.answer()
+                await event.message.answer("Вы уже зарегистрированы!")
+                return  # Прерываем дальнейшее выполнение
         return await handler(event, data)
 
 # Применяем middleware к роутеру
@@ -81,7 +72,7 @@ async def cmd_about(callback_query: types.CallbackQuery):
     await callback_query.message.answer("Привет, наш бот разработан для твоих кардио тренировок(бег),"
                          "данный проект поможет отслеживать твой прогресс!\n")
 @reg_router.callback_query(F.data == "start_registration")
-async def reg_cmd(callback_query: types.CallbackQuery, state: FSMContext):
+async def reg_cmd(callback_query: types.CallbackQuery, state: FSMContext, bot: Bot):
     await callback_query.answer()
     await state.clear()
 
@@ -95,7 +86,7 @@ async def reg_cmd(callback_query: types.CallbackQuery, state: FSMContext):
     await state.set_state(Recording.name)
 
 @reg_router.message(F.text, Recording.name)
-async def capture_name(message: Message, state: FSMContext):
+async def capture_name(message: Message, state: FSMContext, bot: Bot):
     await state.update_data(name=message.text)
     async with ChatActionSender.typing(bot=bot, chat_id=message.chat.id):
         await asyncio.sleep(1)
@@ -103,7 +94,7 @@ async def capture_name(message: Message, state: FSMContext):
     await state.set_state(Recording.age)
 
 @reg_router.message(F.text, Recording.age)
-async def capture_age(message:Message, state:FSMContext):
+async def capture_age(message:Message, state:FSMContext, bot: Bot):
     check_age = extract_number(message.text)
 
 
@@ -188,22 +179,17 @@ async def capture_training_frequency(message:Message, state:FSMContext):
 async def verification(callback_query: types.CallbackQuery, state: FSMContext):
     await callback_query.answer()
     data = await state.get_data()
-    try:
-        df = pd.read_excel("user_registration_data.xlsx")
-    except FileNotFoundError:
-        df = pd.DataFrame(columns=list(data.keys()))
-
-    new_row = pd.DataFrame([data])
-    df = pd.concat([df, new_row], ignore_index=True)
-
-
-    df.to_excel("user_registration_data.xlsx", index=False)
+    # Повторное нажатие или кнопка под старой анкетой: анкета уже сохранена или не заполнена до конца
+    if "user_id" not in data or "training_frequency" not in data:
+        return
+    # Профиль сразу доступен в памяти, на диск он запишется в фоне
+    profile_store.upsert(data)
     await state.clear()
     await callback_query.message.answer("Данные успешно сохранены!")
 
 @reg_router.callback_query(F.data == "no")
-async def restart_registration(callback_query: types.CallbackQuery, state: FSMContext):
+async def restart_registration(callback_query: types.CallbackQuery, state: FSMContext, bot: Bot):
     await callback_query.answer()
     await state.clear()
     await callback_query.message.answer("Регистрация начата заново.")
-    await reg_cmd(callback_query, state)
+    await reg_cmd(callback_query, state, bot)
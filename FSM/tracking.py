@@ -1,19 +1,19 @@
-import asyncio, os
+import asyncio
+import os
+import tempfile
 from aiogram import types, Router, F, Bot, BaseMiddleware
-from aiogram.filters import Command
+from aiogram.filters import Command, CommandObject, StateFilter
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
 from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton
-import pandas as pd
 from aiogram.utils.chat_action import ChatActionSender
-from dotenv import load_dotenv, find_dotenv
-import re
+from common.profile_store import profile_store
+from common.workout_store import workout_store
+from common.track_import import (track_importer, format_duration, TrackImportError, MAX_TRACK_FILE_SIZE,
+                                 TRACK_EXTENSIONS)
+from common.workout_parser import FIELDS, parse_workout, derive_pace
 from typing import Callable, Dict, Any, Awaitable
 
-load_dotenv(find_dotenv())
-
-bot = Bot(token=os.getenv('TOKEN_API'))
-
 # Inline keyboard for registration
 registration_keyboard = InlineKeyboardMarkup(
     inline_keyboard=[
@@ -22,14 +22,6 @@ registration_keyboard = InlineKeyboardMarkup(
     ]
 )
 
-# extracts only first one number from all text (included other numbers)
-def extract_number(text):
-    match = re.search(r'\b(\d+)\b', text)
-    if match:
-        return int(match.group(1))
-    else:
-        return None
-
 class Tracking(StatesGroup):
     user_id = State()
     distance = State()
@@ -39,7 +31,32 @@ class Tracking(StatesGroup):
     burned_calories = State()
     confirmation = State()
 
-track_router = Router()
+track_router = Router(name="tracking")
+
+FIELD_STATES = {
+    "distance": Tracking.distance,
+    "time": Tracking.time,
+    "pace": Tracking.average_pace,
+    "pulse": Tracking.average_pulse,
+    "calories": Tracking.burned_calories,
+}
+STATE_FIELDS = {state.state: field for field, state in FIELD_STATES.items()}
+
+QUESTIONS = {
+    "distance": 'Какую дистанцию вы пробежали (в км)?',
+    "time": 'Сколько времени у вас ушло на преодоление этой дистанции (в минутах или мм:сс)?',
+    "pace": 'Какой был ваш средний темп бега(км/ч)?',
+    "pulse": 'Какой был ваш средний пульс(удары в минуту)?',
+    "calories": 'Сколько калорий было сожжено?',
+}
+ERRORS = {
+    "distance": "Пожалуйста, введите корректную дистанцию.(0-60км)",
+    "time": "Пожалуйста, введите корректное время.",
+    "pace": "Пожалуйста, введите корректный средний темп.(0-44 км/ч)",
+    "pulse": "Пожалуйста, введите корректный средний пульс. (90-240)",
+    "calories": "Пожалуйста, введите корректное количество сожженных калорий (0-6000).",
+}
+ONE_MESSAGE_HINT = 'Можно сразу всю тренировку одним сообщением, например: 5.2 км 27:30 пульс 152 410 ккал'
 
 confirm_track_keyboard = InlineKeyboardMarkup(
     inline_keyboard=[
@@ -56,15 +73,10 @@ class TrackingRegistrationMiddleware(BaseMiddleware):
         event: Message,
         data: Dict[str, Any]
     ) -> Any:
-        if event.text.startswith('/tracking'):
+        # Сообщения без текста (например, файл тренировки) тоже требуют регистрации
+        if event.document is not None or (event.text or '').startswith('/tracking'):
             user_id = event.from_user.id
-            try:
-                df = pd.read_excel("user_registration_data.xlsx")
-                if user_id not in df['user_id'].values:
-                    await event.answer("Пожалуйста, сначала зарегистрируйтесь!")
-                    await event.answer("Нажмите кнопку для начала регистрации:", reply_markup=registration_keyboard)
-                    return  # Прерываем дальнейшее выполнение
-            except FileNotFoundError:
+            if user_id not in profile_store:
                 await event.answer("Пожалуйста, сначала зарегистрируйтесь!")
                 await event.answer("Нажмите кнопку для начала регистрации:", reply_markup=registration_keyboard)
                 return  # Прерываем дальнейшее выполнение
@@ -74,74 +86,54 @@ class TrackingRegistrationMiddleware(BaseMiddleware):
 track_router.message.middleware(TrackingRegistrationMiddleware())
 
 @track_router.message(Command("tracking"))
-async def reg_cmd(message: types.Message, state: FSMContext):
+async def reg_cmd(message: types.Message, state: FSMContext, bot: Bot, command: CommandObject):
     await state.clear()
 
     user_id = message.from_user.id
     await state.update_data(user_id=user_id)
 
+    # /tracking 5.2 км 27:30 пульс 152 410 ккал - спрашиваем только то, что не удалось разобрать
+    found = parse_workout(command.args) if command.args else {}
+    if found:
+        await state.update_data(**found)
+        await ask_next(message, state)
+        return
+
     async with ChatActionSender.typing(bot=bot, chat_id=message.chat.id):
         await asyncio.sleep(2)
-        await message.answer('Какую дистанцию вы пробежали (в км)?')
+        await message.answer(f'{QUESTIONS["distance"]}\n{ONE_MESSAGE_HINT}\n'
+                             '(или пришлите файл тренировки с часов в формате .gpx или .tcx)')
     await state.set_state(Tracking.distance)
 
-@track_router.message(F.text, Tracking.distance)
-async def process_distance(message: types.Message, state: FSMContext):
-    distance = extract_number(message.text)
-    if not distance or not 0 < distance <= 60:
-        await message.reply("Пожалуйста, введите корректную дистанцию.(0-60км)")
-        return
-
-    await state.update_data(distance=distance)
-    await message.answer('Сколько времени у вас ушло на преодоление этой дистанции(в минутах)?')
-    await state.set_state(Tracking.time)
-
-@track_router.message(F.text, Tracking.time)
-async def process_time(message: types.Message, state: FSMContext):
-    time = extract_number(message.text)
-    if not time or time < 0:
-        await message.reply("Пожалуйста, введите корректное время.")
-        return
-
-    await state.update_data(time=time)
-    await message.answer('Какой был ваш средний темп бега(км/ч)?')
-    await state.set_state(Tracking.average_pace)
-
-
-@track_router.message(F.text, Tracking.average_pace)
-async def process_average_pace(message: types.Message, state: FSMContext):
-    pace = extract_number(message.text)
-    if not pace or not 0 < pace <= 44:
-        await message.reply("Пожалуйста, введите корректный средний темп.(0-44 км/ч)")
-        return
-
-    await state.update_data(pace=pace)
-    await message.answer('Какой был ваш средний пульс(удары в минуту)?')
-    await state.set_state(Tracking.average_pulse)
-
-@track_router.message(F.text, Tracking.average_pulse)
-async def process_average_pulse(message: types.Message, state: FSMContext):
-    pulse = extract_number(message.text)
-    if not pulse or not 90 < pulse <= 240:
-        await message.reply("Пожалуйста, введите корректный средний пульс. (90-240)")
+@track_router.message(F.text, StateFilter(*FIELD_STATES.values()))
+async def process_workout_field(message: types.Message, state: FSMContext, raw_state: str):
+    field = STATE_FIELDS[raw_state]
+    # В ответе на вопрос могут быть и другие поля, тогда о них уже не спрашиваем
+    found = parse_workout(message.text, expected=field)
+    if field not in found:
+        await message.reply(ERRORS[field])
         return
 
-    await state.update_data(pulse=pulse)
-    await message.answer('Сколько калорий было сожжено?')
-    await state.set_state(Tracking.burned_calories)
+    await state.update_data(**found)
+    await ask_next(message, state)
 
-@track_router.message(F.text, Tracking.burned_calories)
-async def process_burned_calories(message: types.Message, state: FSMContext):
-    calories = extract_number(message.text)
-    if not calories or not 0 < calories < 6000:
-        await message.reply("Пожалуйста, введите корректное количество сожженных калорий (0-6000).")
+async def ask_next(message: types.Message, state: FSMContext):
+    user_data = await state.get_data()
+    if "pace" not in user_data:
+        pace = derive_pace(user_data.get("distance"), user_data.get("time"))
+        if pace:
+            user_data["pace"] = pace
+            await state.update_data(pace=pace)
+
+    missing = next((field for field in FIELDS if field not in user_data), None)
+    if missing is not None:
+        await message.answer(QUESTIONS[missing])
+        await state.set_state(FIELD_STATES[missing])
         return
 
-    await state.update_data(calories=calories)
-    user_data = await state.get_data()
     await message.answer(f'Отличная работа! Вот ваши результаты:\n'
                          f'- Дистанция: {user_data["distance"]} километров\n'
-                         f'- Время: {user_data["time"]} минут\n'
+                         f'- Время: {format_duration(user_data["time"] * 60)}\n'
                          f'- Средний темп: {user_data["pace"]} км/ч\n'
                          f'- Средний пульс: {user_data["pulse"]} ударов/мин\n'
                          f'- Сожженные калории: {user_data["calories"]}\n\n'
@@ -154,20 +146,13 @@ async def confirm_tracking(callback_query: types.CallbackQuery, state: FSMContex
     await callback_query.answer()
     data = await state.get_data()
 
-    try:
-        df = pd.read_excel("user_tracking_data.xlsx")
-    except FileNotFoundError:
-        df = pd.DataFrame(columns=list(data.keys()))
-
-    new_row = pd.DataFrame([data])
-    df = pd.concat([df, new_row], ignore_index=True)
-
-    df.to_excel("user_tracking_data.xlsx", index=False)
+    # Дописываем одну запись в файл пользователя вместо перезаписи общей таблицы
+    await workout_store.append(data)
     await state.clear()
     await callback_query.message.answer("Данные успешно сохранены!")
 
 @track_router.callback_query(Tracking.confirmation, F.data == "no_track")
-async def reject_tracking(callback_query: types.CallbackQuery, state: FSMContext):
+async def reject_tracking(callback_query: types.CallbackQuery, state: FSMContext, bot: Bot):
     await callback_query.answer()
     data = await state.get_data()
     user_id = data.get("user_id")
@@ -177,5 +162,57 @@ async def reject_tracking(callback_query: types.CallbackQuery, state: FSMContext
 
     async with ChatActionSender.typing(bot=bot, chat_id=callback_query.message.chat.id):
         await asyncio.sleep(2)
-        await callback_query.message.answer('Какую дистанцию вы пробежали (в км)?')
+        await callback_query.message.answer(f'{QUESTIONS["distance"]}\n{ONE_MESSAGE_HINT}')
     await state.set_state(Tracking.distance)
+
+
+def format_track_summary(record: dict, splits: list) -> str:
+    lines = ['Тренировка из файла сохранена:',
+             f'- Дистанция: {record["distance"]} км',
+             f'- Время в движении: {format_duration(record["time"] * 60)}',
+             f'- Средний темп: {record["pace"]} км/ч ({format_duration(3600 / record["pace"])} мин/км)']
+    if record["pulse"]:
+        lines.append(f'- Пульс: средний {record["pulse"]}, максимальный {record["max_pulse"]} ударов/мин')
+    if record["calories"]:
+        lines.append(f'- Сожженные калории: около {record["calories"]}')
+    if splits:
+        lines.append('\nОтрезки по километрам:')
+        lines.extend(f'{number} км - {format_duration(split)}' for number, split in enumerate(splits, start=1))
+    return "\n".join(lines)
+
+@track_router.message(F.document)
+async def import_track_file(message: types.Message, state: FSMContext, bot: Bot):
+    document = message.document
+    extension = os.path.splitext(document.file_name or '')[1].lower()
+    if extension not in TRACK_EXTENSIONS:
+        await message.reply("Поддерживаются файлы тренировок в форматах .gpx и .tcx.")
+        return
+    if document.file_size and document.file_size > MAX_TRACK_FILE_SIZE:
+        await message.reply("Файл слишком большой, максимум 20 МБ.")
+        return
+
+    user_id = message.from_user.id
+    profile = profile_store.get(user_id) or {}
+    fd, path = tempfile.mkstemp(suffix=extension)
+    os.close(fd)
+    try:
+        async with ChatActionSender.typing(bot=bot, chat_id=message.chat.id):
+            # Файл скачивается на диск и разбирается в отдельном процессе, не блокируя бота
+            await bot.download(document, destination=path)
+            record = await track_importer.analyze(path, profile.get('weight'))
+    except TrackImportError as e:
+        await message.reply(str(e))
+        return
+    except Exception as e:
+        print(f"Error importing track file: {e}")
+        await message.reply("Не удалось прочитать файл тренировки.")
+        return
+    finally:
+        os.remove(path)
+
+    splits = record.pop("splits")
+    await workout_store.append({"user_id": user_id, **record})
+    # Файл заменяет ручной ввод, если пользователь был в середине /tracking
+    if await state.get_state() in Tracking:
+        await state.clear()
+    await message.answer(format_track_summary(record, splits))
@@ -0,0 +1,97 @@
+import asyncio
+import json
+import random
+import time
+from collections import defaultdict
+from typing import Dict, Optional
+
+from aiohttp import web
+
+# Заглушка GigaChat для нагрузочных тестов: выдаёт токен доступа и отвечает
+# на /chat/completions фиксированным текстом. Задержка до первого токена и
+# скорость генерации настраиваются, потоковый режим отдаёт ответ через SSE
+# так же, как настоящий API.
+
+ANSWER_WORD = "бег"
+
+
+class FakeGigaChat:
+    def __init__(self, latency: float = 1.0, jitter: float = 0.0, tokens: int = 200, tokens_per_second: float = 100):
+        self.latency = latency
+        self.jitter = jitter
+        self.tokens = tokens
+        self.tokens_per_second = tokens_per_second
+        self.base_url: Optional[str] = None
+        self.auth_url: Optional[str] = None
+        self._runner: Optional[web.AppRunner] = None
+
+        self.requests: Dict[str, int] = defaultdict(int)
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        app = web.Application()
+        app.router.add_post("/oauth", self._handle_auth)
+        app.router.add_post("/api/v1/chat/completions", self._handle_chat)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        host, port = self._runner.addresses[0][:2]
+        self.base_url = f"http://{host}:{port}/api/v1"
+        self.auth_url = f"http://{host}:{port}/oauth"
+        return self.base_url
+
+    async def close(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _handle_auth(self, request: web.Request) -> web.Response:
+        self.requests["oauth"] += 1
+        return web.json_response({"access_token": "bench", "expires_at": int((time.time() + 3600) * 1000)})
+
+    def _usage(self, body: dict) -> dict:
+        prompt_tokens = sum(len(str(message.get("content", "")).split()) for message in body.get("messages", []))
+        return {"prompt_tokens": prompt_tokens, "completion_tokens": self.tokens,
+                "total_tokens": prompt_tokens + self.tokens}
+
+    async def _handle_chat(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        stream = bool(body.get("stream"))
+        self.requests["stream" if stream else "invoke"] += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(max(self.latency + random.uniform(-self.jitter, self.jitter), 0))
+            if stream:
+                return await self._stream(request, body)
+            await asyncio.sleep(self.tokens / self.tokens_per_second)
+            return web.json_response({
+                "choices": [{"message": {"role": "assistant", "content": " ".join([ANSWER_WORD] * self.tokens)},
+                             "index": 0, "finish_reason": "stop"}],
+                "created": int(time.time()),
+                "model": body.get("model") or "GigaChat",
+                "object": "chat.completion",
+                "usage": self._usage(body),
+            })
+        finally:
+            self.in_flight -= 1
+
+    async def _stream(self, request: web.Request, body: dict) -> web.StreamResponse:
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        # Токены уходят пачками по 10, как примерно и делает настоящий API
+        chunk_tokens = 10
+        for sent in range(0, self.tokens, chunk_tokens):
+            count = min(chunk_tokens, self.tokens - sent)
+            await asyncio.sleep(count / self.tokens_per_second)
+            chunk = {
+                "choices": [{"delta": {"role": "assistant", "content": f"{ANSWER_WORD} " * count}, "index": 0}],
+                "created": int(time.time()),
+                "model": body.get("model") or "GigaChat",
+                "object": "chat.completion",
+            }
+            await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode())
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
@@ -0,0 +1,106 @@
+import asyncio
+import json
+import random
+import time
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from aiohttp import web
+
+# Заглушка Bot API для нагрузочных тестов. Принимает запросы бота по адресу
+# /bot<token>/<method>, отвечает правдоподобными объектами Telegram с заданной
+# задержкой и запоминает, сколько и каких сообщений ушло в каждый чат, чтобы
+# симулированные пользователи могли дождаться нужного ответа.
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+# Методы, которые возвращают отправленное сообщение
+MESSAGE_METHODS = {"sendmessage", "sendphoto", "senddocument", "editmessagetext", "editmessagereplymarkup"}
+
+
+class FakeTelegram:
+    def __init__(self, latency: float = 0.05, jitter: float = 0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.url: Optional[str] = None
+        self._runner: Optional[web.AppRunner] = None
+        self._message_ids: Dict[int, int] = defaultdict(int)
+        self._waiters: Dict[int, List[Tuple[str, asyncio.Future]]] = defaultdict(list)
+
+        self.requests: Dict[str, int] = defaultdict(int)
+        # Начала отправленных текстов, по ним в отчёте ищутся ответы об ошибках
+        self.texts: Counter = Counter()
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        app = web.Application(client_max_size=50 * 1024 * 1024)
+        app.router.add_post("/bot{token}/{method}", self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        host, port = self._runner.addresses[0][:2]
+        self.url = f"http://{host}:{port}"
+        return self.url
+
+    async def close(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def wait_for_text(self, chat_id: int, text: str) -> asyncio.Future:
+        # Срабатывает, когда в чат уйдёт сообщение, начинающееся с text
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[chat_id].append((text, future))
+        return future
+
+    def _notify(self, chat_id: int, text: str):
+        waiters = self._waiters.get(chat_id)
+        if not waiters:
+            return
+        for waiter in list(waiters):
+            prefix, future = waiter
+            if text.startswith(prefix):
+                waiters.remove(waiter)
+                if not future.done():
+                    future.set_result(time.perf_counter())
+        if not waiters:
+            del self._waiters[chat_id]
+
+    def _message(self, chat_id: int, data) -> dict:
+        self._message_ids[chat_id] += 1
+        message = {
+            "message_id": int(data.get("message_id") or self._message_ids[chat_id]),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_USER,
+        }
+        if "photo" in data:
+            file_id = f"photo-{chat_id}-{self._message_ids[chat_id]}"
+            message["photo"] = [{"file_id": file_id, "file_unique_id": file_id, "width": 640, "height": 480}]
+        if "document" in data:
+            file_id = f"document-{chat_id}-{self._message_ids[chat_id]}"
+            message["document"] = {"file_id": file_id, "file_unique_id": file_id, "file_name": "report.pdf"}
+        if "text" in data:
+            message["text"] = data["text"]
+        if "caption" in data:
+            message["caption"] = data["caption"]
+        return message
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"].lower()
+        data = await request.post()
+        self.requests[method] += 1
+        if self.latency or self.jitter:
+            await asyncio.sleep(max(self.latency + random.uniform(-self.jitter, self.jitter), 0))
+
+        if method == "getme":
+            result = BOT_USER
+        elif method in MESSAGE_METHODS:
+            chat_id = int(data.get("chat_id", 0))
+            result = self._message(chat_id, data)
+            text = result.get("text") or result.get("caption") or ""
+            if method.startswith("send"):
+                self.texts[text[:60]] += 1
+            self._notify(chat_id, text)
+        else:
+            # answerCallbackQuery, sendChatAction, setMyCommands, deleteWebhook и прочие
+            result = True
+        return web.json_response({"ok": True, "result": result}, dumps=json.dumps)
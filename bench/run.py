@@ -0,0 +1,346 @@
+import argparse
+import asyncio
+import importlib
+import itertools
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from bench.fake_gigachat import FakeGigaChat
+from bench.fake_telegram import FakeTelegram
+
+# Нагрузочный тест бота. Настоящие роутеры из main.py получают апдейты
+# симулированных пользователей, ответы уходят в заглушку Bot API, запросы к
+# модели - в заглушку GigaChat. Каждый пользователь проходит регистрацию,
+# запись тренировок, графики, вопросы к GigaChat и напоминания. Для каждого
+# сценария считается пропускная способность и задержка обработки апдейта
+# (p50/p95/p99), результаты дописываются в bench/results.jsonl (локальный файл, не в git).
+#
+# Запуск из корня репозитория:
+#   python -m bench.run --users 100 --llm-latency 2
+#
+# Настройки бота (OUTBOX_*, GPT_MAX_CONCURRENCY, RESPONSE_CACHE_* и т.д.)
+# берутся из окружения, как при обычном запуске.
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HISTORY_FILE = os.path.join(REPO_DIR, "bench", "results.jsonl")
+FLOWS = ("registration", "tracking", "quick_tracking", "charts", "gpt", "reminders")
+# Ответы бота, которые означают сбой обработки
+ERROR_REPLIES = ("Произошла непредвиденная ошибка", "GigaChat сейчас перегружен",
+                 "Ошибка:", "Не удалось", "Сейчас строится слишком много графиков",
+                 "Сейчас бот перегружен", "Слишком много сообщений подряд")
+USER_ID_BASE = 10_000_000
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота с заглушками Telegram и GigaChat")
+    parser.add_argument("--users", type=int, default=100, help="число одновременных пользователей")
+    parser.add_argument("--ramp-up", type=float, default=5.0, help="за сколько секунд подключаются все пользователи")
+    parser.add_argument("--think-time", type=float, default=0.5, help="средняя пауза пользователя между действиями, с")
+    parser.add_argument("--workouts", type=int, default=3, help="сколько тренировок записывает каждый пользователь")
+    parser.add_argument("--flows", default=",".join(FLOWS), help="сценарии через запятую")
+    parser.add_argument("--tg-latency", type=float, default=0.05, help="задержка ответа Bot API, с")
+    parser.add_argument("--llm-latency", type=float, default=1.0, help="задержка до первого токена GigaChat, с")
+    parser.add_argument("--llm-jitter", type=float, default=0.2, help="разброс задержки GigaChat, с")
+    parser.add_argument("--llm-tokens", type=int, default=200, help="длина ответа GigaChat в токенах")
+    parser.add_argument("--llm-tps", type=float, default=100.0, help="скорость генерации GigaChat, токенов/с")
+    parser.add_argument("--reminder-interval", type=int, default=3, help="интервал напоминаний, с")
+    parser.add_argument("--label", default="", help="метка запуска в истории (например, название ветки)")
+    parser.add_argument("--history", default=HISTORY_FILE, help="файл истории результатов")
+    parser.add_argument("--no-history", action="store_true", help="не записывать результат в историю")
+    parser.add_argument("--keep-data", action="store_true", help="не удалять рабочий каталог с данными бота")
+    return parser.parse_args(argv)
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.completed: Dict[str, int] = defaultdict(int)
+
+    def add(self, flow: str, seconds: float):
+        self.latencies[flow].append(seconds)
+
+    def report(self, duration: float) -> Dict[str, dict]:
+        result = {}
+        for flow in sorted(set(self.latencies) | set(self.errors)):
+            samples = np.array(self.latencies[flow]) * 1000
+            p50, p95, p99 = np.percentile(samples, [50, 95, 99]) if len(samples) else (0, 0, 0)
+            result[flow] = {
+                "updates": len(samples),
+                "completed": self.completed[flow],
+                "errors": self.errors[flow],
+                "throughput": round(len(samples) / duration, 2),
+                "p50_ms": round(float(p50), 1),
+                "p95_ms": round(float(p95), 1),
+                "p99_ms": round(float(p99), 1),
+            }
+        return result
+
+
+class SimulatedUser:
+    _update_ids = itertools.count(1)
+
+    def __init__(self, bench: "Bench", number: int):
+        self.bench = bench
+        self.user_id = USER_ID_BASE + number
+        self.user = {"id": self.user_id, "is_bot": False, "first_name": f"Бегун{number}", "language_code": "ru"}
+        self.chat = {"id": self.user_id, "type": "private"}
+        self._message_ids = itertools.count(1)
+
+    def _message(self, text: str) -> dict:
+        message = {"message_id": next(self._message_ids), "date": int(time.time()), "chat": self.chat,
+                   "from": self.user, "text": text}
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return message
+
+    async def _feed(self, flow: str, update: dict):
+        update["update_id"] = next(self._update_ids)
+        started = time.perf_counter()
+        try:
+            await self.bench.dp.feed_raw_update(self.bench.bot, update)
+            # Апдейт только встал в очередь чата, время считается до конца его обработки
+            await self.bench.main.update_scheduler.join(self.chat["id"])
+        except Exception as e:
+            self.bench.recorder.errors[flow] += 1
+            print(f"[{flow}] user {self.user_id}: {type(e).__name__}: {e}")
+            return
+        self.bench.recorder.add(flow, time.perf_counter() - started)
+
+    async def think(self):
+        if self.bench.args.think_time:
+            await asyncio.sleep(random.expovariate(1 / self.bench.args.think_time))
+
+    async def send(self, flow: str, text: str):
+        await self._feed(flow, {"message": self._message(text)})
+        await self.think()
+
+    async def press(self, flow: str, data: str):
+        bot_message = {"message_id": next(self._message_ids), "date": int(time.time()), "chat": self.chat,
+                       "from": {"id": 1, "is_bot": True, "first_name": "bench"}, "text": "..."}
+        await self._feed(flow, {"callback_query": {"id": str(next(self._update_ids)), "from": self.user,
+                                                   "chat_instance": str(self.user_id), "data": data,
+                                                   "message": bot_message}})
+        await self.think()
+
+    async def registration(self):
+        flow = "registration"
+        await self.send(flow, "/start")
+        await self.press(flow, "start_registration")
+        for answer in ("Бегун", str(random.randint(18, 60)), str(random.randint(50, 100)),
+                       str(random.randint(150, 200)), str(random.randint(1, 36)), "10", "3"):
+            await self.send(flow, answer)
+        await self.press(flow, "yes")
+
+    async def tracking(self):
+        flow = "tracking"
+        for _ in range(self.bench.args.workouts):
+            await self.send(flow, "/tracking")
+            # Темп бот считает сам по дистанции и времени
+            for answer in (random.randint(3, 21), random.randint(20, 120), random.randint(120, 180),
+                           random.randint(200, 1200)):
+                await self.send(flow, str(answer))
+            await self.press(flow, "yes_track")
+
+    async def quick_tracking(self):
+        # Вся тренировка одной командой и подтверждение
+        flow = "quick_tracking"
+        for _ in range(self.bench.args.workouts):
+            await self.send(flow, f"/tracking {random.randint(30, 210) / 10} км {random.randint(20, 90)}:{random.randint(0, 59):02d} "
+                                  f"пульс {random.randint(120, 180)} {random.randint(200, 1200)} ккал")
+            await self.press(flow, "yes_track")
+
+    async def charts(self):
+        flow = "charts"
+        await self.send(flow, "/report_achievements")
+        for text in ("График:\nдистанция/тренировки", "График:\nпульс/тренировки", "График:\nскорость/пульс",
+                     "Отчёт:\nвсе графики", "Отчёт:\nPDF"):
+            await self.send(flow, text)
+        await self.send(flow, "/stats")
+
+    async def gpt(self):
+        flow = "gpt"
+        await self.send(flow, "/get_equipment")
+        await self.send(flow, "/get_personal_training")
+        await self.press(flow, random.choice(("interval_training", "long_training", "speed_training")))
+        await self.send(flow, f"Как мне подготовиться к забегу на {random.randint(5, 42)} км?")
+
+    async def reminders(self):
+        flow = "reminders"
+        # Задержка доставки считается от момента, когда напоминание должно было уйти
+        delivered = self.bench.telegram.wait_for_text(self.chat["id"], self.bench.reminder_text)
+        await self._feed(flow, {"message": self._message("/start_reminders")})
+        due = time.perf_counter() + self.bench.args.reminder_interval
+        try:
+            arrived = await asyncio.wait_for(delivered, self.bench.args.reminder_interval + 60)
+            self.bench.recorder.add("reminder_delivery", max(arrived - due, 0))
+            self.bench.recorder.completed["reminder_delivery"] += 1
+        except asyncio.TimeoutError:
+            self.bench.recorder.errors["reminder_delivery"] += 1
+        await self.send(flow, "/stop_reminders")
+
+    async def run(self, flows: List[str]):
+        for flow in flows:
+            await getattr(self, flow)()
+            self.bench.recorder.completed[flow] += 1
+
+
+class Bench:
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.telegram = FakeTelegram(latency=args.tg_latency)
+        self.gigachat = FakeGigaChat(latency=args.llm_latency, jitter=args.llm_jitter, tokens=args.llm_tokens,
+                                     tokens_per_second=args.llm_tps)
+        self.recorder = Recorder()
+        self.workdir = tempfile.mkdtemp(prefix="bot-bench-")
+        self.main = None
+        self.reminder_text = ""
+
+    @property
+    def dp(self):
+        return self.main.dp
+
+    @property
+    def bot(self):
+        return self.main.bot
+
+    async def setup(self):
+        await self.telegram.start()
+        await self.gigachat.start()
+        os.environ.update({
+            "TOKEN_API": "123456:bench",
+            "ACCESS_TOKEN": "YmVuY2g6YmVuY2g=",
+            "TELEGRAM_API_URL": self.telegram.url,
+            "GIGACHAT_BASE_URL": self.gigachat.base_url,
+            "GIGACHAT_AUTH_URL": self.gigachat.auth_url,
+            "BOT_MODE": "polling",
+            "METRICS_PORT": "0",
+            "REMINDER_INTERVAL": str(self.args.reminder_interval),
+        })
+        os.environ.setdefault("REMINDER_TICK", "0.2")
+        # Бот пишет файлы данных в текущий каталог, поэтому работаем во временном
+        os.chdir(self.workdir)
+        if REPO_DIR not in sys.path:
+            sys.path.insert(0, REPO_DIR)
+        self.main = importlib.import_module("main")
+        self.reminder_text = importlib.import_module("handlers.reminder").REMINDER_TEXT
+        await self.main.start_services()
+
+    async def teardown(self):
+        await self.main.stop_services(None)
+        await self.dp.storage.close()
+        await self.telegram.close()
+        await self.gigachat.close()
+        os.chdir(REPO_DIR)
+        if not self.args.keep_data:
+            shutil.rmtree(self.workdir, ignore_errors=True)
+
+    async def _user(self, number: int, flows: List[str]):
+        await asyncio.sleep(random.uniform(0, self.args.ramp_up))
+        await SimulatedUser(self, number).run(flows)
+
+    async def run(self) -> dict:
+        flows = [flow.strip() for flow in self.args.flows.split(",") if flow.strip()]
+        unknown = set(flows) - set(FLOWS)
+        if unknown:
+            raise SystemExit(f"Неизвестные сценарии: {', '.join(sorted(unknown))}")
+        # Без регистрации остальные сценарии упираются в проверку профиля
+        if "registration" not in flows:
+            flows.insert(0, "registration")
+
+        await self.setup()
+        started = time.perf_counter()
+        try:
+            await asyncio.gather(*(self._user(number, flows) for number in range(self.args.users)))
+            duration = time.perf_counter() - started
+        finally:
+            await self.teardown()
+
+        error_replies = sum(count for text, count in self.telegram.texts.items() if text.startswith(ERROR_REPLIES))
+        return {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "label": self.args.label,
+            "config": {key: getattr(self.args, key) for key in (
+                "users", "ramp_up", "think_time", "workouts", "tg_latency", "llm_latency", "llm_jitter",
+                "llm_tokens", "llm_tps", "reminder_interval")},
+            "flows_run": flows,
+            "duration": round(duration, 2),
+            "flows": self.recorder.report(duration),
+            "error_replies": error_replies,
+            "telegram_requests": dict(self.telegram.requests),
+            "llm_requests": dict(self.gigachat.requests),
+            "llm_max_in_flight": self.gigachat.max_in_flight,
+            "updates": self.main.update_scheduler.stats(),
+        }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_previous(path: str, config: dict) -> Optional[dict]:
+    # Последний запуск с теми же параметрами нагрузки
+    if not os.path.exists(path):
+        return None
+    previous = None
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if entry.get("config") == config:
+                previous = entry
+    return previous
+
+
+def print_report(result: dict, previous: Optional[dict]):
+    config = result["config"]
+    print(f"\n{config['users']} пользователей, {result['duration']} с, коммит {result['commit'] or '-'}")
+    print(f"{'сценарий':<18}{'апдейтов':>9}{'готово':>8}{'ошибок':>8}{'в сек':>8}"
+          f"{'p50, мс':>10}{'p95, мс':>10}{'p99, мс':>10}")
+    for flow, stats in result["flows"].items():
+        line = (f"{flow:<18}{stats['updates']:>9}{stats['completed']:>8}{stats['errors']:>8}{stats['throughput']:>8}"
+                f"{stats['p50_ms']:>10}{stats['p95_ms']:>10}{stats['p99_ms']:>10}")
+        before = (previous or {}).get("flows", {}).get(flow)
+        if before and before["p95_ms"]:
+            change = (stats["p95_ms"] - before["p95_ms"]) / before["p95_ms"] * 100
+            line += f"   p95 {change:+.0f}% к {previous['commit'] or previous['timestamp']}"
+        print(line)
+    print(f"Ответов об ошибках: {result['error_replies']}")
+    print(f"Запросов к Bot API: {sum(result['telegram_requests'].values())}, "
+          f"к GigaChat: {result['llm_requests']}, одновременно до {result['llm_max_in_flight']}")
+    updates = result.get("updates")
+    if updates:
+        print(f"Очередь апдейтов: до {updates['max_queued']}, отброшено {updates['shed'] + updates['dropped']}, "
+              f"ошибок в хендлерах {updates['errors']}, ожидание до {updates['max_wait_seconds']} с")
+
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    result = asyncio.run(Bench(args).run())
+    previous = load_previous(args.history, result["config"])
+    print_report(result, previous)
+    if not args.no_history:
+        with open(args.history, "a", encoding="utf-8") as f:
+            f.write(json.dumps(result, ensure_ascii=False) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,7 @@ private = [
     BotCommand(command="start", description="о боте"),
     BotCommand(command="tracking", description="отслеживание прогресса"),
     BotCommand(command="report_achievements", description="прогресс в графиках"),
+    BotCommand(command="stats", description="сводная статистика тренировок"),
     BotCommand(command="clear", description="очищает историю запросов"),
     BotCommand(command="get_personal_training", description="создает персональную тренировку"),
     BotCommand(command="get_equipment", description="получить совет про экипировку"),
@@ -0,0 +1,56 @@
+import asyncio
+import os
+import ssl
+from typing import Optional
+
+import certifi
+from aiohttp import ClientSession, TCPConnector
+from aiohttp.hdrs import USER_AGENT
+from aiogram import Bot, __version__ as AIOGRAM_VERSION
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from common.outbox import outbox, OutboxMiddleware
+
+# Размер пула соединений к Bot API и сколько секунд держать простаивающее соединение открытым
+BOT_HTTP_POOL_SIZE = int(os.getenv("BOT_HTTP_POOL_SIZE", "100"))
+BOT_HTTP_KEEPALIVE = float(os.getenv("BOT_HTTP_KEEPALIVE", "60"))
+# Свой адрес Bot API (локальный сервер Bot API или заглушка из bench/), по умолчанию api.telegram.org
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
+
+
+class PooledSession(AiohttpSession):
+    # Сессия Bot API со своим пулом соединений. По умолчанию aiohttp закрывает
+    # соединение после 15 секунд простоя, здесь его держат keepalive_timeout
+    # секунд, чтобы не повторять TLS-рукопожатие между сообщениями
+    def __init__(self, limit: int = BOT_HTTP_POOL_SIZE, keepalive_timeout: float = BOT_HTTP_KEEPALIVE, **kwargs):
+        super().__init__(limit=limit, **kwargs)
+        self.limit = limit
+        self.keepalive_timeout = keepalive_timeout
+        self._client: Optional[ClientSession] = None
+
+    async def create_session(self) -> ClientSession:
+        if self._client is None or self._client.closed:
+            connector = TCPConnector(
+                limit=self.limit,
+                keepalive_timeout=self.keepalive_timeout,
+                ssl=ssl.create_default_context(cafile=certifi.where()),
+                ttl_dns_cache=3600,
+            )
+            self._client = ClientSession(connector=connector, headers={USER_AGENT: f"aiogram/{AIOGRAM_VERSION}"})
+        return self._client
+
+    async def close(self):
+        if self._client is not None and not self._client.closed:
+            await self._client.close()
+            # Даём SSL-соединениям закрыться, как это делает AiohttpSession
+            await asyncio.sleep(0.25)
+
+
+def create_bot(token: str) -> Bot:
+    if TELEGRAM_API_URL:
+        session = PooledSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL))
+    else:
+        session = PooledSession()
+    # Все отправки в чаты идут через общую очередь с ограничением скорости
+    session.middleware(OutboxMiddleware(outbox))
+    return Bot(token=token, session=session)
@@ -0,0 +1,92 @@
+import os
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+from common.metrics import register_collector
+
+# Кэш построенных графиков.
+# Ключ - пользователь и тип графика, запись хранит версию данных, на которых
+# график построен (номер последней тренировки). Пока версия не изменилась,
+# график не перерисовывается, а после первой отправки вместо байтов
+# повторно используется file_id, который вернул Telegram.
+
+CHART_CACHE_MAX_BYTES = int(os.getenv("CHART_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+CHART_CACHE_MAX_ENTRIES = int(os.getenv("CHART_CACHE_MAX_ENTRIES", "20000"))
+
+
+@dataclass
+class CachedChart:
+    version: int
+    png: Optional[bytes] = None
+    file_id: Optional[str] = None
+
+    @property
+    def size(self) -> int:
+        return len(self.png) if self.png else 0
+
+
+class ChartCache:
+    def __init__(self, max_bytes: int = CHART_CACHE_MAX_BYTES, max_entries: int = CHART_CACHE_MAX_ENTRIES):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[int, str], CachedChart]" = OrderedDict()
+        self.total_bytes = 0
+
+        self.hits = 0
+        self.file_id_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, user_id: int, chart_type: str, version: int) -> Optional[CachedChart]:
+        key = (user_id, chart_type)
+        entry = self._entries.get(key)
+        if entry is None or entry.version != version:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        if entry.file_id:
+            self.file_id_hits += 1
+        return entry
+
+    def has(self, user_id: int, chart_type: str, version: int) -> bool:
+        # Без учёта в счётчиках, для фоновой подготовки отчётов
+        entry = self._entries.get((user_id, chart_type))
+        return entry is not None and entry.version == version
+
+    def put(self, user_id: int, chart_type: str, version: int, png: bytes):
+        self._set((user_id, chart_type), CachedChart(version=version, png=png))
+
+    def set_file_id(self, user_id: int, chart_type: str, version: int, file_id: str):
+        key = (user_id, chart_type)
+        entry = self._entries.get(key)
+        if entry is None or entry.version != version:
+            return
+        # Картинка уже лежит на серверах Telegram, байты в памяти больше не нужны
+        self._set(key, CachedChart(version=version, file_id=file_id))
+
+    def _set(self, key: Tuple[int, str], entry: CachedChart):
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.total_bytes -= old.size
+        self._entries[key] = entry
+        self.total_bytes += entry.size
+        while self._entries and (self.total_bytes > self.max_bytes or len(self._entries) > self.max_entries):
+            _, evicted = self._entries.popitem(last=False)
+            self.total_bytes -= evicted.size
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "bytes": self.total_bytes,
+            "hits": self.hits,
+            "file_id_hits": self.file_id_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+chart_cache = ChartCache()
+register_collector("chart_cache", chart_cache.stats)
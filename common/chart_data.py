@@ -0,0 +1,146 @@
+import os
+from typing import TYPE_CHECKING, List, NamedTuple, Optional
+
+# Подготовка данных для графиков.
+# Пока тренировок немного, на графике каждая запись. Для длинной истории
+# записи с датами агрегируются по неделям, а если и недель слишком много -
+# по месяцам. Записи без даты (перенесённые из старой таблицы) в агрегацию
+# по времени не попадают: пока датированных записей большинство, они
+# агрегируются, а записи без даты только подсчитываются и упоминаются
+# в подписи оси. Если точек всё равно больше CHART_MAX_POINTS, линия
+# прореживается алгоритмом LTTB, который сохраняет форму графика (пики и
+# провалы). Плотное облако темп/пульс заменяется двумерной гистограммой,
+# посчитанной здесь же, поэтому в пул отрисовки уходит не больше
+# CHART_MAX_POINTS точек или сетка CHART_DENSITY_BINS x CHART_DENSITY_BINS
+# при любой длине истории.
+
+if TYPE_CHECKING:
+    import numpy as np
+    import pandas as pd
+
+# Выше этого числа записей график строится по неделям или месяцам
+CHART_RAW_POINTS = int(os.getenv("CHART_RAW_POINTS", "200"))
+# Предел точек на одной линии после агрегации
+CHART_MAX_POINTS = int(os.getenv("CHART_MAX_POINTS", "500"))
+# Выше этого числа точек вместо облака рисуется плотность
+CHART_SCATTER_MAX_POINTS = int(os.getenv("CHART_SCATTER_MAX_POINTS", "1000"))
+CHART_DENSITY_BINS = int(os.getenv("CHART_DENSITY_BINS", "30"))
+
+# Дистанция, время и калории за период складываются, темп и пульс усредняются
+AGGREGATIONS = {"distance": "sum", "time": "sum", "calories": "sum", "pace": "mean", "pulse": "mean"}
+# Правило resample, подпись оси и название периода
+PERIODS = (("W", "Неделя", "week"), ("MS", "Месяц", "month"))
+
+
+class LineSeries(NamedTuple):
+    x: list
+    y: list
+    xlabel: str
+    # workout - по тренировкам, week / month - агрегаты за период
+    period: str
+    # Линия прорежена LTTB
+    downsampled: bool = False
+    # Записи без даты, не попавшие на график по времени
+    undated: int = 0
+
+
+class DensityGrid(NamedTuple):
+    counts: List[List[float]]
+    x_edges: List[float]
+    y_edges: List[float]
+
+
+class ScatterSeries(NamedTuple):
+    x: list
+    y: list
+    density: Optional[DensityGrid] = None
+
+
+def lttb(x: "np.ndarray", y: "np.ndarray", threshold: int) -> "np.ndarray":
+    # Largest-Triangle-Three-Buckets: индексы threshold точек, лучше всего сохраняющих форму линии
+    import numpy as np
+
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    # Первая и последняя точки остаются, остальные делятся на threshold - 2 корзины
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int)
+    selected = np.empty(threshold, dtype=int)
+    selected[0], selected[-1] = 0, n - 1
+    previous = 0
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], max(edges[bucket + 1], edges[bucket] + 1)
+        next_start = edges[bucket + 1]
+        next_end = edges[bucket + 2] if bucket + 2 < len(edges) else n
+        next_x, next_y = x[next_start:next_end].mean(), y[next_start:next_end].mean()
+        # Площадь треугольника (предыдущая выбранная точка, кандидат, среднее следующей корзины)
+        area = np.abs((x[previous] - next_x) * (y[start:end] - y[previous])
+                      - (x[previous] - x[start:end]) * (next_y - y[previous]))
+        previous = start + int(area.argmax())
+        selected[bucket + 1] = previous
+    return selected
+
+
+def _timestamps(df: "pd.DataFrame") -> Optional["pd.Series"]:
+    # Даты записей (NaT у записей без даты), None - если датированных записей меньшинство
+    import pandas as pd
+
+    if "recorded_at" not in df:
+        return None
+    times = pd.to_datetime(df["recorded_at"], errors="coerce")
+    return times if times.notna().sum() * 2 >= len(times) else None
+
+
+def line_series(df: "pd.DataFrame", column: str) -> LineSeries:
+    import numpy as np
+    import pandas as pd
+
+    values = pd.to_numeric(df[column], errors="coerce") if column in df else pd.Series(np.nan, index=df.index)
+    if len(values) <= CHART_RAW_POINTS:
+        return LineSeries(list(range(1, len(values) + 1)), values.tolist(), "Тренировка", "workout")
+
+    times = _timestamps(df)
+    undated = 0
+    if times is not None:
+        dated = times.notna().to_numpy()
+        undated = int((~dated).sum())
+        series = pd.Series(values.to_numpy()[dated], index=pd.DatetimeIndex(times[dated])).sort_index()
+        how = AGGREGATIONS.get(column, "mean")
+        for rule, xlabel, period in PERIODS:
+            resampled = series.resample(rule).agg(how)
+            if how == "mean":
+                # Периоды без тренировок на графике среднего не показываются
+                resampled = resampled.dropna()
+            if len(resampled) <= CHART_RAW_POINTS:
+                break
+        x = resampled.index.to_pydatetime()
+        y = resampled.to_numpy(dtype=float)
+    else:
+        xlabel, period = "Тренировка", "workout"
+        x = np.arange(1, len(values) + 1)
+        y = values.to_numpy(dtype=float)
+
+    known = ~np.isnan(y)
+    x, y = x[known], y[known]
+    if len(y) <= CHART_MAX_POINTS:
+        return LineSeries(x.tolist(), y.tolist(), xlabel, period, undated=undated)
+    # Точки после агрегации идут с одинаковым шагом, поэтому для LTTB хватает их номеров
+    indices = lttb(np.arange(len(y), dtype=float), y, CHART_MAX_POINTS)
+    return LineSeries(x[indices].tolist(), y[indices].tolist(), xlabel, period, downsampled=True, undated=undated)
+
+
+def scatter_series(df: "pd.DataFrame", x_column: str, y_column: str) -> ScatterSeries:
+    import numpy as np
+    import pandas as pd
+
+    if x_column not in df or y_column not in df:
+        return ScatterSeries([], [])
+    x = pd.to_numeric(df[x_column], errors="coerce").to_numpy(dtype=float)
+    y = pd.to_numeric(df[y_column], errors="coerce").to_numpy(dtype=float)
+    known = ~(np.isnan(x) | np.isnan(y))
+    x, y = x[known], y[known]
+    if len(x) <= CHART_SCATTER_MAX_POINTS:
+        return ScatterSeries(x.tolist(), y.tolist())
+    counts, x_edges, y_edges = np.histogram2d(x, y, bins=CHART_DENSITY_BINS)
+    # pcolormesh ждёт строки по оси Y
+    return ScatterSeries([], [], DensityGrid(counts.T.tolist(), x_edges.tolist(), y_edges.tolist()))
@@ -0,0 +1,235 @@
+import asyncio
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from io import BytesIO
+from typing import Callable, List, Optional, Sequence
+
+from common.chart_data import LineSeries, ScatterSeries
+from common.metrics import CHART_RENDER_SECONDS, register_collector
+
+# Отрисовка графиков вне event loop.
+# Функции render_* строят картинку через явные Figure и холст Agg, без
+# глобального состояния pyplot, поэтому их можно безопасно запускать
+# параллельно в пуле процессов (по умолчанию) или потоков.
+# Matplotlib загружается только в воркерах пула и сразу с неинтерактивным
+# бэкендом Agg, без поиска GUI-бэкендов.
+
+CHART_WORKERS = int(os.getenv("CHART_WORKERS", str(os.cpu_count() or 2)))
+CHART_EXECUTOR = os.getenv("CHART_EXECUTOR", "process")
+# Сколько графиков может одновременно ждать отрисовки, остальные получают отказ
+CHART_MAX_PENDING = int(os.getenv("CHART_MAX_PENDING", "32"))
+# Сколько последних точек усредняется на графике трендов
+TREND_WINDOW = int(os.getenv("CHART_TREND_WINDOW", "3"))
+# Больше тренировок - подписи по оси X ставятся автоматически, а не у каждой
+MAX_XTICKS = int(os.getenv("CHART_MAX_XTICKS", "20"))
+DASHBOARD_SIZE = (12, 9)
+# Альбомный A4 в дюймах
+PDF_PAGE_SIZE = (11.69, 8.27)
+
+# Переменная окружения наследуется процессами пула
+os.environ.setdefault("MPLBACKEND", "Agg")
+
+
+class ChartQueueFull(Exception):
+    pass
+
+
+def _new_figure():
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    figure = Figure()
+    FigureCanvasAgg(figure)
+    return figure
+
+
+def _init_worker():
+    # Импорт при старте воркера, а не во время первого графика
+    import matplotlib
+    matplotlib.use("Agg")
+    _new_figure()
+
+
+def _to_png(figure) -> bytes:
+    buf = BytesIO()
+    figure.savefig(buf, format='png')
+    return buf.getvalue()
+
+
+def _period_title(title: str, series: LineSeries) -> str:
+    if series.period == "week":
+        return f"{title} (по неделям)"
+    if series.period == "month":
+        return f"{title} (по месяцам)"
+    return title
+
+
+def _draw_line(ax, series: LineSeries, ylabel: str, title: str):
+    ax.plot(series.x, series.y)
+    if series.undated:
+        ax.set_xlabel(f"{series.xlabel} (без даты и не показано: {series.undated})")
+    else:
+        ax.set_xlabel(series.xlabel)
+    ax.set_ylabel(ylabel)
+    # Подпись у каждой тренировки, пока их немного, дальше - автоматические деления
+    if series.period == "workout" and len(series.x) <= MAX_XTICKS:
+        ax.set_xticks(series.x)
+    if series.period != "workout":
+        ax.tick_params(axis="x", labelrotation=30)
+    ax.set_title(_period_title(title, series))
+    ax.grid(True)
+
+
+def _draw_scatter(ax, series: ScatterSeries, xlabel: str, ylabel: str, title: str):
+    if series.density is not None:
+        # Слишком много точек для облака - рисуем, сколько тренировок попало в каждую клетку
+        import numpy as np
+
+        counts = np.ma.masked_equal(np.array(series.density.counts), 0)
+        mesh = ax.pcolormesh(series.density.x_edges, series.density.y_edges, counts, cmap="viridis")
+        ax.figure.colorbar(mesh, ax=ax, label="Тренировок")
+    else:
+        ax.scatter(series.x, series.y, alpha=0.7)
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
+    ax.set_title(title)
+    ax.grid(True)
+
+
+def _moving_average(values: Sequence, window: int) -> List[float]:
+    # Среднее по последним window точкам, пропуски не учитываются
+    averages = []
+    for index in range(len(values)):
+        recent = [value for value in values[max(index - window + 1, 0):index + 1] if value == value]
+        averages.append(sum(recent) / len(recent) if recent else float("nan"))
+    return averages
+
+
+def _draw_trends(ax, distance: LineSeries, pace: LineSeries):
+    ax.plot(distance.x, _moving_average(distance.y, TREND_WINDOW), color="tab:blue", label="дистанция, км")
+    ax.set_xlabel(distance.xlabel)
+    ax.set_ylabel("Дистанция, км")
+    pace_ax = ax.twinx()
+    pace_ax.plot(pace.x, _moving_average(pace.y, TREND_WINDOW), color="tab:orange", label="темп, км/ч")
+    pace_ax.set_ylabel("Темп, км/ч")
+    ax.set_title(f"Тренды (скользящее среднее по {TREND_WINDOW} точкам)")
+    ax.grid(True)
+    ax.legend(handles=ax.get_lines() + pace_ax.get_lines(), loc="upper left")
+
+
+def _draw_dashboard(figure, distance: LineSeries, pulse: LineSeries, pace: LineSeries, scatter: ScatterSeries,
+                    title: str):
+    (distance_ax, pulse_ax), (scatter_ax, trends_ax) = figure.subplots(2, 2)
+    _draw_line(distance_ax, distance, "Дистанция, км", "Дистанция")
+    _draw_line(pulse_ax, pulse, "Пульс, уд/мин", "Пульс")
+    _draw_scatter(scatter_ax, scatter, "Скорость, км/ч", "Пульс, уд/мин", "Зависимость пульса от скорости")
+    _draw_trends(trends_ax, distance, pace)
+    figure.suptitle(title)
+    figure.tight_layout()
+
+
+def render_line_plot(series: LineSeries, ylabel: str, title: str) -> bytes:
+    figure = _new_figure()
+    _draw_line(figure.add_subplot(), series, ylabel, title)
+    return _to_png(figure)
+
+
+def render_scatter_plot(series: ScatterSeries, xlabel: str, ylabel: str, title: str) -> bytes:
+    figure = _new_figure()
+    _draw_scatter(figure.add_subplot(), series, xlabel, ylabel, title)
+    return _to_png(figure)
+
+
+def render_dashboard(distance: LineSeries, pulse: LineSeries, pace: LineSeries, scatter: ScatterSeries,
+                     title: str) -> bytes:
+    # Все графики на одной картинке
+    figure = _new_figure()
+    figure.set_size_inches(*DASHBOARD_SIZE)
+    _draw_dashboard(figure, distance, pulse, pace, scatter, title)
+    return _to_png(figure)
+
+
+def render_report_pdf(distance: LineSeries, pulse: LineSeries, pace: LineSeries, scatter: ScatterSeries,
+                      title: str, summary: Sequence[str]) -> bytes:
+    # Многостраничный отчёт: сводка, общая панель и каждый график на своей странице
+    from matplotlib.backends.backend_pdf import PdfPages
+
+    pages = []
+
+    cover = _new_figure()
+    cover.text(0.08, 0.9, title, fontsize=20, va="top")
+    cover.text(0.08, 0.8, "\n".join(summary), fontsize=13, va="top", linespacing=1.8)
+    pages.append(cover)
+
+    dashboard = _new_figure()
+    dashboard.set_size_inches(*PDF_PAGE_SIZE)
+    _draw_dashboard(dashboard, distance, pulse, pace, scatter, title)
+    pages.append(dashboard)
+
+    for draw in (
+        lambda ax: _draw_line(ax, distance, "Дистанция, км", "Дистанция/тренировки"),
+        lambda ax: _draw_line(ax, pulse, "Пульс, уд/мин", "Пульс/тренировки"),
+        lambda ax: _draw_scatter(ax, scatter, "Скорость, км/ч", "Пульс, уд/мин", "Зависимость пульса от скорости"),
+        lambda ax: _draw_trends(ax, distance, pace),
+    ):
+        page = _new_figure()
+        draw(page.add_subplot())
+        pages.append(page)
+
+    buf = BytesIO()
+    with PdfPages(buf) as pdf:
+        for page in pages:
+            page.set_size_inches(*PDF_PAGE_SIZE)
+            pdf.savefig(page)
+    return buf.getvalue()
+
+
+class ChartRenderer:
+    def __init__(self, workers: int = CHART_WORKERS, executor_kind: str = CHART_EXECUTOR,
+                 max_pending: int = CHART_MAX_PENDING):
+        self.workers = workers
+        self.executor_kind = executor_kind
+        self.max_pending = max_pending
+        self._executor: Optional[Executor] = None
+        self.pending = 0
+        self.rendered = 0
+        self.rejected = 0
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if self.executor_kind == "thread":
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, initializer=_init_worker)
+            else:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker)
+        return self._executor
+
+    async def render(self, func: Callable[..., bytes], *args) -> bytes:
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise ChartQueueFull()
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            with CHART_RENDER_SECONDS.time(chart=func.__name__):
+                png = await loop.run_in_executor(self._get_executor(), func, *args)
+        finally:
+            self.pending -= 1
+        self.rendered += 1
+        return png
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "pending": self.pending,
+            "rendered": self.rendered,
+            "rejected": self.rejected,
+        }
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+chart_renderer = ChartRenderer()
+register_collector("chart_renderer", chart_renderer.stats)
@@ -0,0 +1,206 @@
+import asyncio
+import ast
+import json
+import os
+from typing import Dict, List, Optional
+
+from common.metrics import STORAGE_SECONDS
+from common.workers import owns, shard_path
+
+# Хранилище истории диалогов с GigaChat.
+# Горячие истории лежат в памяти, каждое изменение дописывается одной строкой
+# в журнал (append-only), а фоновая задача периодически сворачивает журнал
+# в снапшот. Старый user_data.xlsx импортируется один раз при первом запуске.
+
+SNAPSHOT_FILE = shard_path("user_data.snapshot.json")
+JOURNAL_FILE = shard_path("user_data.journal")
+LEGACY_EXCEL_FILE = "user_data.xlsx"
+MEMORY_COLUMN = "memory"
+USER_ID_COLUMN = "user_id"
+
+# Как часто (в секундах) журнал сворачивается в снапшот
+COMPACT_INTERVAL = int(os.getenv("HISTORY_COMPACT_INTERVAL", "60"))
+
+
+def _read_legacy_excel(path: str) -> Dict[int, list]:
+    import pandas as pd
+
+    df = pd.read_excel(path, index_col=USER_ID_COLUMN, engine="openpyxl")
+    # В xlsx история хранилась как repr списка, поэтому читаем её через literal_eval, а не eval
+    return {
+        int(user_id): ast.literal_eval(memory_str)
+        for user_id, memory_str in df[MEMORY_COLUMN].items()
+    }
+
+
+def _write_snapshot(path: str, snapshot: dict):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(snapshot, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class ConversationStore:
+    def __init__(self, snapshot_path: str = SNAPSHOT_FILE, journal_path: str = JOURNAL_FILE,
+                 legacy_excel_path: str = LEGACY_EXCEL_FILE):
+        self.snapshot_path = snapshot_path
+        self.journal_path = journal_path
+        self.legacy_excel_path = legacy_excel_path
+        self._histories: Dict[int, List[dict]] = {}
+        self._summaries: Dict[int, dict] = {}
+        self._seq = 0
+        self._journal = None
+        self._journal_records = 0
+        self._loaded = False
+        self._compact_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def _rotated_journal_path(self) -> str:
+        return self.journal_path + ".old"
+
+    def load(self):
+        if self._loaded:
+            return
+
+        snapshot_seq = 0
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, encoding="utf-8") as f:
+                snapshot = json.load(f)
+            snapshot_seq = snapshot["seq"]
+            self._histories = {int(user_id): history for user_id, history in snapshot["users"].items()}
+            self._summaries = {int(user_id): summary for user_id, summary in snapshot.get("summaries", {}).items()}
+        elif os.path.exists(self.legacy_excel_path):
+            self._histories = {user_id: history for user_id, history in _read_legacy_excel(self.legacy_excel_path).items()
+                               if owns(user_id)}
+        self._seq = snapshot_seq
+
+        # Журнал после неудачного сворачивания (.old) старше текущего, проигрываем его первым
+        for path in (self._rotated_journal_path, self.journal_path):
+            if os.path.exists(path):
+                self._replay(path, snapshot_seq)
+
+        self._journal = open(self.journal_path, "a", encoding="utf-8")
+        self._loaded = True
+
+    def _replay(self, path: str, snapshot_seq: int):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # Недописанная последняя строка после аварийного завершения
+                    continue
+                if record["seq"] <= snapshot_seq:
+                    continue
+                self._apply(record)
+                self._seq = max(self._seq, record["seq"])
+                self._journal_records += 1
+
+    def _apply(self, record: dict):
+        user_id = record["user_id"]
+        if record["op"] == "append":
+            self._histories.setdefault(user_id, []).extend(record["messages"])
+        elif record["op"] == "clear":
+            self._histories[user_id] = []
+            self._summaries.pop(user_id, None)
+        elif record["op"] == "fold":
+            # Первые count сообщений заменяются сводкой
+            self._histories[user_id] = self._histories.get(user_id, [])[record["count"]:]
+            self._summaries[user_id] = record["summary"]
+
+    def _write(self, record: dict):
+        self._seq += 1
+        record["seq"] = self._seq
+        with STORAGE_SECONDS.time(store="conversations", operation="append"):
+            self._journal.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._journal.flush()
+        self._journal_records += 1
+
+    def get(self, user_id: int) -> List[dict]:
+        self.load()
+        return list(self._histories.get(user_id, []))
+
+    def append(self, user_id: int, messages: List[dict]):
+        self.load()
+        record = {"op": "append", "user_id": user_id, "messages": messages}
+        self._apply(record)
+        self._write(record)
+
+    def get_summary(self, user_id: int) -> Optional[dict]:
+        self.load()
+        return self._summaries.get(user_id)
+
+    def fold(self, user_id: int, messages: List[dict], summary: dict) -> bool:
+        # Сворачиваем начало истории, только если оно не изменилось с момента,
+        # когда по нему строилась сводка (например, пользователь не делал /clear)
+        self.load()
+        history = self._histories.get(user_id, [])
+        if history[:len(messages)] != messages:
+            return False
+        record = {"op": "fold", "user_id": user_id, "count": len(messages), "summary": summary}
+        self._apply(record)
+        self._write(record)
+        return True
+
+    def clear(self, user_id: int):
+        self.load()
+        if not self._histories.get(user_id) and user_id not in self._summaries:
+            return
+        record = {"op": "clear", "user_id": user_id}
+        self._apply(record)
+        self._write(record)
+
+    async def compact(self):
+        async with self._compact_lock:
+            if not self._loaded or not self._journal_records:
+                return
+
+            # Переключаем запись на новый журнал, старый удалим после записи снапшота
+            self._journal.close()
+            rotated = self._rotated_journal_path
+            if os.path.exists(rotated):
+                with open(self.journal_path, encoding="utf-8") as src, open(rotated, "a", encoding="utf-8") as dst:
+                    dst.write(src.read())
+                os.remove(self.journal_path)
+            else:
+                os.replace(self.journal_path, rotated)
+            self._journal = open(self.journal_path, "a", encoding="utf-8")
+            self._journal_records = 0
+
+            snapshot = {
+                "seq": self._seq,
+                "users": {str(user_id): list(history) for user_id, history in self._histories.items()},
+                "summaries": {str(user_id): summary for user_id, summary in self._summaries.items()},
+            }
+            with STORAGE_SECONDS.time(store="conversations", operation="compact"):
+                await asyncio.to_thread(_write_snapshot, self.snapshot_path, snapshot)
+            os.remove(rotated)
+
+    async def _compact_periodically(self):
+        while True:
+            await asyncio.sleep(COMPACT_INTERVAL)
+            try:
+                await self.compact()
+            except Exception as e:
+                print(f"Error compacting conversation history: {e}")
+
+    async def start(self):
+        await asyncio.to_thread(self.load)
+        if self._task is None:
+            self._task = asyncio.create_task(self._compact_periodically())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.compact()
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+            self._loaded = False
+
+
+conversation_store = ConversationStore()
@@ -0,0 +1,96 @@
+import asyncio
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Iterable, Optional
+
+from common.metrics import register_collector
+
+# Еженедельная подготовка отчётов в часы низкой нагрузки.
+# Раз в неделю (по умолчанию в понедельник в 4 утра) для каждого активного
+# пользователя заранее строятся отчёты, чтобы утренние запросы отдавались
+# из кэша. Пользователи обрабатываются по DIGEST_CONCURRENCY за раз, чтобы
+# подготовка не занимала весь пул отрисовки. Готовые отчёты пишутся на диск
+# (common/report_store.py) и только для пользователей, записывавших
+# тренировки в последние DIGEST_ACTIVE_DAYS дней.
+
+DIGEST_ENABLED = os.getenv("DIGEST_ENABLED", "1") == "1"
+# 0 - понедельник, 6 - воскресенье
+DIGEST_WEEKDAY = int(os.getenv("DIGEST_WEEKDAY", "0"))
+DIGEST_HOUR = int(os.getenv("DIGEST_HOUR", "4"))
+DIGEST_CONCURRENCY = int(os.getenv("DIGEST_CONCURRENCY", "2"))
+DIGEST_ACTIVE_DAYS = int(os.getenv("DIGEST_ACTIVE_DAYS", "30"))
+
+
+def next_run(now: datetime, weekday: int = DIGEST_WEEKDAY, hour: int = DIGEST_HOUR) -> datetime:
+    run_at = now.replace(hour=hour, minute=0, second=0, microsecond=0) + timedelta(days=(weekday - now.weekday()) % 7)
+    if run_at <= now:
+        run_at += timedelta(days=7)
+    return run_at
+
+
+class WeeklyDigest:
+    def __init__(self, weekday: int = DIGEST_WEEKDAY, hour: int = DIGEST_HOUR, concurrency: int = DIGEST_CONCURRENCY):
+        self.weekday = weekday
+        self.hour = hour
+        self.concurrency = concurrency
+        self._users: Optional[Callable[[], Awaitable[Iterable[int]]]] = None
+        self._job: Optional[Callable[[int], Awaitable[None]]] = None
+        self._task: Optional[asyncio.Task] = None
+        self.next_run: Optional[datetime] = None
+
+        self.runs = 0
+        self.prepared = 0
+        self.failed = 0
+        self.last_duration = 0.0
+
+    async def start(self, users: Callable[[], Awaitable[Iterable[int]]], job: Callable[[int], Awaitable[None]]):
+        # users - список пользователей для подготовки, job - подготовка отчётов одного пользователя
+        self._users = users
+        self._job = job
+        if self._task is None:
+            self._task = asyncio.create_task(self._run_weekly())
+
+    async def run_once(self):
+        started = time.perf_counter()
+        user_ids = iter(await self._users())
+
+        async def worker():
+            for user_id in user_ids:
+                try:
+                    await self._job(user_id)
+                    self.prepared += 1
+                except Exception as e:
+                    self.failed += 1
+                    print(f"Error preparing digest for user {user_id}: {e}")
+
+        await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+        self.runs += 1
+        self.last_duration = time.perf_counter() - started
+
+    async def _run_weekly(self):
+        while True:
+            self.next_run = next_run(datetime.now(), self.weekday, self.hour)
+            await asyncio.sleep((self.next_run - datetime.now()).total_seconds())
+            try:
+                await self.run_once()
+            except Exception as e:
+                print(f"Error in weekly digest: {e}")
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "runs": self.runs,
+            "prepared": self.prepared,
+            "failed": self.failed,
+            "last_duration_seconds": round(self.last_duration, 3),
+            "next_run_in_seconds": round((self.next_run - datetime.now()).total_seconds()) if self.next_run else 0,
+        }
+
+
+weekly_digest = WeeklyDigest()
+register_collector("digest", weekly_digest.stats)
@@ -0,0 +1,77 @@
+import asyncio
+import json
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Mapping, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+from common.metrics import STORAGE_SECONDS
+
+# Хранилище состояний FSM (регистрация, запись тренировки) в SQLite.
+# В отличие от MemoryStorage состояние переживает перезапуск бота, а базу
+# могут одновременно открывать несколько процессов-воркеров.
+
+FSM_DB = os.getenv("FSM_DB", "fsm.db")
+
+
+class SQLiteStorage(BaseStorage):
+    def __init__(self, path: str = FSM_DB):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        # Соединение используется только из этого потока
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fsm-db")
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS fsm ("
+                "key TEXT PRIMARY KEY, state TEXT, data TEXT NOT NULL DEFAULT '{}')"
+            )
+            self._conn.commit()
+        return self._conn
+
+    async def _call(self, operation: str, func: Callable, *args) -> Any:
+        with STORAGE_SECONDS.time(store="fsm", operation=operation):
+            return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        return ":".join(str(part) for part in (
+            key.bot_id, key.chat_id, key.user_id, key.thread_id, key.business_connection_id, key.destiny,
+        ))
+
+    def _write(self, column: str, key: str, value: Optional[str]):
+        conn = self._connect()
+        conn.execute("INSERT OR IGNORE INTO fsm (key) VALUES (?)", (key,))
+        conn.execute(f"UPDATE fsm SET {column} = ? WHERE key = ?", (value, key))
+        # После state.clear() строка пустая, не храним её
+        conn.execute("DELETE FROM fsm WHERE key = ? AND state IS NULL AND data = '{}'", (key,))
+        conn.commit()
+
+    def _read(self, column: str, key: str) -> Optional[str]:
+        row = self._connect().execute(f"SELECT {column} FROM fsm WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        value = state.state if isinstance(state, State) else state
+        await self._call("write", self._write, "state", self._key(key), value)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return await self._call("read", self._read, "state", self._key(key))
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        await self._call("write", self._write, "data", self._key(key), json.dumps(dict(data), ensure_ascii=False))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        value = await self._call("read", self._read, "data", self._key(key))
+        return json.loads(value) if value else {}
+
+    async def close(self) -> None:
+        if self._conn is not None:
+            await asyncio.get_running_loop().run_in_executor(self._executor, self._conn.close)
+            self._conn = None
@@ -0,0 +1,113 @@
+import asyncio
+import os
+from typing import Awaitable, Callable, Dict, List, Tuple
+
+from common.conversation_store import ConversationStore
+
+# Окно истории для промпта: в запрос уходят только последние сообщения,
+# укладывающиеся в бюджет токенов, а всё, что старше, фоновой задачей
+# сворачивается в короткую сводку, которая подставляется в системный промпт.
+
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "3000"))
+# Сводка перегенерируется, когда за окном накопилось столько токенов
+HISTORY_SUMMARY_BATCH_TOKENS = int(os.getenv("HISTORY_SUMMARY_BATCH_TOKENS", "500"))
+# Грубая оценка для русского текста; точный подсчёт потребовал бы отдельного запроса к API
+CHARS_PER_TOKEN = float(os.getenv("HISTORY_CHARS_PER_TOKEN", "3"))
+
+# (предыдущая сводка или "", сворачиваемые сообщения) -> новая сводка
+Summarizer = Callable[[str, List[dict]], Awaitable[str]]
+
+
+def estimate_tokens(text: str) -> int:
+    return int(len(text) / CHARS_PER_TOKEN) + 1
+
+
+def _message_tokens(message: dict) -> int:
+    return estimate_tokens(message["content"])
+
+
+def split_history(history: List[dict], budget: int) -> int:
+    # Возвращает индекс, с которого начинается окно
+    start = len(history)
+    used = 0
+    while start > 0:
+        tokens = _message_tokens(history[start - 1])
+        if used + tokens > budget:
+            break
+        used += tokens
+        start -= 1
+    # Окно не должно начинаться с ответа ассистента без вопроса пользователя
+    while start < len(history) and history[start]["role"] != "user":
+        start += 1
+    return start
+
+
+class HistoryWindow:
+    def __init__(self, store: ConversationStore, summarize: Summarizer,
+                 token_budget: int = HISTORY_TOKEN_BUDGET,
+                 summary_batch_tokens: int = HISTORY_SUMMARY_BATCH_TOKENS):
+        self.store = store
+        self.summarize = summarize
+        self.token_budget = token_budget
+        self.summary_batch_tokens = summary_batch_tokens
+        self._tasks: Dict[int, asyncio.Task] = {}
+
+        self.requests = 0
+        self.full_history_tokens = 0
+        self.prompt_history_tokens = 0
+        self.summaries_generated = 0
+        self.summary_errors = 0
+
+    def build(self, user_id: int) -> Tuple[str, List[dict]]:
+        history = self.store.get(user_id)
+        summary = self.store.get_summary(user_id)
+        summary_text = summary["content"] if summary else ""
+        summary_tokens = estimate_tokens(summary_text) if summary_text else 0
+
+        start = split_history(history, max(self.token_budget - summary_tokens, 0))
+        window = history[start:]
+        overflow = history[:start]
+
+        history_tokens = sum(_message_tokens(message) for message in history)
+        window_tokens = sum(_message_tokens(message) for message in window)
+        folded_tokens = summary["folded_tokens"] if summary else 0
+        self.requests += 1
+        self.full_history_tokens += folded_tokens + history_tokens
+        self.prompt_history_tokens += summary_tokens + window_tokens
+
+        if overflow and history_tokens - window_tokens >= self.summary_batch_tokens:
+            self._schedule_summary(user_id, overflow, summary_text, folded_tokens)
+        return summary_text, window
+
+    def _schedule_summary(self, user_id: int, overflow: List[dict], summary_text: str, folded_tokens: int):
+        if user_id in self._tasks:
+            return
+        self._tasks[user_id] = asyncio.create_task(
+            self._fold(user_id, overflow, summary_text, folded_tokens))
+
+    async def _fold(self, user_id: int, overflow: List[dict], summary_text: str, folded_tokens: int):
+        try:
+            new_summary = await self.summarize(summary_text, overflow)
+            self.store.fold(user_id, overflow, {
+                "content": new_summary,
+                "folded_tokens": folded_tokens + sum(_message_tokens(message) for message in overflow),
+            })
+            self.summaries_generated += 1
+        except Exception as e:
+            self.summary_errors += 1
+            print(f"Error summarizing history for user {user_id}: {e}")
+        finally:
+            self._tasks.pop(user_id, None)
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "full_history_tokens": self.full_history_tokens,
+            "prompt_history_tokens": self.prompt_history_tokens,
+            "saved_tokens": self.full_history_tokens - self.prompt_history_tokens,
+            "saved_tokens_per_request": (
+                (self.full_history_tokens - self.prompt_history_tokens) / self.requests if self.requests else 0.0
+            ),
+            "summaries_generated": self.summaries_generated,
+            "summary_errors": self.summary_errors,
+        }
@@ -0,0 +1,173 @@
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from typing import AsyncIterator, Awaitable, Callable, List, Optional, Tuple, TypeVar
+
+from common.metrics import LLM_QUEUE_SECONDS, LLM_SECONDS, register_collector
+
+# Общий пул запросов к LLM: ограничивает число одновременных генераций
+# на весь бот, чтобы медленный GigaChat не забирал все соединения и память,
+# и ведёт счётчики очереди и ожидания. Интерактивные запросы всегда идут
+# из очереди первыми, а фоновые занимают не больше BACKGROUND_CONCURRENCY слотов.
+
+T = TypeVar("T")
+
+MAX_CONCURRENCY = int(os.getenv("GPT_MAX_CONCURRENCY", "4"))
+# Таймаут на саму генерацию и на ожидание свободного слота (в секундах)
+REQUEST_TIMEOUT = float(os.getenv("GPT_REQUEST_TIMEOUT", "60"))
+QUEUE_TIMEOUT = float(os.getenv("GPT_QUEUE_TIMEOUT", "120"))
+BACKGROUND_CONCURRENCY = int(os.getenv("GPT_BACKGROUND_CONCURRENCY", str(max(MAX_CONCURRENCY // 2, 1))))
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+
+
+class LLMPool:
+    def __init__(self, max_concurrency: int = MAX_CONCURRENCY, request_timeout: float = REQUEST_TIMEOUT,
+                 queue_timeout: float = QUEUE_TIMEOUT, background_concurrency: int = BACKGROUND_CONCURRENCY):
+        self.max_concurrency = max_concurrency
+        self.request_timeout = request_timeout
+        self.queue_timeout = queue_timeout
+        self.background_concurrency = min(background_concurrency, max_concurrency)
+        # Ожидающие слота: (приоритет, порядковый номер, future)
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._active = 0
+        self._background_active = 0
+
+        self.queue_depth = 0
+        self.in_flight = 0
+        self.background_in_flight = 0
+        self.completed = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.queue_timeouts = 0
+        self.total_wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    def _can_start(self, priority: int) -> bool:
+        if self._active >= self.max_concurrency:
+            return False
+        return priority == PRIORITY_INTERACTIVE or self._background_active < self.background_concurrency
+
+    def _take(self, priority: int):
+        self._active += 1
+        self.in_flight += 1
+        if priority != PRIORITY_INTERACTIVE:
+            self._background_active += 1
+            self.background_in_flight += 1
+
+    def _dispatch(self):
+        # Отдаём освободившиеся слоты ожидающим в порядке приоритета
+        while self._waiters:
+            priority, _, future = self._waiters[0]
+            if future.done():
+                heapq.heappop(self._waiters)
+                continue
+            if not self._can_start(priority):
+                return
+            heapq.heappop(self._waiters)
+            self._take(priority)
+            future.set_result(None)
+
+    async def _acquire(self, priority: int):
+        started = time.monotonic()
+        queued_ahead = self._waiters and self._waiters[0][0] <= priority
+        if not queued_ahead and self._can_start(priority):
+            self._take(priority)
+        else:
+            future = asyncio.get_running_loop().create_future()
+            heapq.heappush(self._waiters, (priority, next(self._seq), future))
+            self.queue_depth += 1
+            try:
+                await asyncio.wait_for(asyncio.shield(future), self.queue_timeout)
+            except BaseException as e:
+                if future.done():
+                    # Слот выдан в момент отмены, возвращаем его
+                    self._release(priority, completed=False)
+                else:
+                    future.cancel()
+                if isinstance(e, asyncio.TimeoutError):
+                    self.queue_timeouts += 1
+                raise
+            finally:
+                self.queue_depth -= 1
+        waited = time.monotonic() - started
+        LLM_QUEUE_SECONDS.observe(waited)
+        self.total_wait_time += waited
+        self.max_wait_time = max(self.max_wait_time, waited)
+
+    def _release(self, priority: int, completed: bool = True):
+        self._active -= 1
+        self.in_flight -= 1
+        if priority != PRIORITY_INTERACTIVE:
+            self._background_active -= 1
+            self.background_in_flight -= 1
+        if completed:
+            self.completed += 1
+        self._dispatch()
+
+    async def run(self, coro_factory: Callable[[], Awaitable[T]], timeout: Optional[float] = None,
+                  priority: int = PRIORITY_INTERACTIVE) -> T:
+        await self._acquire(priority)
+        try:
+            with LLM_SECONDS.time(kind="invoke"):
+                return await asyncio.wait_for(coro_factory(), timeout or self.request_timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise
+        except Exception:
+            self.errors += 1
+            raise
+        finally:
+            self._release(priority)
+
+    async def stream(self, agen_factory: Callable[[], AsyncIterator[T]],
+                     timeout: Optional[float] = None, priority: int = PRIORITY_INTERACTIVE) -> AsyncIterator[T]:
+        # Слот занят на всё время потоковой генерации, таймаут общий на весь поток
+        await self._acquire(priority)
+        started = time.monotonic()
+        deadline = started + (timeout or self.request_timeout)
+        agen = agen_factory()
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise asyncio.TimeoutError()
+                try:
+                    chunk = await asyncio.wait_for(agen.__anext__(), remaining)
+                except StopAsyncIteration:
+                    break
+                yield chunk
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise
+        except Exception:
+            self.errors += 1
+            raise
+        finally:
+            LLM_SECONDS.observe(time.monotonic() - started, kind="stream")
+            try:
+                await agen.aclose()
+            finally:
+                self._release(priority)
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "queue_depth": self.queue_depth,
+            "in_flight": self.in_flight,
+            "background_in_flight": self.background_in_flight,
+            "completed": self.completed,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "queue_timeouts": self.queue_timeouts,
+            "total_wait_time": self.total_wait_time,
+            "max_wait_time": self.max_wait_time,
+        }
+
+
+llm_pool = LLMPool()
+register_collector("llm_pool", llm_pool.stats)
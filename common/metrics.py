@@ -0,0 +1,221 @@
+import os
+import time
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Sequence, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+# Метрики в формате Prometheus без внешних зависимостей.
+# Счётчики и гистограммы обновляются в коде, а статистика хранилищ и пулов
+# (их методы stats()) собирается в момент запроса. Всё отдаётся по HTTP
+# на METRICS_HOST:METRICS_PORT/metrics.
+
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class _Metric:
+    type_name = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels: Dict[str, Any]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                for key, value in self._values.items()]
+
+
+class Gauge(Counter):
+    type_name = "gauge"
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        self._counts: Dict[LabelValues, List[int]] = {}
+        self._sums: Dict[LabelValues, float] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        counts = self._counts.get(key)
+        if counts is None:
+            counts = self._counts[key] = [0] * len(self.buckets)
+            self._sums[key] = 0.0
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[index] += 1
+                break
+        self._sums[key] += value
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self) -> List[str]:
+        lines = []
+        for key, counts in self._counts.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(self._sums[key])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Tuple[str, Callable[[], Dict[str, float]]]] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, prefix: str, collect: Callable[[], Dict[str, float]]):
+        # Каждое числовое поле из stats() становится отдельной метрикой <prefix>_<поле>
+        self._collectors.append((prefix, collect))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.header())
+            lines.extend(metric.samples())
+        for prefix, collect in self._collectors:
+            try:
+                stats = collect()
+            except Exception as e:
+                print(f"Error collecting {prefix} metrics: {e}")
+                continue
+            for key, value in stats.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    name = f"bot_{prefix}_{key}"
+                    lines.append(f"# TYPE {name} untyped")
+                    lines.append(f"{name} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+def register_collector(prefix: str, collect: Callable[[], Dict[str, float]]):
+    registry.register_collector(prefix, collect)
+
+
+HANDLER_SECONDS = registry.register(Histogram(
+    "bot_handler_seconds", "Время обработки апдейта хендлером", ("router", "handler")))
+HANDLER_ERRORS = registry.register(Counter(
+    "bot_handler_errors_total", "Исключения, вылетевшие из хендлеров", ("router", "handler")))
+HANDLER_IN_FLIGHT = registry.register(Gauge(
+    "bot_handler_in_flight", "Апдейты, которые сейчас обрабатываются", ("router", "handler")))
+LLM_SECONDS = registry.register(Histogram(
+    "bot_llm_request_seconds", "Длительность запросов к GigaChat без ожидания в очереди", ("kind",)))
+LLM_QUEUE_SECONDS = registry.register(Histogram(
+    "bot_llm_queue_wait_seconds", "Ожидание свободного слота в пуле GigaChat"))
+STORAGE_SECONDS = registry.register(Histogram(
+    "bot_storage_seconds", "Операции чтения и записи хранилищ", ("store", "operation")))
+CHART_RENDER_SECONDS = registry.register(Histogram(
+    "bot_chart_render_seconds", "Отрисовка графика в пуле воркеров", ("chart",)))
+UPDATE_QUEUE_SECONDS = registry.register(Histogram(
+    "bot_update_queue_wait_seconds", "Ожидание апдейта в очереди планировщика", ("priority",)))
+
+
+class MetricsMiddleware(BaseMiddleware):
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        handler_object = data.get("handler")
+        router = data.get("event_router")
+        labels = {
+            "router": router.name if router is not None else "",
+            "handler": handler_object.callback.__name__ if handler_object is not None else "",
+        }
+        HANDLER_IN_FLIGHT.inc(**labels)
+        try:
+            with HANDLER_SECONDS.time(**labels):
+                return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.inc(**labels)
+            raise
+        finally:
+            HANDLER_IN_FLIGHT.dec(**labels)
+
+
+async def start_metrics_server(host: str = METRICS_HOST, port: int = METRICS_PORT):
+    from aiohttp import web
+
+    async def handle_metrics(request: web.Request) -> web.Response:
+        return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8",
+                            headers={"X-Content-Type-Options": "nosniff"})
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    print(f"Metrics available at http://{host}:{port}/metrics")
+    return runner
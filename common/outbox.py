@@ -0,0 +1,257 @@
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import (
+    CopyMessage, EditMessageCaption, EditMessageMedia, EditMessageText, ForwardMessage,
+    SendDocument, SendMessage, SendPhoto, TelegramMethod,
+)
+from aiogram.methods.base import Response, TelegramType
+
+from common.metrics import register_collector
+from common.workers import WORKERS
+
+# Очередь исходящих сообщений.
+# Все отправки в чаты проходят через общий token bucket (лимит Telegram
+# около 30 сообщений в секунду на бота) и bucket конкретного чата. Ответы
+# пользователям идут в приоритетной полосе и обгоняют массовые напоминания,
+# а при 429 запрос повторяется после retry_after, не задерживая другие чаты.
+# При остановке начатые отправки дожидаются, а ещё не начатые завершаются
+# ошибкой OutboxClosed, чтобы ждущие их хендлеры и рассылки не зависали.
+
+# Лимит Telegram общий на бота, поэтому при нескольких воркерах делится между ними
+OUTBOX_GLOBAL_RATE = float(os.getenv("OUTBOX_GLOBAL_RATE", "30")) / WORKERS
+OUTBOX_CHAT_RATE = float(os.getenv("OUTBOX_CHAT_RATE", "1"))
+OUTBOX_CHAT_BURST = float(os.getenv("OUTBOX_CHAT_BURST", "3"))
+OUTBOX_MAX_RETRIES = int(os.getenv("OUTBOX_MAX_RETRIES", "3"))
+# Сколько неактивных bucket'ов чатов держать в памяти
+OUTBOX_MAX_CHAT_BUCKETS = int(os.getenv("OUTBOX_MAX_CHAT_BUCKETS", "10000"))
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+LANE_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_BULK: "bulk"}
+
+# Приоритет отправок из текущего контекста (например, рассылки напоминаний)
+outbox_priority: ContextVar[int] = ContextVar("outbox_priority", default=PRIORITY_INTERACTIVE)
+
+RATE_LIMITED_METHODS = (
+    SendMessage, SendPhoto, SendDocument, EditMessageText, EditMessageCaption, EditMessageMedia,
+    CopyMessage, ForwardMessage,
+)
+
+
+class OutboxClosed(Exception):
+    pass
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        # Через сколько секунд будет доступен один токен
+        self._refill(now)
+        if now < self.paused_until:
+            return self.paused_until - now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def idle(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity and now >= self.paused_until
+
+
+class _Job:
+    __slots__ = ("chat_id", "priority", "seq", "call", "future", "attempts")
+
+    def __init__(self, chat_id: int, priority: int, seq: int, call: Callable[[], Awaitable[Any]],
+                 future: asyncio.Future):
+        self.chat_id = chat_id
+        self.priority = priority
+        self.seq = seq
+        self.call = call
+        self.future = future
+        self.attempts = 0
+
+
+class Outbox:
+    def __init__(self, global_rate: float = OUTBOX_GLOBAL_RATE, chat_rate: float = OUTBOX_CHAT_RATE,
+                 chat_burst: float = OUTBOX_CHAT_BURST, max_retries: int = OUTBOX_MAX_RETRIES):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats: Dict[int, TokenBucket] = {}
+        self._seq = itertools.count()
+        # Готовые к отправке: (приоритет, порядковый номер); ждущие свой чат: (время, приоритет, номер)
+        self._ready: List[Tuple[int, int, _Job]] = []
+        self._delayed: List[Tuple[float, int, int, _Job]] = []
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._in_flight: set = set()
+        self._closed = False
+
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.backlog = {lane: 0 for lane in LANE_NAMES}
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= OUTBOX_MAX_CHAT_BUCKETS:
+                now = time.monotonic()
+                self._chats = {key: value for key, value in self._chats.items() if not value.idle(now)}
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _push(self, job: _Job):
+        heapq.heappush(self._ready, (job.priority, job.seq, job))
+        self._wakeup.set()
+
+    async def submit(self, chat_id: int, priority: int, call: Callable[[], Awaitable[Any]]) -> Any:
+        if self._closed:
+            raise OutboxClosed("outbox is closed")
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        self.backlog[priority] += 1
+        self._push(_Job(chat_id, priority, next(self._seq), call, future))
+        return await future
+
+    def _release_delayed(self, now: float):
+        while self._delayed and self._delayed[0][0] <= now:
+            _, _, _, job = heapq.heappop(self._delayed)
+            heapq.heappush(self._ready, (job.priority, job.seq, job))
+
+    async def _wait(self, timeout: Optional[float]):
+        self._wakeup.clear()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _run(self):
+        while True:
+            now = time.monotonic()
+            self._release_delayed(now)
+            if not self._ready:
+                await self._wait(self._delayed[0][0] - now if self._delayed else None)
+                continue
+
+            _, _, job = self._ready[0]
+            if job.future.cancelled():
+                heapq.heappop(self._ready)
+                self.backlog[job.priority] -= 1
+                continue
+            chat_delay = self._chat_bucket(job.chat_id).delay(now)
+            if chat_delay > 0:
+                # Чат ещё не готов: откладываем задачу, но не блокируем очередь для остальных
+                heapq.heappop(self._ready)
+                heapq.heappush(self._delayed, (now + chat_delay, job.priority, job.seq, job))
+                continue
+            global_delay = self._global.delay(now)
+            if global_delay > 0:
+                await self._wait(global_delay)
+                continue
+
+            heapq.heappop(self._ready)
+            self._global.take()
+            self._chat_bucket(job.chat_id).take()
+            task = asyncio.create_task(self._execute(job))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+
+    async def _execute(self, job: _Job):
+        job.attempts += 1
+        try:
+            result = await job.call()
+        except TelegramRetryAfter as e:
+            self._chat_bucket(job.chat_id).pause(e.retry_after)
+            if job.attempts <= self.max_retries:
+                self.retried += 1
+                self._push(job)
+                return
+            self._finish(job, exception=e)
+        except Exception as e:
+            self._finish(job, exception=e)
+        else:
+            self._finish(job, result=result)
+
+    def _finish(self, job: _Job, result: Any = None, exception: Optional[BaseException] = None):
+        self.backlog[job.priority] -= 1
+        if exception is not None:
+            self.failed += 1
+            if not job.future.done():
+                job.future.set_exception(exception)
+        else:
+            self.sent += 1
+            if not job.future.done():
+                job.future.set_result(result)
+
+    def stats(self) -> dict:
+        return {
+            "sent": self.sent,
+            "failed": self.failed,
+            "retried": self.retried,
+            "in_flight": len(self._in_flight),
+            "waiting_for_chat": len(self._delayed),
+            **{f"backlog_{LANE_NAMES[lane]}": count for lane, count in self.backlog.items()},
+        }
+
+    async def close(self):
+        self._closed = True
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        # Начатые отправки завершаются, в том числе возвращая задачу в очередь после 429
+        if self._in_flight:
+            await asyncio.gather(*self._in_flight, return_exceptions=True)
+        jobs = [job for *_, job in self._ready] + [job for *_, job in self._delayed]
+        self._ready.clear()
+        self._delayed.clear()
+        for job in jobs:
+            self._finish(job, exception=OutboxClosed("outbox is closed"))
+
+
+class OutboxMiddleware(BaseRequestMiddleware):
+    def __init__(self, outbox: Outbox):
+        self.outbox = outbox
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        chat_id = getattr(method, "chat_id", None)
+        if not isinstance(method, RATE_LIMITED_METHODS) or not isinstance(chat_id, int):
+            return await make_request(bot, method)
+        return await self.outbox.submit(chat_id, outbox_priority.get(), lambda: make_request(bot, method))
+
+
+outbox = Outbox()
+register_collector("outbox", outbox.stats)
@@ -0,0 +1,81 @@
+import asyncio
+import os
+from typing import Awaitable, Callable, Hashable, List, Optional, Set
+
+from common.metrics import register_collector
+
+# Очередь фоновых заданий, которые заранее готовят ответы (например, планы
+# тренировок после регистрации). Задание с тем же ключом, пока оно ждёт или
+# выполняется, повторно не ставится. Генерация в заданиях идёт через
+# llm_pool с фоновым приоритетом и не мешает запросам пользователей.
+
+PREFETCH_CONCURRENCY = int(os.getenv("PREFETCH_CONCURRENCY", "2"))
+PREFETCH_QUEUE_SIZE = int(os.getenv("PREFETCH_QUEUE_SIZE", "1000"))
+
+Job = Callable[[], Awaitable[None]]
+
+
+class Prefetcher:
+    def __init__(self, concurrency: int = PREFETCH_CONCURRENCY, queue_size: int = PREFETCH_QUEUE_SIZE):
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        # Пары (ключ, задание)
+        self._queue: Optional[asyncio.Queue] = None
+        self._pending: Set[Hashable] = set()
+        self._workers: List[asyncio.Task] = []
+
+        self.submitted = 0
+        self.deduplicated = 0
+        self.dropped = 0
+        self.completed = 0
+        self.failed = 0
+
+    def submit(self, key: Hashable, job: Job) -> bool:
+        if key in self._pending:
+            self.deduplicated += 1
+            return False
+        if self._queue is None:
+            self._queue = asyncio.Queue(self.queue_size)
+            self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+        if self._queue.full():
+            self.dropped += 1
+            return False
+        self._pending.add(key)
+        self._queue.put_nowait((key, job))
+        self.submitted += 1
+        return True
+
+    async def _worker(self):
+        while True:
+            key, job = await self._queue.get()
+            try:
+                await job()
+                self.completed += 1
+            except Exception as e:
+                self.failed += 1
+                print(f"Error in prefetch job {key}: {e}")
+            finally:
+                self._pending.discard(key)
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "pending": len(self._pending),
+            "submitted": self.submitted,
+            "deduplicated": self.deduplicated,
+            "dropped": self.dropped,
+            "completed": self.completed,
+            "failed": self.failed,
+        }
+
+    async def close(self):
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._queue = None
+        self._pending.clear()
+
+
+prefetcher = Prefetcher()
+register_collector("prefetch", prefetcher.stats)
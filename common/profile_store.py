@@ -0,0 +1,125 @@
+import asyncio
+import os
+from typing import Callable, Dict, List, Optional
+
+from common.metrics import STORAGE_SECONDS
+from common.workers import owns, shard_path
+
+# Профили пользователей из user_registration_data.xlsx.
+# Файл читается один раз, дальше профили живут в словаре по user_id,
+# а изменения сбрасываются на диск в фоне с небольшой задержкой,
+# чтобы несколько регистраций подряд дали одну запись файла.
+
+PROFILE_FILE = "user_registration_data.xlsx"
+PROFILE_SAVE_DELAY = float(os.getenv("PROFILE_SAVE_DELAY", "2"))
+
+
+def _read_profiles(path: str) -> Dict[int, dict]:
+    import pandas as pd
+
+    df = pd.read_excel(path)
+    df['user_id'] = pd.to_numeric(df['user_id'], errors='coerce')
+    df = df.dropna(subset=['user_id'])
+    profiles = {}
+    for row in df.to_dict('records'):
+        # Пустые ячейки превращают целые столбцы во float, возвращаем числам исходный вид
+        row = {key: int(value) if isinstance(value, float) and value.is_integer() else value
+               for key, value in row.items()}
+        # При повторной регистрации актуальна последняя строка
+        profiles[row['user_id']] = row
+    return profiles
+
+
+def _write_profiles(path: str, rows: List[dict]):
+    import pandas as pd
+
+    root, ext = os.path.splitext(path)
+    tmp_path = f"{root}.tmp{ext}"
+    pd.DataFrame(rows).to_excel(tmp_path, index=False, engine="openpyxl")
+    os.replace(tmp_path, path)
+
+
+class ProfileStore:
+    def __init__(self, path: str = PROFILE_FILE, save_delay: float = PROFILE_SAVE_DELAY):
+        self.path = shard_path(path)
+        # Общий файл, из которого воркер при первом запуске забирает своих пользователей
+        self.shared_path = path
+        self.save_delay = save_delay
+        self._profiles: Dict[int, dict] = {}
+        self._loaded = False
+        self._dirty = False
+        self._save_task: Optional[asyncio.Task] = None
+        self._save_lock = asyncio.Lock()
+        self._listeners: List[Callable[[dict], None]] = []
+
+    def add_listener(self, listener: Callable[[dict], None]):
+        # Вызывается после каждого изменения профиля
+        self._listeners.append(listener)
+
+    def load(self):
+        if self._loaded:
+            return
+        # Проверка заранее, чтобы без файла не загружать pandas
+        if os.path.exists(self.path):
+            self._profiles = _read_profiles(self.path)
+        else:
+            self._profiles = self._read_shared()
+        self._loaded = True
+
+    def _read_shared(self) -> Dict[int, dict]:
+        if self.shared_path == self.path or not os.path.exists(self.shared_path):
+            return {}
+        return {user_id: profile for user_id, profile in _read_profiles(self.shared_path).items() if owns(user_id)}
+
+    async def start(self):
+        await asyncio.to_thread(self.load)
+
+    def get(self, user_id: int) -> Optional[dict]:
+        self.load()
+        return self._profiles.get(user_id)
+
+    def __contains__(self, user_id: int) -> bool:
+        self.load()
+        return user_id in self._profiles
+
+    def upsert(self, profile: dict):
+        self.load()
+        self._profiles[profile['user_id']] = dict(profile)
+        self._dirty = True
+        if self._save_task is None:
+            self._save_task = asyncio.create_task(self._save_later())
+        for listener in self._listeners:
+            try:
+                listener(self._profiles[profile['user_id']])
+            except Exception as e:
+                print(f"Error in profile listener: {e}")
+
+    async def _save_later(self):
+        await asyncio.sleep(self.save_delay)
+        self._save_task = None
+        try:
+            await self.flush()
+        except Exception as e:
+            print(f"Error saving user profiles: {e}")
+
+    async def flush(self):
+        async with self._save_lock:
+            if not self._dirty:
+                return
+            self._dirty = False
+            rows = list(self._profiles.values())
+            try:
+                with STORAGE_SECONDS.time(store="profiles", operation="write"):
+                    await asyncio.to_thread(_write_profiles, self.path, rows)
+            except Exception:
+                self._dirty = True
+                raise
+
+    async def close(self):
+        if self._save_task is not None:
+            self._save_task.cancel()
+            self._save_task = None
+        await self.flush()
+
+
+profile_store = ProfileStore()
@@ -0,0 +1,188 @@
+import asyncio
+import heapq
+import math
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from common.metrics import register_collector
+from common.workers import owns
+
+# Движок напоминаний.
+# Подписки хранятся в SQLite и восстанавливаются при запуске. Вместо
+# отдельной задачи планировщика на каждый чат работает один диспетчер:
+# куча (время следующего напоминания, chat_id), которая на каждом тике
+# отдаёт все наступившие напоминания одной пачкой.
+
+REMINDER_DB = os.getenv("REMINDER_DB", "reminders.db")
+REMINDER_INTERVAL = int(os.getenv("REMINDER_INTERVAL", "300"))
+REMINDER_TICK = float(os.getenv("REMINDER_TICK", "1"))
+# Сколько напоминаний из пачки отправляется одновременно
+REMINDER_SEND_CONCURRENCY = int(os.getenv("REMINDER_SEND_CONCURRENCY", "25"))
+
+
+class ReminderDB:
+    def __init__(self, path: str):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS subscriptions ("
+            "chat_id INTEGER PRIMARY KEY, interval_seconds INTEGER NOT NULL, next_due REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def load_all(self) -> List[Tuple[int, int, float]]:
+        return self._conn.execute("SELECT chat_id, interval_seconds, next_due FROM subscriptions").fetchall()
+
+    def upsert(self, chat_id: int, interval: int, next_due: float):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO subscriptions (chat_id, interval_seconds, next_due) VALUES (?, ?, ?)",
+            (chat_id, interval, next_due),
+        )
+        self._conn.commit()
+
+    def delete(self, chat_id: int):
+        self._conn.execute("DELETE FROM subscriptions WHERE chat_id = ?", (chat_id,))
+        self._conn.commit()
+
+    def update_due(self, rows: List[Tuple[float, int]]):
+        self._conn.executemany("UPDATE subscriptions SET next_due = ? WHERE chat_id = ?", rows)
+        self._conn.commit()
+
+    def close(self):
+        self._conn.close()
+
+
+class ReminderEngine:
+    def __init__(self, db_path: str = REMINDER_DB, interval: int = REMINDER_INTERVAL, tick: float = REMINDER_TICK,
+                 send_concurrency: int = REMINDER_SEND_CONCURRENCY):
+        self.db_path = db_path
+        self.interval = interval
+        self.tick = tick
+        self.send_concurrency = send_concurrency
+        self._db: Optional[ReminderDB] = None
+        # Все обращения к базе идут через один поток, поэтому выполняются по порядку
+        self._db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="reminder-db")
+        self._subscriptions: Dict[int, Tuple[int, float]] = {}
+        self._heap: List[Tuple[float, int]] = []
+        self._wakeup = asyncio.Event()
+        self._send: Optional[Callable[[int], Awaitable[None]]] = None
+        self._task: Optional[asyncio.Task] = None
+        self._batches: set = set()
+
+        self.dispatched = 0
+        self.batches = 0
+
+    @property
+    def subscribers(self) -> int:
+        return len(self._subscriptions)
+
+    def _db_call(self, func: Callable, *args) -> asyncio.Future:
+        return asyncio.get_running_loop().run_in_executor(self._db_executor, func, *args)
+
+    def _schedule(self, chat_id: int, interval: int, next_due: float):
+        self._subscriptions[chat_id] = (interval, next_due)
+        heapq.heappush(self._heap, (next_due, chat_id))
+
+    def subscribe(self, chat_id: int, interval: Optional[int] = None) -> bool:
+        if chat_id in self._subscriptions:
+            return False
+        interval = interval or self.interval
+        next_due = time.time() + interval
+        self._schedule(chat_id, interval, next_due)
+        self._db_call(self._db.upsert, chat_id, interval, next_due)
+        self._wakeup.set()
+        return True
+
+    def unsubscribe(self, chat_id: int) -> bool:
+        # Запись в куче не удаляем, она будет пропущена при извлечении
+        if self._subscriptions.pop(chat_id, None) is None:
+            return False
+        self._db_call(self._db.delete, chat_id)
+        if len(self._heap) > 2 * len(self._subscriptions) + 1024:
+            self._heap = [(next_due, chat_id) for chat_id, (_, next_due) in self._subscriptions.items()]
+            heapq.heapify(self._heap)
+        return True
+
+    def _pop_due(self, now: float) -> Tuple[List[int], List[Tuple[float, int]]]:
+        due_chats, updates = [], []
+        while self._heap and self._heap[0][0] <= now:
+            due, chat_id = heapq.heappop(self._heap)
+            subscription = self._subscriptions.get(chat_id)
+            if subscription is None or subscription[1] != due:
+                continue
+            interval = subscription[0]
+            next_due = due + interval
+            if next_due <= now:
+                next_due = now + interval
+            self._schedule(chat_id, interval, next_due)
+            due_chats.append(chat_id)
+            updates.append((next_due, chat_id))
+        return due_chats, updates
+
+    async def _send_batch(self, chat_ids: List[int]):
+        chats = iter(chat_ids)
+
+        async def worker():
+            for chat_id in chats:
+                await self._send(chat_id)
+
+        await asyncio.gather(*(worker() for _ in range(min(self.send_concurrency, len(chat_ids)))))
+
+    async def _run(self):
+        while True:
+            now = time.time()
+            due_chats, updates = self._pop_due(now)
+            if due_chats:
+                self.batches += 1
+                self.dispatched += len(due_chats)
+                # Отправка пачки не задерживает следующий тик
+                task = asyncio.create_task(self._send_batch(due_chats))
+                self._batches.add(task)
+                task.add_done_callback(self._batches.discard)
+                self._db_call(self._db.update_due, updates)
+
+            self._wakeup.clear()
+            timeout = max(self._heap[0][0] - time.time(), self.tick) if self._heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def start(self, send: Callable[[int], Awaitable[None]]):
+        self._send = send
+        self._db = await self._db_call(ReminderDB, self.db_path)
+        now = time.time()
+        for chat_id, interval, next_due in await self._db_call(self._db.load_all):
+            # База общая для всех воркеров, каждый рассылает только своим чатам
+            if not owns(chat_id):
+                continue
+            # Пропущенные за время простоя напоминания не шлём пачкой, а сохраняем фазу интервала
+            if next_due <= now:
+                next_due += math.ceil((now - next_due) / interval) * interval
+            self._schedule(chat_id, interval, next_due)
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._db is not None:
+            await self._db_call(self._db.close)
+            self._db = None
+        self._db_executor.shutdown(wait=True)
+
+    def stats(self) -> dict:
+        return {
+            "subscribers": self.subscribers,
+            "heap_size": len(self._heap),
+            "dispatched": self.dispatched,
+            "batches": self.batches,
+        }
+
+
+reminder_engine = ReminderEngine()
+register_collector("reminder_engine", reminder_engine.stats)
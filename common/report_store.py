@@ -0,0 +1,69 @@
+import glob
+import os
+from typing import Optional
+
+from common.metrics import STORAGE_SECONDS, register_collector
+
+# Отчёты, заранее подготовленные еженедельной рассылкой.
+# Хранятся на диске, а не в общем кэше графиков в памяти: иначе подготовка
+# отчётов для большого числа пользователей вытесняла бы из кэша и свои же
+# ранние результаты, и графики, которые пользователи запрашивают сами.
+# В имени файла версия данных (номер последней тренировки), устаревшие
+# версии удаляются при сохранении новой. После первой отправки файл больше
+# не читается: дальше отчёт отдаётся по file_id из кэша графиков.
+
+REPORTS_DIR = "reports"
+EXTENSIONS = {"dashboard": ".png", "report_pdf": ".pdf"}
+
+
+class ReportStore:
+    def __init__(self, directory: str = REPORTS_DIR):
+        self.directory = directory
+
+        self.saved = 0
+        self.bytes_written = 0
+        self.hits = 0
+
+    def _partition_dir(self, user_id: int) -> str:
+        return os.path.join(self.directory, f"{user_id % 256:02x}")
+
+    def _path(self, user_id: int, report_type: str, version: int) -> str:
+        return os.path.join(self._partition_dir(user_id), f"{user_id}.{report_type}.{version}{EXTENSIONS[report_type]}")
+
+    def has(self, user_id: int, report_type: str, version: int) -> bool:
+        return os.path.exists(self._path(user_id, report_type, version))
+
+    def load(self, user_id: int, report_type: str, version: int) -> Optional[bytes]:
+        path = self._path(user_id, report_type, version)
+        if not os.path.exists(path):
+            return None
+        with STORAGE_SECONDS.time(store="reports", operation="read"):
+            with open(path, "rb") as f:
+                data = f.read()
+        self.hits += 1
+        return data
+
+    def save(self, user_id: int, report_type: str, version: int, data: bytes):
+        path = self._path(user_id, report_type, version)
+        os.makedirs(self._partition_dir(user_id), exist_ok=True)
+        with STORAGE_SECONDS.time(store="reports", operation="write"):
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        for old in glob.glob(os.path.join(self._partition_dir(user_id), f"{user_id}.{report_type}.*")):
+            if old != path:
+                os.remove(old)
+        self.saved += 1
+        self.bytes_written += len(data)
+
+    def stats(self) -> dict:
+        return {
+            "saved": self.saved,
+            "bytes_written": self.bytes_written,
+            "hits": self.hits,
+        }
+
+
+report_store = ReportStore()
+register_collector("reports", report_store.stats)
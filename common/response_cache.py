@@ -0,0 +1,216 @@
+import asyncio
+import json
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, Iterable, Optional, Tuple
+
+from common.metrics import STORAGE_SECONDS, register_collector
+
+# Кэш ответов GigaChat на запросы, которые строятся только из профиля
+# (экипировка, питание, персональная тренировка). Числовые поля профиля и
+# показатели тренировок округляются до шага, поэтому пользователи с близкими
+# данными получают один и тот же ответ без повторного обращения к модели.
+# Устаревший ответ ещё RESPONSE_CACHE_STALE_TTL секунд можно отдавать, пока в
+# фоне готовится новый. Ответы, в том числе заранее подготовленные планы
+# тренировок, дублируются в SQLite: переживают перезапуск и видны всем
+# воркерам. В памяти остаются последние RESPONSE_CACHE_MAX_ENTRIES.
+
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", str(24 * 60 * 60)))
+RESPONSE_CACHE_STALE_TTL = float(os.getenv("RESPONSE_CACHE_STALE_TTL", str(7 * 24 * 60 * 60)))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "5000"))
+# Пустое значение оставляет кэш только в памяти
+RESPONSE_CACHE_DB = os.getenv("RESPONSE_CACHE_DB", "responses.db")
+# Шаг округления числовых полей профиля
+BUCKET_STEPS = {
+    "age": float(os.getenv("RESPONSE_CACHE_AGE_STEP", "5")),
+    "weight": float(os.getenv("RESPONSE_CACHE_WEIGHT_STEP", "5")),
+    "height": float(os.getenv("RESPONSE_CACHE_HEIGHT_STEP", "5")),
+    "experience_running": float(os.getenv("RESPONSE_CACHE_EXPERIENCE_STEP", "3")),
+    # Показатели тренировок из training_stats.prompt_figures
+    "total_distance": float(os.getenv("RESPONSE_CACHE_TOTAL_DISTANCE_STEP", "50")),
+    "week_distance": float(os.getenv("RESPONSE_CACHE_WEEK_DISTANCE_STEP", "5")),
+    "average_pace": float(os.getenv("RESPONSE_CACHE_PACE_STEP", "0.5")),
+    "average_pulse": float(os.getenv("RESPONSE_CACHE_PULSE_STEP", "5")),
+    "longest_distance": float(os.getenv("RESPONSE_CACHE_LONGEST_STEP", "5")),
+}
+
+CacheKey = Tuple[str, Tuple[Tuple[str, object], ...]]
+
+
+def bucket(value, step: float):
+    if not step:
+        return value
+    rounded = round(float(value) / step) * step
+    return int(rounded) if float(rounded).is_integer() else rounded
+
+
+def normalize_profile(profile: dict, fields: Iterable[str]) -> Dict[str, object]:
+    normalized = {}
+    for field in fields:
+        value = profile[field]
+        step = BUCKET_STEPS.get(field)
+        if step:
+            value = bucket(value, step)
+        elif isinstance(value, str):
+            value = value.strip().lower()
+        normalized[field] = value
+    return normalized
+
+
+@dataclass
+class CachedResponse:
+    response: str
+    fresh_until: float
+
+    @property
+    def stale(self) -> bool:
+        return self.fresh_until <= time.monotonic()
+
+
+class ResponseCache:
+    def __init__(self, ttl: float = RESPONSE_CACHE_TTL, stale_ttl: float = RESPONSE_CACHE_STALE_TTL,
+                 max_entries: int = RESPONSE_CACHE_MAX_ENTRIES, path: Optional[str] = RESPONSE_CACHE_DB):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self.path = path
+        self._entries: "OrderedDict[CacheKey, CachedResponse]" = OrderedDict()
+        self._conn: Optional[sqlite3.Connection] = None
+        # Соединение используется только из этого потока
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="response-cache-db")
+        self._writes: set = set()
+
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        self.bypassed = 0
+        self.loaded = 0
+
+    @staticmethod
+    def make_key(kind: str, inputs: Dict[str, object]) -> CacheKey:
+        return kind, tuple(sorted(inputs.items()))
+
+    def peek(self, key: CacheKey) -> Optional[CachedResponse]:
+        # Без учёта в счётчиках и порядке вытеснения, для фоновых задач
+        entry = self._entries.get(key)
+        if entry is None or entry.fresh_until + self.stale_ttl <= time.monotonic():
+            return None
+        return entry
+
+    def get(self, key: CacheKey) -> Optional[CachedResponse]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        if entry.fresh_until + self.stale_ttl <= time.monotonic():
+            del self._entries[key]
+            self.expired += 1
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        if entry.stale:
+            self.stale_hits += 1
+        return entry
+
+    async def load(self, key: CacheKey, peek: bool = False) -> Optional[CachedResponse]:
+        # Как get (или peek), но при промахе в памяти ищет ответ в базе
+        entry = self.peek(key) if peek else self.get(key)
+        if entry is not None or not self.path:
+            return entry
+        with STORAGE_SECONDS.time(store="responses", operation="read"):
+            row = await asyncio.get_running_loop().run_in_executor(self._executor, self._read, _db_key(key))
+        if row is None:
+            return None
+        response, fresh_until = row
+        # В базе время по часам, в памяти - по monotonic
+        entry = CachedResponse(response, time.monotonic() + fresh_until - time.time())
+        if entry.fresh_until + self.stale_ttl <= time.monotonic():
+            return None
+        self._remember(key, entry)
+        self.loaded += 1
+        if not peek:
+            self.misses -= 1
+            self.hits += 1
+            if entry.stale:
+                self.stale_hits += 1
+        return entry
+
+    def put(self, key: CacheKey, response: str):
+        entry = CachedResponse(response, time.monotonic() + self.ttl)
+        self._remember(key, entry)
+        if self.path:
+            # Запись в базу идёт в фоне, ответ пользователю её не ждёт
+            future = asyncio.get_running_loop().run_in_executor(
+                self._executor, self._write, _db_key(key), response, time.time() + self.ttl)
+            self._writes.add(future)
+            future.add_done_callback(self._write_done)
+
+    def _remember(self, key: CacheKey, entry: CachedResponse):
+        self._entries.pop(key, None)
+        self._entries[key] = entry
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _write_done(self, future: asyncio.Future):
+        self._writes.discard(future)
+        if not future.cancelled() and future.exception() is not None:
+            print(f"Error saving cached response: {future.exception()}")
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, response TEXT NOT NULL, fresh_until REAL NOT NULL)"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def _read(self, key: str) -> Optional[Tuple[str, float]]:
+        return self._connect().execute(
+            "SELECT response, fresh_until FROM responses WHERE key = ?", (key,)).fetchone()
+
+    def _write(self, key: str, response: str, fresh_until: float):
+        conn = self._connect()
+        with STORAGE_SECONDS.time(store="responses", operation="write"):
+            conn.execute("INSERT OR REPLACE INTO responses (key, response, fresh_until) VALUES (?, ?, ?)",
+                         (key, response, fresh_until))
+            # Заодно удаляем ответы, которые уже нельзя отдавать даже как устаревшие
+            conn.execute("DELETE FROM responses WHERE fresh_until < ?", (time.time() - self.stale_ttl,))
+            conn.commit()
+
+    async def close(self):
+        if self._writes:
+            await asyncio.gather(*self._writes, return_exceptions=True)
+        if self._conn is not None:
+            await asyncio.get_running_loop().run_in_executor(self._executor, self._conn.close)
+            self._conn = None
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "expired": self.expired,
+            "evictions": self.evictions,
+            "bypassed": self.bypassed,
+            "loaded": self.loaded,
+        }
+
+
+def _db_key(key: CacheKey) -> str:
+    return json.dumps(key, ensure_ascii=False)
+
+
+response_cache = ResponseCache()
+register_collector("response_cache", response_cache.stats)
@@ -0,0 +1,86 @@
+import builtins
+import os
+import sys
+import time
+from collections import defaultdict
+from typing import List, Optional, Tuple
+
+# Профиль холодного старта. При STARTUP_PROFILE=1 засекается время первого
+# импорта каждого модуля, а когда бот готов принимать апдейты, печатается,
+# сколько заняли импорты роутеров из main.py и какие пакеты самые тяжёлые.
+
+STARTUP_PROFILE = os.getenv("STARTUP_PROFILE", "0") == "1"
+STARTUP_PROFILE_TOP = int(os.getenv("STARTUP_PROFILE_TOP", "15"))
+
+
+class ImportProfiler:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._original_import = None
+        # Время вложенных импортов на каждом уровне, чтобы отделить собственное время модуля
+        self._stack: List[float] = []
+        # (модуль, время с вложенными, собственное время, глубина)
+        self.records: List[Tuple[str, float, float, int]] = []
+
+    @property
+    def active(self) -> bool:
+        return self._original_import is not None
+
+    def start(self):
+        if self.active:
+            return
+        self.started = time.perf_counter()
+        self._original_import = builtins.__import__
+        builtins.__import__ = self._import
+
+    def stop(self):
+        if self.active:
+            builtins.__import__ = self._original_import
+            self._original_import = None
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        if level or name in sys.modules:
+            return self._original_import(name, globals, locals, fromlist, level)
+        self._stack.append(0.0)
+        started = time.perf_counter()
+        try:
+            return self._original_import(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = time.perf_counter() - started
+            nested = self._stack.pop()
+            if self._stack:
+                self._stack[-1] += elapsed
+            self.records.append((name, elapsed, elapsed - nested, len(self._stack)))
+
+    def report(self, stage: str, top: int = STARTUP_PROFILE_TOP) -> str:
+        total = time.perf_counter() - self.started
+        imports = sum(elapsed for _, elapsed, _, depth in self.records if depth == 0)
+        packages = defaultdict(float)
+        for name, _, own, _ in self.records:
+            packages[name.split(".")[0]] += own
+
+        lines = [f"Профиль запуска: {stage} через {total:.2f} с, из них импорты {imports:.2f} с"]
+        lines.append("Импорты main.py:")
+        for name, elapsed, _, depth in self.records:
+            if depth == 0 and elapsed >= 0.001:
+                lines.append(f"  {elapsed:7.3f} с  {name}")
+        lines.append("Самые тяжёлые пакеты (собственное время):")
+        for name, own in sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]:
+            lines.append(f"  {own:7.3f} с  {name}")
+        return "\n".join(lines)
+
+
+import_profiler = ImportProfiler()
+# Замер начинается с импорта этого модуля, поэтому main.py импортирует его до остальных
+if STARTUP_PROFILE:
+    import_profiler.start()
+
+
+def report_startup(stage: str) -> Optional[str]:
+    # Печатает отчёт и перестаёт засекать импорты (дальше они идут лениво, по мере запросов)
+    if not import_profiler.active:
+        return None
+    report = import_profiler.report(stage)
+    import_profiler.stop()
+    print(report)
+    return report
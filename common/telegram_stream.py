@@ -0,0 +1,96 @@
+import os
+import time
+from typing import AsyncIterator, List, Optional
+
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.types import Message
+
+# Постепенная отправка длинного ответа в Telegram: первое сообщение уходит
+# сразу после первого фрагмента, дальше оно редактируется не чаще, чем раз
+# в STREAM_EDIT_INTERVAL секунд, а текст длиннее лимита Telegram переносится
+# в следующее сообщение.
+
+TELEGRAM_MESSAGE_LIMIT = 4096
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.5"))
+
+
+def _split_point(text: str, limit: int) -> int:
+    # Режем по последнему переносу строки или пробелу, чтобы не рвать слова
+    for separator in ("\n", " "):
+        index = text.rfind(separator, 0, limit)
+        if index > 0:
+            return index + 1
+    return limit
+
+
+def split_message(text: str, limit: int = TELEGRAM_MESSAGE_LIMIT) -> List[str]:
+    parts = []
+    while len(text) > limit:
+        index = _split_point(text, limit)
+        parts.append(text[:index])
+        text = text[index:]
+    if text:
+        parts.append(text)
+    return parts
+
+
+class StreamingReply:
+    def __init__(self, message: Message, reply: bool = False, edit_interval: float = STREAM_EDIT_INTERVAL):
+        self.message = message
+        self.reply = reply
+        self.edit_interval = edit_interval
+        self._current = ""
+        self._sent_text = ""
+        self._sent_message: Optional[Message] = None
+        self._next_edit_at = 0.0
+
+    async def _send(self, text: str) -> Message:
+        if self.reply:
+            return await self.message.reply(text)
+        return await self.message.answer(text)
+
+    async def _flush(self, force: bool = False):
+        text = self._current
+        if not text.strip() or text == self._sent_text:
+            return
+        if self._sent_message is None:
+            self._sent_message = await self._send(text)
+        elif force or time.monotonic() >= self._next_edit_at:
+            try:
+                await self._sent_message.edit_text(text)
+            except TelegramRetryAfter as e:
+                # Не ждём на каждом фрагменте: просто откладываем следующую правку
+                self._next_edit_at = time.monotonic() + e.retry_after
+                if not force:
+                    return
+                await self._sent_message.edit_text(text)
+            except TelegramBadRequest as e:
+                if "message is not modified" not in str(e):
+                    raise
+        else:
+            return
+        self._sent_text = text
+        self._next_edit_at = time.monotonic() + self.edit_interval
+
+    async def feed(self, chunk: str):
+        self._current += chunk
+        while len(self._current) > TELEGRAM_MESSAGE_LIMIT:
+            index = _split_point(self._current, TELEGRAM_MESSAGE_LIMIT)
+            head, tail = self._current[:index], self._current[index:]
+            self._current = head
+            await self._flush(force=True)
+            self._current, self._sent_text, self._sent_message = tail, "", None
+        await self._flush()
+
+    async def finish(self):
+        await self._flush(force=True)
+
+
+async def send_streaming(message: Message, chunks: AsyncIterator[str], reply: bool = False) -> str:
+    streaming_reply = StreamingReply(message, reply=reply)
+    parts = []
+    async for chunk in chunks:
+        parts.append(chunk)
+        await streaming_reply.feed(chunk)
+    await streaming_reply.finish()
+    return "".join(parts)
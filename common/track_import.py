@@ -0,0 +1,185 @@
+import asyncio
+import os
+import xml.etree.ElementTree as ET
+from array import array
+from concurrent.futures import Executor, ProcessPoolExecutor
+from datetime import datetime
+from typing import TYPE_CHECKING, List, Optional
+
+from common.metrics import STORAGE_SECONDS, register_collector
+
+# Импорт тренировок из файлов часов (GPX и TCX).
+# XML читается потоково через iterparse: каждая точка трека сразу
+# разбирается в компактные массивы и удаляется из дерева, поэтому память
+# не растёт с длиной файла. Дистанция, время в движении, пульс и отрезки
+# по километрам считаются векторно в NumPy. Разбор идёт в отдельном процессе,
+# NumPy загружается только там.
+
+if TYPE_CHECKING:
+    import numpy as np
+
+IMPORT_WORKERS = int(os.getenv("TRACK_IMPORT_WORKERS", "1"))
+# Максимальный размер файла, который Bot API отдаёт через getFile
+MAX_TRACK_FILE_SIZE = 20 * 1024 * 1024
+TRACK_EXTENSIONS = (".gpx", ".tcx")
+
+EARTH_RADIUS_M = 6371008.8
+# Отрезки медленнее этой скорости (м/с) считаются остановкой
+MOVING_SPEED_THRESHOLD = float(os.getenv("TRACK_MOVING_SPEED", "0.5"))
+# Примерный расход при беге: ккал на килограмм веса на километр
+KCAL_PER_KG_KM = 1.0
+
+
+class TrackImportError(Exception):
+    pass
+
+
+def _local_name(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1]
+
+
+def _parse_time(text: Optional[str]) -> float:
+    if not text:
+        return float("nan")
+    return datetime.fromisoformat(text.strip().replace("Z", "+00:00")).timestamp()
+
+
+def _child_text(element, name: str) -> Optional[str]:
+    for child in element.iter():
+        if _local_name(child.tag) == name and child.text:
+            return child.text
+    return None
+
+
+def parse_track(path: str):
+    import numpy as np
+
+    # Возвращает массивы широты, долготы, времени (unix, NaN если нет) и пульса (NaN если нет)
+    lat, lon, times, hr = array("d"), array("d"), array("d"), array("d")
+    stack = []
+    for event, element in ET.iterparse(path, events=("start", "end")):
+        if event == "start":
+            stack.append(element)
+            continue
+        stack.pop()
+        name = _local_name(element.tag)
+        if name == "trkpt":
+            latitude, longitude = element.get("lat"), element.get("lon")
+        elif name == "Trackpoint":
+            latitude, longitude = _child_text(element, "LatitudeDegrees"), _child_text(element, "LongitudeDegrees")
+        else:
+            continue
+        if latitude is not None and longitude is not None:
+            lat.append(float(latitude))
+            lon.append(float(longitude))
+            times.append(_parse_time(_child_text(element, "time" if name == "trkpt" else "Time")))
+            # В GPX пульс лежит в расширениях Garmin (gpxtpx:hr), в TCX - в HeartRateBpm/Value
+            pulse = _child_text(element, "hr") if name == "trkpt" else _child_text(element, "Value")
+            hr.append(float(pulse) if pulse else float("nan"))
+        # Разобранная точка больше не нужна
+        element.clear()
+        if stack:
+            stack[-1].remove(element)
+    return (np.frombuffer(lat), np.frombuffer(lon), np.frombuffer(times), np.frombuffer(hr))
+
+
+def haversine(lat: "np.ndarray", lon: "np.ndarray") -> "np.ndarray":
+    import numpy as np
+
+    # Расстояния в метрах между соседними точками
+    lat, lon = np.radians(lat), np.radians(lon)
+    dlat, dlon = np.diff(lat), np.diff(lon)
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat[:-1]) * np.cos(lat[1:]) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def km_splits(segment_m: "np.ndarray", segment_moving_s: "np.ndarray") -> List[float]:
+    import numpy as np
+
+    # Время в движении (с) на каждый полный километр
+    distance = np.concatenate(([0.0], np.cumsum(segment_m)))
+    moving = np.concatenate(([0.0], np.cumsum(segment_moving_s)))
+    marks = np.arange(1000.0, distance[-1] + 1e-9, 1000.0)
+    if not len(marks):
+        return []
+    at_marks = np.interp(marks, distance, moving)
+    return np.diff(np.concatenate(([0.0], at_marks))).tolist()
+
+
+def analyze_track(path: str, weight: Optional[float] = None) -> dict:
+    import numpy as np
+
+    lat, lon, times, hr = parse_track(path)
+    if len(lat) < 2:
+        raise TrackImportError("В файле нет точек трека.")
+    valid = ~np.isnan(times)
+    if valid.sum() < 2:
+        raise TrackImportError("В треке нет времени прохождения точек.")
+    lat, lon, times, hr = lat[valid], lon[valid], times[valid], hr[valid]
+    order = np.argsort(times, kind="stable")
+    lat, lon, times, hr = lat[order], lon[order], times[order], hr[order]
+
+    segment_m = haversine(lat, lon)
+    segment_s = np.diff(times)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        moving = (segment_s > 0) & (segment_m / segment_s >= MOVING_SPEED_THRESHOLD)
+    segment_moving_s = np.where(moving, segment_s, 0.0)
+
+    distance_km = float(segment_m.sum()) / 1000
+    moving_s = float(segment_moving_s.sum())
+    if distance_km <= 0 or moving_s <= 0:
+        raise TrackImportError("По треку не удалось определить дистанцию и время.")
+    has_hr = bool((~np.isnan(hr)).any())
+
+    started_at = datetime.fromtimestamp(times[0])
+    return {
+        "distance": round(distance_km, 2),
+        "time": round(moving_s / 60, 1),
+        "pace": round(distance_km / (moving_s / 3600), 1),
+        "pulse": round(float(np.nanmean(hr))) if has_hr else None,
+        "max_pulse": round(float(np.nanmax(hr))) if has_hr else None,
+        "calories": round(weight * distance_km * KCAL_PER_KG_KM) if weight else None,
+        "elapsed_time": round(float(times[-1] - times[0]) / 60, 1),
+        "splits": [round(split) for split in km_splits(segment_m, segment_moving_s)],
+        "recorded_at": started_at.isoformat(timespec="seconds"),
+        "source": os.path.splitext(path)[1].lstrip(".").lower(),
+    }
+
+
+def format_duration(seconds: float) -> str:
+    seconds = int(round(seconds))
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
+
+
+class TrackImporter:
+    def __init__(self, workers: int = IMPORT_WORKERS):
+        self.workers = workers
+        self._executor: Optional[Executor] = None
+        self.imported = 0
+        self.failed = 0
+
+    async def analyze(self, path: str, weight: Optional[float] = None) -> dict:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        try:
+            with STORAGE_SECONDS.time(store="track_import", operation="parse"):
+                result = await asyncio.get_running_loop().run_in_executor(self._executor, analyze_track, path, weight)
+        except Exception:
+            self.failed += 1
+            raise
+        self.imported += 1
+        return result
+
+    def stats(self) -> dict:
+        return {"imported": self.imported, "failed": self.failed}
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+track_importer = TrackImporter()
+register_collector("track_import", track_importer.stats)
@@ -0,0 +1,279 @@
+import asyncio
+import json
+import os
+from dataclasses import asdict, dataclass
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional
+
+from common.metrics import STORAGE_SECONDS
+from common.workers import shard_path
+from common.workout_store import WorkoutStore, workout_store
+
+# Сводная статистика тренировок по пользователям.
+# Агрегаты обновляются за O(1) при каждой новой записи в WorkoutStore и
+# периодически сохраняются в tracking_stats.json. Для пользователя, которого
+# ещё нет в файле, статистика один раз пересчитывается по его записям.
+# Запись задним числом (импорт старой пробежки из GPX/TCX) меняет серии
+# недель, поэтому после неё агрегаты тоже пересчитываются по записям.
+
+STATS_FILE = shard_path("tracking_stats.json")
+STATS_SAVE_DELAY = float(os.getenv("STATS_SAVE_DELAY", "5"))
+
+# Периоды для графиков и статистики: сколько последних дней, включая сегодня (None - за всё время)
+WINDOWS = {"week": 7, "month": 30, "all": None}
+WINDOW_ALIASES = {"week": "week", "неделя": "week", "month": "month", "месяц": "month",
+                  "all": "all", "всё": "all", "все": "all", "всё время": "all"}
+WINDOW_TITLES = {"week": "за неделю", "month": "за месяц", "all": "за всё время"}
+
+
+def window_start(window: str, now: Optional[datetime] = None) -> Optional[datetime]:
+    # Начало периода по полуночи, чтобы в течение дня выборка и кэш графиков не менялись
+    days = WINDOWS[window]
+    if days is None:
+        return None
+    today = (now or datetime.now()).replace(hour=0, minute=0, second=0, microsecond=0)
+    return today - timedelta(days=days - 1)
+
+
+def _iso_week(day: date) -> str:
+    year, week, _ = day.isocalendar()
+    return f"{year}-W{week:02d}"
+
+
+def _previous_iso_week(week: str) -> str:
+    year, week_number = week.split("-W")
+    monday = date.fromisocalendar(int(year), int(week_number), 1)
+    return _iso_week(date.fromordinal(monday.toordinal() - 7))
+
+
+def _record_week(record: dict) -> Optional[str]:
+    recorded_at = record.get("recorded_at")
+    if not isinstance(recorded_at, str) or not recorded_at:
+        return None
+    return _iso_week(datetime.fromisoformat(recorded_at).date())
+
+
+def _number(value) -> float:
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return 0.0
+    return 0.0 if value != value else value  # NaN из пустых ячеек считаем нулём
+
+
+@dataclass
+class TrainingStats:
+    workouts: int = 0
+    total_distance: float = 0.0
+    total_time: float = 0.0  # минуты
+    total_calories: float = 0.0
+    pulse_sum: float = 0.0
+    pulse_count: int = 0
+    longest_distance: float = 0.0
+    best_pace: float = 0.0  # км/ч
+    week: str = ""
+    week_distance: float = 0.0
+    week_workouts: int = 0
+    week_streak: int = 0
+    best_week_streak: int = 0
+
+    def add(self, record: dict):
+        distance = _number(record.get("distance"))
+        time = _number(record.get("time"))
+        pace = _number(record.get("pace"))
+        pulse = _number(record.get("pulse"))
+
+        self.workouts += 1
+        self.total_distance += distance
+        self.total_time += time
+        self.total_calories += _number(record.get("calories"))
+        if pulse:
+            self.pulse_sum += pulse
+            self.pulse_count += 1
+        self.longest_distance = max(self.longest_distance, distance)
+        self.best_pace = max(self.best_pace, pace)
+
+        week = _record_week(record)
+        if week is None:
+            # У записей из старого xlsx нет даты, они не участвуют в недельной статистике
+            return
+        if week == self.week:
+            self.week_distance += distance
+            self.week_workouts += 1
+            return
+        if week < self.week:
+            # Для записей не по порядку недели считает TrainingStatsStore, пересчитывая агрегаты
+            return
+        self.week_streak = self.week_streak + 1 if self.week and _previous_iso_week(week) == self.week else 1
+        self.best_week_streak = max(self.best_week_streak, self.week_streak)
+        self.week, self.week_distance, self.week_workouts = week, distance, 1
+
+    def is_back_dated(self, record: dict) -> bool:
+        week = _record_week(record)
+        return week is not None and week < self.week
+
+    @property
+    def average_pace(self) -> float:
+        return self.total_distance / (self.total_time / 60) if self.total_time else 0.0
+
+    @property
+    def average_pulse(self) -> float:
+        return self.pulse_sum / self.pulse_count if self.pulse_count else 0.0
+
+    def current_week_distance(self, today: Optional[date] = None) -> float:
+        return self.week_distance if self.week == _iso_week(today or date.today()) else 0.0
+
+    def recent_week_distance(self, today: Optional[date] = None) -> float:
+        # Объём последней недели с тренировками, если это текущая или прошлая неделя:
+        # в отличие от current_week_distance не обнуляется в понедельник
+        current = _iso_week(today or date.today())
+        return self.week_distance if self.week in (current, _previous_iso_week(current)) else 0.0
+
+    def current_week_streak(self, today: Optional[date] = None) -> int:
+        # Серия не прервана, пока есть пробежка на этой или прошлой неделе
+        current = _iso_week(today or date.today())
+        if self.week in (current, _previous_iso_week(current)):
+            return self.week_streak
+        return 0
+
+
+class TrainingStatsStore:
+    def __init__(self, store: WorkoutStore, path: str = STATS_FILE, save_delay: float = STATS_SAVE_DELAY):
+        self.store = store
+        self.path = path
+        self.save_delay = save_delay
+        self._stats: Dict[int, TrainingStats] = {}
+        # Пересчёт по сырым данным и записи, пришедшие во время него
+        self._rebuilding: Dict[int, asyncio.Task] = {}
+        self._pending: Dict[int, List[dict]] = {}
+        self._loaded = False
+        self._save_task: Optional[asyncio.Task] = None
+        self._dirty = False
+        store.add_listener(self.on_workout)
+
+    def load(self):
+        if self._loaded:
+            return
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as f:
+                self._stats = {int(user_id): TrainingStats(**stats) for user_id, stats in json.load(f).items()}
+        self._loaded = True
+
+    async def start(self):
+        await asyncio.to_thread(self.load)
+
+    def on_workout(self, record: dict):
+        self.load()
+        user_id = int(record["user_id"])
+        if user_id in self._pending:
+            self._pending[user_id].append(record)
+            return
+        stats = self._stats.get(user_id)
+        # Если агрегатов ещё нет, они целиком посчитаются при первом запросе
+        if stats is None:
+            return
+        if stats.is_back_dated(record):
+            # Пробежка за прошлую неделю может соединить или продлить серии, агрегаты
+            # пересчитаются по записям (в хронологическом порядке) при следующем запросе
+            del self._stats[user_id]
+        else:
+            stats.add(record)
+        self._schedule_save()
+
+    async def get(self, user_id: int) -> TrainingStats:
+        self.load()
+        stats = self._stats.get(user_id)
+        if stats is not None:
+            return stats
+        task = self._rebuilding.get(user_id)
+        if task is None:
+            task = self._rebuilding[user_id] = asyncio.create_task(self._rebuild(user_id))
+        return await asyncio.shield(task)
+
+    async def for_window(self, user_id: int, window: str) -> TrainingStats:
+        if WINDOWS[window] is None:
+            return await self.get(user_id)
+        # За период статистика считается по срезу записей, общие агрегаты не меняются
+        stats = TrainingStats()
+        for record in await self.store.records(user_id, since=window_start(window)):
+            stats.add(record)
+        return stats
+
+    async def _rebuild(self, user_id: int) -> TrainingStats:
+        self._pending[user_id] = []
+        try:
+            records = await self.store.records(user_id)
+            stats = TrainingStats()
+            for record in records:
+                stats.add(record)
+            last_seq = max((record["seq"] for record in records), default=0)
+            for record in self._pending[user_id]:
+                if record["seq"] > last_seq:
+                    stats.add(record)
+            self._stats[user_id] = stats
+            self._schedule_save()
+            return stats
+        finally:
+            self._pending.pop(user_id, None)
+            self._rebuilding.pop(user_id, None)
+
+    def _schedule_save(self):
+        self._dirty = True
+        if self._save_task is None:
+            self._save_task = asyncio.create_task(self._save_later())
+
+    async def _save_later(self):
+        await asyncio.sleep(self.save_delay)
+        self._save_task = None
+        try:
+            await self.flush()
+        except Exception as e:
+            print(f"Error saving training stats: {e}")
+
+    async def flush(self):
+        if not self._dirty:
+            return
+        self._dirty = False
+        data = {str(user_id): asdict(stats) for user_id, stats in self._stats.items()}
+        with STORAGE_SECONDS.time(store="training_stats", operation="write"):
+            await asyncio.to_thread(_write_json, self.path, data)
+
+    async def close(self):
+        if self._save_task is not None:
+            self._save_task.cancel()
+            self._save_task = None
+        await self.flush()
+
+
+def _write_json(path: str, data: dict):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def prompt_figures(stats: TrainingStats) -> Dict[str, float]:
+    # Показатели для запроса к GigaChat, пустой словарь - тренировок ещё нет
+    if not stats.workouts:
+        return {}
+    return {
+        "total_distance": stats.total_distance,
+        # Показатели входят в ключ заранее готовых планов, поэтому не должны меняться без новых тренировок
+        "week_distance": stats.recent_week_distance(),
+        "average_pace": stats.average_pace,
+        "average_pulse": stats.average_pulse,
+        "longest_distance": stats.longest_distance,
+    }
+
+
+def describe_for_prompt(figures: Dict[str, float]) -> str:
+    if not figures:
+        return ""
+    return (f" статистика тренировок: общая дистанция - около {figures['total_distance']} км,"
+            f" за последнюю неделю - около {figures['week_distance']} км,"
+            f" средний темп - около {figures['average_pace']} км/ч,"
+            f" средний пульс - около {figures['average_pulse']},"
+            f" самая длинная пробежка - около {figures['longest_distance']} км")
+
+
+training_stats = TrainingStatsStore(workout_store)
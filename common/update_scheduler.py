@@ -0,0 +1,283 @@
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, Iterable, NamedTuple, Optional, Set
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+from common.metrics import UPDATE_QUEUE_SECONDS, register_collector
+
+# Планировщик апдейтов. Стоит внешним middleware на dp.update, поэтому
+# получает апдейт уже с чатом и состоянием FSM, кладёт его в очередь чата
+# и сразу возвращает управление поллингу. Апдейты одного чата выполняются
+# строго по очереди, разных чатов - параллельно, но не больше
+# UPDATE_CONCURRENCY одновременно. Свободный текст для GigaChat идёт с низким
+# приоритетом: запускается, только когда нет других готовых апдейтов, а при
+# заполнении очереди до UPDATE_SHED_RATIO отбрасывается с ответом
+# пользователю. Если очередь заполнена полностью, поллинг ждёт свободного
+# места и новые апдейты остаются на стороне Telegram.
+# Повтор последнего апдейта чата, пока первый ждёт в очереди или выполняется,
+# считается в duplicates. Если первый апдейт - запрос к GigaChat (кнопки и
+# команды из coalesce или свободный текст вне FSM), повтор присоединяется к
+# нему: второго запроса нет, ответ придёт на первый (coalesced). Остальные
+# повторы, например одинаковые ответы в FSM, выполняются как обычно.
+
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "32"))
+# Всего апдейтов в очередях всех чатов
+UPDATE_QUEUE_LIMIT = int(os.getenv("UPDATE_QUEUE_LIMIT", "1000"))
+# Апдейты одного чата сверх этого числа отбрасываются, чтобы один чат не занял всю очередь
+UPDATE_CHAT_QUEUE_LIMIT = int(os.getenv("UPDATE_CHAT_QUEUE_LIMIT", "20"))
+UPDATE_SHED_RATIO = float(os.getenv("UPDATE_SHED_RATIO", "0.5"))
+# Сколько секунд при остановке дожидаться уже принятых апдейтов
+UPDATE_DRAIN_TIMEOUT = float(os.getenv("UPDATE_DRAIN_TIMEOUT", "30"))
+
+PRIORITY_HIGH = 0
+PRIORITY_LOW = 1
+PRIORITY_NAMES = ("high", "low")
+
+OVERLOADED_TEXT = "Сейчас бот перегружен, поэтому вопрос не обработан. Пожалуйста, повторите его через минуту."
+FLOOD_TEXT = "Слишком много сообщений подряд, подождите ответа на предыдущие."
+DUPLICATE_TEXT = "Уже выполняю, подождите немного."
+
+
+class Job(NamedTuple):
+    handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]]
+    event: TelegramObject
+    data: Dict[str, Any]
+    priority: int
+    enqueued_at: float
+    # Ключ для поиска повторов, None - апдейт не сравнивается с другими
+    key: Optional[Hashable] = None
+    # Апдейт запрашивает GigaChat, его повторы присоединяются к нему
+    coalesce: bool = False
+
+
+class UpdateScheduler(BaseMiddleware):
+    def __init__(self, concurrency: int = UPDATE_CONCURRENCY, queue_limit: int = UPDATE_QUEUE_LIMIT,
+                 chat_queue_limit: int = UPDATE_CHAT_QUEUE_LIMIT, shed_ratio: float = UPDATE_SHED_RATIO):
+        self.concurrency = concurrency
+        self.queue_limit = queue_limit
+        self.chat_queue_limit = chat_queue_limit
+        self.shed_limit = int(queue_limit * shed_ratio)
+        # Тексты кнопок клавиатуры - это команды, а не вопросы к GigaChat
+        self.reserved_texts: Set[str] = set()
+        # Кнопки и команды, которые запрашивают GigaChat
+        self.coalesced_callbacks: Set[str] = set()
+        self.coalesced_commands: Set[str] = set()
+        self._queues: Dict[int, Deque[Job]] = {}
+        # Чаты, у которых есть апдейт в очереди и ничего не выполняется, по приоритету первого апдейта
+        self._ready = (deque(), deque())
+        self._running: Dict[int, asyncio.Task] = {}
+        # Последний принятый апдейт каждого чата, с ним сравниваются новые
+        self._last: Dict[int, Job] = {}
+        self._space = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._replies: set = set()
+        self._drained: Dict[int, asyncio.Event] = {}
+
+        self.queued = 0
+        self.queued_low = 0
+        self.max_queued = 0
+        self.started = 0
+        self.processed = 0
+        self.errors = 0
+        self.shed = 0
+        self.dropped = 0
+        self.duplicates = 0
+        self.coalesced = 0
+        self.backpressure_waits = 0
+        self.total_wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    def reserve_texts(self, texts: Iterable[str]):
+        self.reserved_texts.update(texts)
+
+    def coalesce(self, callbacks: Iterable[str] = (), commands: Iterable[str] = ()):
+        self.coalesced_callbacks.update(callbacks)
+        self.coalesced_commands.update(commands)
+
+    def priority(self, event: TelegramObject, data: Dict[str, Any]) -> int:
+        # Свободный текст вне FSM уходит в GigaChat: его можно отложить или отбросить
+        message = event.message if isinstance(event, Update) else None
+        if message is None or not message.text or data.get("raw_state") is not None:
+            return PRIORITY_HIGH
+        if message.text.startswith("/") or message.text in self.reserved_texts:
+            return PRIORITY_HIGH
+        return PRIORITY_LOW
+
+    def duplicate_key(self, event: TelegramObject) -> Optional[Hashable]:
+        if not isinstance(event, Update):
+            return None
+        if event.callback_query is not None:
+            # Повторное нажатие той же кнопки
+            return "callback", event.callback_query.data
+        message = event.message
+        if message is None or not message.text:
+            return None
+        return "text", message.text
+
+    def is_gpt_request(self, event: TelegramObject, data: Dict[str, Any], priority: int) -> bool:
+        if not isinstance(event, Update):
+            return False
+        if event.callback_query is not None:
+            return event.callback_query.data in self.coalesced_callbacks
+        message = event.message
+        if message is None or not message.text:
+            return False
+        if data.get("raw_state") is not None:
+            # В FSM команда или текст может оказаться ответом на вопрос
+            return False
+        command = message.text.split(maxsplit=1)[0].split("@", 1)[0]
+        # Свободный текст идёт в GigaChat, если получил низкий приоритет: чат был свободен
+        return command in self.coalesced_commands or priority == PRIORITY_LOW
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        chat = data.get("event_chat")
+        if chat is None:
+            return await handler(event, data)
+        queue = self._queues.get(chat.id)
+        chat_busy = chat.id in self._queues
+        # Текст за другими апдейтами чата может оказаться ответом для FSM, которую они запустят
+        priority = PRIORITY_HIGH if chat_busy else self.priority(event, data)
+        chat_queued = len(queue) if queue else 0
+        key = self.duplicate_key(event)
+
+        last = self._last.get(chat.id) if chat_busy else None
+        if key is not None and last is not None and last.key == key:
+            self.duplicates += 1
+            # Состояние FSM у повтора уже не проверить (его поменяет первый апдейт), решает первый
+            if last.coalesce:
+                self.coalesced += 1
+                if event.callback_query is not None:
+                    self._answer(event.callback_query.answer(DUPLICATE_TEXT))
+                return None
+        if chat_queued >= self.chat_queue_limit:
+            self.dropped += 1
+            self._reply(event, FLOOD_TEXT)
+            return None
+        if priority == PRIORITY_LOW and self.queued >= self.shed_limit:
+            self.shed += 1
+            self._reply(event, OVERLOADED_TEXT)
+            return None
+        if self.queued >= self.queue_limit:
+            # Поллинг стоит, пока не освободится место, апдейты ждут в Telegram
+            self.backpressure_waits += 1
+            while self.queued >= self.queue_limit:
+                self._space.clear()
+                await self._space.wait()
+            queue = self._queues.get(chat.id)
+
+        if queue is None:
+            queue = self._queues[chat.id] = deque()
+        job = self._last[chat.id] = Job(handler, event, data, priority, time.monotonic(), key,
+                                        self.is_gpt_request(event, data, priority))
+        queue.append(job)
+        self.queued += 1
+        self.queued_low += priority == PRIORITY_LOW
+        self.max_queued = max(self.max_queued, self.queued)
+        self._idle.clear()
+        if len(queue) == 1 and chat.id not in self._running:
+            self._ready[priority].append(chat.id)
+        self._dispatch()
+        return None
+
+    def _reply(self, event: TelegramObject, text: str):
+        message = event.message if isinstance(event, Update) else None
+        if message is None:
+            return
+        self._answer(message.answer(text))
+
+    def _answer(self, method: Awaitable):
+        # Ответы на отброшенные апдейты уходят в фоне, не задерживая поллинг
+        task = asyncio.ensure_future(method)
+        self._replies.add(task)
+        task.add_done_callback(self._replies.discard)
+
+    def _dispatch(self):
+        # Низкий приоритет получает слот, только если не ждут апдейты с высоким
+        while len(self._running) < self.concurrency:
+            ready = self._ready[PRIORITY_HIGH] or self._ready[PRIORITY_LOW]
+            if not ready:
+                return
+            chat_id = ready.popleft()
+            job = self._queues[chat_id].popleft()
+            self.queued -= 1
+            self.queued_low -= job.priority == PRIORITY_LOW
+            self._space.set()
+            self.started += 1
+            waited = time.monotonic() - job.enqueued_at
+            UPDATE_QUEUE_SECONDS.observe(waited, priority=PRIORITY_NAMES[job.priority])
+            self.total_wait_time += waited
+            self.max_wait_time = max(self.max_wait_time, waited)
+            self._running[chat_id] = asyncio.create_task(self._run(chat_id, job))
+
+    async def _run(self, chat_id: int, job: Job):
+        try:
+            state = job.data.get("state")
+            if state is not None:
+                # Состояние FSM читается заново: предыдущий апдейт чата мог его изменить
+                job.data["raw_state"] = await state.get_state()
+            await job.handler(job.event, job.data)
+            self.processed += 1
+        except Exception as e:
+            self.errors += 1
+            print(f"Error processing update in chat {chat_id}: {e}")
+        finally:
+            del self._running[chat_id]
+            queue = self._queues[chat_id]
+            if queue:
+                self._ready[queue[0].priority].append(chat_id)
+            else:
+                del self._queues[chat_id]
+                del self._last[chat_id]
+                drained = self._drained.pop(chat_id, None)
+                if drained is not None:
+                    drained.set()
+            if not self._queues:
+                self._idle.set()
+            self._dispatch()
+
+    async def join(self, chat_id: int):
+        # Ждёт, пока выполнятся все принятые апдейты чата
+        if chat_id not in self._queues:
+            return
+        await self._drained.setdefault(chat_id, asyncio.Event()).wait()
+
+    async def close(self, timeout: float = UPDATE_DRAIN_TIMEOUT):
+        # Дожидаемся принятых апдейтов, чтобы хранилища закрылись после них
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            print(f"Update scheduler stopped with {self.queued} queued updates")
+        if self._replies:
+            await asyncio.gather(*self._replies, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            "queued": self.queued,
+            "queued_low_priority": self.queued_low,
+            "max_queued": self.max_queued,
+            "running": len(self._running),
+            "chats": len(self._queues),
+            "processed": self.processed,
+            "errors": self.errors,
+            "shed": self.shed,
+            "dropped": self.dropped,
+            "duplicates": self.duplicates,
+            "coalesced": self.coalesced,
+            "backpressure_waits": self.backpressure_waits,
+            "avg_wait_seconds": round(self.total_wait_time / self.started, 3) if self.started else 0.0,
+            "max_wait_seconds": round(self.max_wait_time, 3),
+        }
+
+
+update_scheduler = UpdateScheduler()
+register_collector("updates", update_scheduler.stats)
@@ -0,0 +1,166 @@
+import asyncio
+import os
+import signal
+import sys
+from typing import Awaitable, Callable, Dict, List
+
+from aiogram import Bot, Dispatcher
+
+from common.workers import WORKERS, WORKER_ID, worker_for
+
+# Режим вебхука с несколькими процессами.
+# Главный процесс принимает апдейты от Telegram на одном порту и пересылает
+# каждый воркеру chat_id % WORKERS на его локальный порт. Следующий апдейт
+# чата уходит только после того, как воркер принял предыдущий, а воркер
+# обрабатывает апдейты одного чата строго по очереди, разные чаты - параллельно.
+
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+# Воркер N слушает 127.0.0.1:WORKER_BASE_PORT + N
+WORKER_BASE_PORT = int(os.getenv("WORKER_BASE_PORT", "8100"))
+# Сколько секунд главный процесс пытается достучаться до воркера (например, пока тот перезапускается)
+WORKER_FORWARD_TIMEOUT = float(os.getenv("WORKER_FORWARD_TIMEOUT", "30"))
+WORKER_RESTART_DELAY = float(os.getenv("WORKER_RESTART_DELAY", "1"))
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def update_chat_id(update: dict) -> int:
+    for key in ("message", "edited_message"):
+        if key in update:
+            return update[key]["chat"]["id"]
+    callback_query = update.get("callback_query")
+    if callback_query:
+        message = callback_query.get("message")
+        return message["chat"]["id"] if message else callback_query["from"]["id"]
+    return 0
+
+
+class ChatSerializer:
+    # Выполняет задачи одного чата по очереди, задачи разных чатов - параллельно
+    def __init__(self):
+        self._locks: Dict[int, asyncio.Lock] = {}
+        self._waiting: Dict[int, int] = {}
+
+    async def run(self, chat_id: int, func: Callable[[], Awaitable]):
+        lock = self._locks.setdefault(chat_id, asyncio.Lock())
+        self._waiting[chat_id] = self._waiting.get(chat_id, 0) + 1
+        try:
+            async with lock:
+                return await func()
+        finally:
+            self._waiting[chat_id] -= 1
+            if not self._waiting[chat_id]:
+                del self._waiting[chat_id]
+                del self._locks[chat_id]
+
+
+async def _wait_for_stop_signal():
+    # SIGTERM завершает процесс штатно, с сохранением данных хранилищ
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+    await stop.wait()
+
+
+async def _supervise_worker(worker_id: int):
+    # Воркер - тот же main.py с WORKER_ID, упавший процесс запускается заново
+    env = {**os.environ, "WORKER_ID": str(worker_id)}
+    while True:
+        process = await asyncio.create_subprocess_exec(sys.executable, sys.argv[0], env=env)
+        try:
+            code = await process.wait()
+        except asyncio.CancelledError:
+            process.terminate()
+            await process.wait()
+            raise
+        print(f"Worker {worker_id} exited with code {code}, restarting")
+        await asyncio.sleep(WORKER_RESTART_DELAY)
+
+
+async def run_master():
+    from aiohttp import ClientError, ClientSession, web
+
+    serializer = ChatSerializer()
+    session = ClientSession()
+
+    async def forward(worker_id: int, body: bytes) -> bool:
+        url = f"http://127.0.0.1:{WORKER_BASE_PORT + worker_id}/update"
+        deadline = asyncio.get_running_loop().time() + WORKER_FORWARD_TIMEOUT
+        while True:
+            try:
+                async with session.post(url, data=body, headers={"Content-Type": "application/json"}) as response:
+                    if response.status == 200:
+                        return True
+            except ClientError:
+                pass
+            if asyncio.get_running_loop().time() >= deadline:
+                return False
+            await asyncio.sleep(0.5)
+
+    async def handle_update(request: web.Request) -> web.Response:
+        if WEBHOOK_SECRET and request.headers.get(SECRET_HEADER) != WEBHOOK_SECRET:
+            return web.Response(status=401)
+        body = await request.read()
+        chat_id = update_chat_id(await request.json())
+        worker_id = worker_for(chat_id)
+        if not await serializer.run(chat_id, lambda: forward(worker_id, body)):
+            print(f"Worker {worker_id} is unavailable, update for chat {chat_id} will be redelivered")
+            # Telegram повторит доставку апдейта позже
+            return web.Response(status=503)
+        return web.Response()
+
+    supervisors: List[asyncio.Task] = [asyncio.create_task(_supervise_worker(i)) for i in range(WORKERS)]
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, handle_update)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+    print(f"Webhook listening on {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}, {WORKERS} workers")
+    try:
+        await _wait_for_stop_signal()
+    finally:
+        for task in supervisors:
+            task.cancel()
+        await asyncio.gather(*supervisors, return_exceptions=True)
+        await runner.cleanup()
+        await session.close()
+
+
+async def serve_worker(dp: Dispatcher, bot: Bot, **kwargs):
+    from aiohttp import web
+
+    serializer = ChatSerializer()
+    tasks: set = set()
+
+    async def process(update: dict):
+        try:
+            await dp.feed_raw_update(bot, update, **kwargs)
+        except Exception as e:
+            print(f"Error processing update {update.get('update_id')}: {e}")
+
+    async def handle_update(request: web.Request) -> web.Response:
+        update = await request.json()
+        chat_id = update_chat_id(update)
+        # Отвечаем сразу, обработка идёт в фоне в порядке поступления апдейтов чата
+        task = asyncio.create_task(serializer.run(chat_id, lambda: process(update)))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_post("/update", handle_update)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", WORKER_BASE_PORT + WORKER_ID).start()
+    print(f"Worker {WORKER_ID} started")
+    try:
+        await _wait_for_stop_signal()
+    finally:
+        await runner.cleanup()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
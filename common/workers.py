@@ -0,0 +1,27 @@
+import os
+
+# Разбиение чатов между процессами-воркерами в режиме вебхука.
+# Апдейты чата всегда попадают в воркер chat_id % WORKERS, поэтому данные,
+# которые пишет один процесс (история диалогов, профили, статистика),
+# хранятся в отдельном файле на воркер. Число воркеров нельзя менять без
+# переноса этих файлов: иначе чаты окажутся у воркера, который их не видит.
+
+WORKERS = max(int(os.getenv("WORKERS", "1")), 1)
+# Номер текущего воркера, задаётся главным процессом при запуске
+WORKER_ID = int(os.getenv("WORKER_ID", "0"))
+
+
+def worker_for(chat_id: int) -> int:
+    return chat_id % WORKERS
+
+
+def owns(chat_id: int) -> bool:
+    return worker_for(chat_id) == WORKER_ID
+
+
+def shard_path(path: str) -> str:
+    # При одном воркере файлы остаются на прежних местах
+    if WORKERS == 1:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.w{WORKER_ID}{ext}"
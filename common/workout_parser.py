@@ -0,0 +1,159 @@
+import re
+from typing import Dict, Optional
+
+# Разбор тренировки, записанной одним сообщением, например
+# "5.2 км 27:30 пульс 152 410 ккал". Понимает дробные числа (через точку
+# или запятую), время в виде мм:сс и чч:мм:сс, единицы измерения и
+# ключевые слова перед числом. Ключевое слово получает ближайшее число после
+# себя, даже если за числом идёт единица другого поля ("пульс 150 калории
+# 400": 150 - пульс, а "калории" - ключевое слово для 400). Числа без единиц
+# раскладываются по свободным полям в порядке вопросов /tracking, пропуская
+# поля, в допустимый диапазон которых число не попадает. Значения вне
+# диапазона не извлекаются, и бот спросит о них отдельно.
+
+FIELDS = ("distance", "time", "pace", "pulse", "calories")
+
+# Допустимые значения: (минимум не включая, максимум включая)
+LIMITS = {
+    "distance": (0, 60),
+    "time": (0, 24 * 60),
+    "pace": (0, 44),
+    "pulse": (90, 240),
+    "calories": (0, 5999),
+}
+
+# Единица после числа: поле и множитель к единице хранения (км, минуты, км/ч, уд/мин, ккал)
+UNITS = (
+    (r"км/ч|km/h|kmh|кмч", "pace", 1),
+    (r"мин/км|min/km", "pace_per_km", 1),
+    (r"км|km|k", "distance", 1),
+    (r"метр[а-яё]*", "distance", 0.001),
+    # Просто "м": метры от METERS_MIN, иначе минуты ("5км 30м")
+    (r"м|m", "meters_or_minutes", 1),
+    (r"ч|час[а-яё]*|h", "time", 60),
+    (r"мин[а-яё]*|min", "time", 1),
+    (r"сек[а-яё]*|с|sec|s", "time", 1 / 60),
+    (r"уд[а-яё]*(?:/мин)?|bpm", "pulse", 1),
+    (r"ккал|kcal|кал[а-яё]*|cal", "calories", 1),
+)
+UNIT_FIELDS = {f"u{index}": (field, factor) for index, (_, field, factor) in enumerate(UNITS)}
+METERS_MIN = 100
+
+# Слово перед числом: "пульс 152", "темп 5:20"
+KEYWORDS = {
+    "distance": r"дистанц[а-яё]*|distance",
+    "time": r"время|time",
+    "pace": r"темп|скорост[а-яё]*|pace|speed",
+    "pulse": r"пульс[а-яё]*|чсс|hr|pulse",
+    "calories": r"калори[а-яё]*|calories|ккал|kcal",
+}
+KEYWORD_RES = {field: re.compile(pattern, re.IGNORECASE) for field, pattern in KEYWORDS.items()}
+
+NUMBER = r"\d+(?:[.,]\d+)?"
+# Число может идти сразу за ключевым словом: "пульс150"
+KEYWORD_GROUPS = "|".join(f"(?P<k_{field}>\\b(?:{pattern})(?![a-zа-яё]))" for field, pattern in KEYWORDS.items())
+TOKEN_RE = re.compile(
+    r"(?P<keyword>" + KEYWORD_GROUPS + ")"
+    r"|(?P<duration>\d{1,2}:\d{2}(?::\d{2})?)"
+    r"|(?P<number>" + NUMBER + ")"
+    r"(?:\s*(?P<unit>" + "|".join(f"(?P<u{index}>(?:{pattern})(?![\\wа-яё]))" for index, (pattern, _, _)
+                                   in enumerate(UNITS)) + "))?",
+    re.IGNORECASE,
+)
+DURATION_UNIT_RE = re.compile(r"\s*(?:мин/км|min/km|/км|/km)", re.IGNORECASE)
+
+
+def parse_duration(text: str) -> float:
+    # мм:сс или чч:мм:сс в минутах
+    parts = [int(part) for part in text.split(":")]
+    if len(parts) == 3:
+        return parts[0] * 60 + parts[1] + parts[2] / 60
+    return parts[0] + parts[1] / 60
+
+
+def parse_number(text: str) -> float:
+    return float(text.replace(",", "."))
+
+
+def _fits(field: str, value: float) -> bool:
+    low, high = LIMITS[field]
+    return low < value <= high
+
+
+def _normalize(field: str, value: float):
+    if field in ("pulse", "calories"):
+        return int(round(value))
+    value = round(value, 2)
+    return int(value) if value.is_integer() else value
+
+
+def parse_workout(text: str, expected: Optional[str] = None) -> Dict[str, float]:
+    # expected - поле, о котором бот спросил: число без единиц в первую очередь относится к нему
+    found: Dict[str, float] = {}
+    bare = []
+    keyword = None
+    # "1 ч 5 мин" - одно время из нескольких частей
+    time_parts = False
+    for match in TOKEN_RE.finditer(text):
+        if match.group("keyword"):
+            keyword = next(field for field in KEYWORDS if match.group(f"k_{field}"))
+            continue
+
+        field = None
+        unit = None
+        next_keyword = None
+        if match.group("duration"):
+            value = parse_duration(match.group("duration"))
+            # Время на километр ("5:20 мин/км" или "темп 5:20") переводится в км/ч
+            if keyword == "pace" or DURATION_UNIT_RE.match(text, match.end()):
+                field, value = "pace", 60 / value if value else 0
+            else:
+                field = "time"
+        else:
+            value = parse_number(match.group("number"))
+            unit = next((name for name in UNIT_FIELDS if match.group(name)), None)
+            if unit is not None:
+                field, factor = UNIT_FIELDS[unit]
+                if field == "meters_or_minutes":
+                    if keyword in ("distance", "time"):
+                        field = keyword
+                    else:
+                        field = "distance" if value >= METERS_MIN else "time"
+                    factor = 0.001 if field == "distance" else 1
+                if field == "pace_per_km":
+                    field, number = "pace", 60 / value if value else 0
+                else:
+                    number = value * factor
+                if keyword is None or field == keyword:
+                    value = number
+                else:
+                    # Число относится к ожидающему ключевому слову, а слово после него - к следующему числу
+                    next_keyword = next((name for name, pattern in KEYWORD_RES.items()
+                                         if pattern.fullmatch(match.group("unit"))), None)
+                    field, unit = keyword, None
+            elif keyword is not None:
+                field = keyword
+        keyword = next_keyword
+
+        if field == "time" and unit is not None and time_parts:
+            value += found.pop("time", 0)
+        time_parts = field == "time" and unit is not None
+        if field is None:
+            bare.append(value)
+        elif field not in found and _fits(field, value):
+            found[field] = _normalize(field, value)
+
+    order = FIELDS if expected is None else (expected,) + tuple(field for field in FIELDS if field != expected)
+    for value in bare:
+        field = next((field for field in order if field not in found and _fits(field, value)), None)
+        if field is not None:
+            found[field] = _normalize(field, value)
+    return found
+
+
+def derive_pace(distance: float, time: float) -> Optional[float]:
+    # Средняя скорость в км/ч по дистанции и времени в минутах
+    if not distance or not time:
+        return None
+    pace = round(distance / (time / 60), 1)
+    return pace if _fits("pace", pace) else None
@@ -0,0 +1,275 @@
+import asyncio
+import bisect
+import json
+import os
+from collections import OrderedDict
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from common.metrics import STORAGE_SECONDS
+from common.workers import owns
+
+# Хранилище записанных тренировок.
+# Данные разбиты по пользователям: у каждого свой сжатый файл <user_id>.csv
+# и журнал <user_id>.jsonl, в который новая тренировка дописывается одной
+# строкой. Фоновая задача переносит накопившийся журнал в csv. Каждая запись
+# получает порядковый номер seq внутри пользователя, поэтому повторное
+# применение журнала после сбоя не даёт дублей. Старый user_tracking_data.xlsx
+# импортируется один раз.
+# У каждой записи есть время тренировки recorded_at. Записи читавшихся недавно
+# пользователей держатся в памяти отсортированными по времени, поэтому выборка
+# за период (неделя, месяц) - это два бинарных поиска и срез списка.
+
+TRACKING_DIR = "tracking_data"
+LEGACY_TRACKING_FILE = "user_tracking_data.xlsx"
+IMPORTED_MARKER = ".imported"
+
+COMPACT_INTERVAL = int(os.getenv("TRACKING_COMPACT_INTERVAL", "300"))
+# Журнал пользователя сворачивается, когда в нём накопилось столько записей
+COMPACT_MIN_RECORDS = int(os.getenv("TRACKING_COMPACT_MIN_RECORDS", "20"))
+# Для скольких пользователей держать в памяти индекс тренировок по времени
+INDEX_MAX_USERS = int(os.getenv("TRACKING_INDEX_MAX_USERS", "1000"))
+
+
+def workout_time(record: dict) -> float:
+    # Время тренировки в секундах; записи из старого xlsx без даты идут раньше всех
+    recorded_at = record.get("recorded_at")
+    if isinstance(recorded_at, str) and recorded_at:
+        try:
+            return datetime.fromisoformat(recorded_at).timestamp()
+        except ValueError:
+            pass
+    return float("-inf")
+
+
+def _sort_key(record: dict) -> Tuple[float, int]:
+    return workout_time(record), record["seq"]
+
+
+class WorkoutIndex:
+    # Записи одного пользователя по возрастанию времени тренировки
+    def __init__(self, records: List[dict]):
+        self.records = sorted(records, key=_sort_key)
+        self.times = [workout_time(record) for record in self.records]
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def add(self, record: dict):
+        # Тренировка из файла может оказаться старше уже записанных
+        position = bisect.bisect_right(self.times, workout_time(record))
+        self.times.insert(position, workout_time(record))
+        self.records.insert(position, record)
+
+    def slice(self, since: Optional[datetime] = None, until: Optional[datetime] = None) -> List[dict]:
+        start = bisect.bisect_left(self.times, since.timestamp()) if since else 0
+        end = bisect.bisect_left(self.times, until.timestamp()) if until else len(self.times)
+        return self.records[start:end]
+
+
+class WorkoutStore:
+    def __init__(self, directory: str = TRACKING_DIR, legacy_path: str = LEGACY_TRACKING_FILE):
+        self.directory = directory
+        self.legacy_path = legacy_path
+        self._last_seq: Dict[int, int] = {}
+        self._journal_records: Dict[int, int] = {}
+        self._locks: Dict[int, asyncio.Lock] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._listeners: List[Callable[[dict], None]] = []
+        self._indexes: "OrderedDict[int, WorkoutIndex]" = OrderedDict()
+        self.max_indexed_users = INDEX_MAX_USERS
+
+    def add_listener(self, listener: Callable[[dict], None]):
+        # Слушатель получает каждую новую запись сразу после сохранения
+        self._listeners.append(listener)
+
+    # Пользователи раскладываются по 256 подкаталогам, чтобы не держать тысячи файлов в одном
+    def _partition_dir(self, user_id: int) -> str:
+        return os.path.join(self.directory, f"{user_id % 256:02x}")
+
+    def _base_path(self, user_id: int) -> str:
+        return os.path.join(self._partition_dir(user_id), f"{user_id}.csv")
+
+    def _journal_path(self, user_id: int) -> str:
+        return os.path.join(self._partition_dir(user_id), f"{user_id}.jsonl")
+
+    def user_ids(self, active_since: Optional[float] = None) -> List[int]:
+        # Все пользователи с записанными тренировками, обслуживаемые этим воркером.
+        # active_since (unix time) оставляет тех, чьи файлы менялись не раньше этого момента
+        user_ids = set()
+        if not os.path.isdir(self.directory):
+            return []
+        for partition in os.scandir(self.directory):
+            if not partition.is_dir():
+                continue
+            for entry in os.scandir(partition.path):
+                name, ext = os.path.splitext(entry.name)
+                if ext not in (".csv", ".jsonl") or not name.isdigit() or not owns(int(name)):
+                    continue
+                if active_since is None or entry.stat().st_mtime >= active_since:
+                    user_ids.add(int(name))
+        return sorted(user_ids)
+
+    def _lock(self, user_id: int) -> asyncio.Lock:
+        lock = self._locks.get(user_id)
+        if lock is None:
+            lock = self._locks[user_id] = asyncio.Lock()
+        return lock
+
+    def _read_records(self, user_id: int) -> Tuple[List[dict], int]:
+        # Возвращает записи пользователя и сколько из них ещё лежит в журнале
+        import pandas as pd
+
+        records = []
+        base_path = self._base_path(user_id)
+        if os.path.exists(base_path):
+            records = pd.read_csv(base_path).to_dict("records")
+        # csv отсортирован по времени тренировки, поэтому последний номер ищем по всем записям
+        base_seq = max((record["seq"] for record in records), default=0)
+        base_count = len(records)
+
+        journal_path = self._journal_path(user_id)
+        if os.path.exists(journal_path):
+            with open(journal_path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Недописанная строка после аварийного завершения
+                        continue
+                    # Записи, уже перенесённые в csv, но не удалённые из журнала из-за сбоя
+                    if record["seq"] > base_seq:
+                        records.append(record)
+        return records, len(records) - base_count
+
+    def _write_base(self, user_id: int, records: List[dict]):
+        import pandas as pd
+
+        os.makedirs(self._partition_dir(user_id), exist_ok=True)
+        base_path = self._base_path(user_id)
+        tmp_path = base_path + ".tmp"
+        pd.DataFrame(records).to_csv(tmp_path, index=False)
+        os.replace(tmp_path, base_path)
+
+    def _compact_partition(self, user_id: int):
+        records, journal_count = self._read_records(user_id)
+        if journal_count:
+            self._write_base(user_id, sorted(records, key=_sort_key))
+        journal_path = self._journal_path(user_id)
+        if os.path.exists(journal_path):
+            os.remove(journal_path)
+
+    def import_legacy(self):
+        marker = os.path.join(self.directory, IMPORTED_MARKER)
+        if os.path.exists(marker):
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        if os.path.exists(self.legacy_path):
+            import pandas as pd
+
+            df = pd.read_excel(self.legacy_path)
+            df['user_id'] = pd.to_numeric(df['user_id'], errors='coerce')
+            df = df.dropna(subset=['user_id'])
+            df['user_id'] = df['user_id'].astype(int)
+            for user_id, user_df in df.groupby('user_id'):
+                if os.path.exists(self._base_path(user_id)) or os.path.exists(self._journal_path(user_id)):
+                    continue
+                user_df = user_df.reset_index(drop=True)
+                user_df.insert(0, 'seq', range(1, len(user_df) + 1))
+                self._write_base(user_id, user_df.to_dict("records"))
+        with open(marker, "w") as f:
+            f.write(self.legacy_path)
+
+    async def _ensure_seq(self, user_id: int) -> int:
+        if user_id not in self._last_seq:
+            await self._index(user_id)
+        return self._last_seq[user_id]
+
+    async def _index(self, user_id: int) -> WorkoutIndex:
+        # Вызывается под блокировкой пользователя
+        index = self._indexes.get(user_id)
+        if index is not None:
+            self._indexes.move_to_end(user_id)
+            return index
+        with STORAGE_SECONDS.time(store="workouts", operation="read"):
+            records, journal_count = await asyncio.to_thread(self._read_records, user_id)
+            index = WorkoutIndex(records)
+        self._last_seq[user_id] = max((record["seq"] for record in records), default=0)
+        self._journal_records[user_id] = journal_count
+        self._indexes[user_id] = index
+        while len(self._indexes) > self.max_indexed_users:
+            self._indexes.popitem(last=False)
+        return index
+
+    async def append(self, record: dict) -> int:
+        user_id = int(record['user_id'])
+        async with self._lock(user_id):
+            seq = await self._ensure_seq(user_id) + 1
+            record = {"seq": seq, **record, "user_id": user_id}
+            record.setdefault("recorded_at", datetime.now().isoformat(timespec="seconds"))
+            line = json.dumps(record, ensure_ascii=False)
+            os.makedirs(self._partition_dir(user_id), exist_ok=True)
+            # Одна короткая строка в конец файла пользователя, объём остальных данных не важен
+            with STORAGE_SECONDS.time(store="workouts", operation="append"):
+                with open(self._journal_path(user_id), "a", encoding="utf-8") as f:
+                    f.write(line + "\n")
+            self._last_seq[user_id] = seq
+            self._journal_records[user_id] = self._journal_records.get(user_id, 0) + 1
+            index = self._indexes.get(user_id)
+            if index is not None:
+                index.add(record)
+        for listener in self._listeners:
+            try:
+                listener(record)
+            except Exception as e:
+                print(f"Error in tracking listener: {e}")
+        return seq
+
+    async def records(self, user_id: int, since: Optional[datetime] = None,
+                      until: Optional[datetime] = None) -> List[dict]:
+        # Тренировки с since (включительно) по until (не включая), по возрастанию времени
+        async with self._lock(user_id):
+            index = await self._index(user_id)
+            return index.slice(since, until)
+
+    async def read(self, user_id: int, since: Optional[datetime] = None, until: Optional[datetime] = None):
+        import pandas as pd
+
+        return pd.DataFrame(await self.records(user_id, since, until))
+
+    async def version(self, user_id: int) -> int:
+        # Номер последней записи пользователя меняется с каждой новой тренировкой
+        if user_id in self._last_seq:
+            return self._last_seq[user_id]
+        async with self._lock(user_id):
+            return await self._ensure_seq(user_id)
+
+    async def compact(self, min_records: int = COMPACT_MIN_RECORDS):
+        for user_id, count in list(self._journal_records.items()):
+            if count < max(min_records, 1):
+                continue
+            async with self._lock(user_id):
+                with STORAGE_SECONDS.time(store="workouts", operation="compact"):
+                    await asyncio.to_thread(self._compact_partition, user_id)
+                self._journal_records[user_id] = 0
+
+    async def _compact_periodically(self):
+        while True:
+            await asyncio.sleep(COMPACT_INTERVAL)
+            try:
+                await self.compact()
+            except Exception as e:
+                print(f"Error compacting tracking data: {e}")
+
+    async def start(self):
+        await asyncio.to_thread(self.import_legacy)
+        if self._task is None:
+            self._task = asyncio.create_task(self._compact_periodically())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+workout_store = WorkoutStore()
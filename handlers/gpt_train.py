@@ -1,18 +1,23 @@
-import os
-import pandas as pd
+import os, asyncio
 from dotenv import load_dotenv, find_dotenv
-from langchain_gigachat import GigaChat
-from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain.prompts.chat import SystemMessagePromptTemplate, HumanMessagePromptTemplate
 from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
-from langchain_core.runnables import RunnablePassthrough
 from aiogram import Router, F
 from aiogram.filters import Command
 from aiogram.types import Message, callback_query
-from typing import Dict
+from typing import AsyncIterator, Dict, Optional, Tuple
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
 import logging
+from common.conversation_store import conversation_store
+from common.profile_store import profile_store
+from common.workout_store import workout_store
+from common.training_stats import TrainingStats, training_stats, describe_for_prompt, prompt_figures
+from common.llm_pool import llm_pool, PRIORITY_BACKGROUND
+from common.history_window import HistoryWindow
+from common.metrics import register_collector
+from common.response_cache import response_cache, normalize_profile
+from common.prefetch import prefetcher
+from common.telegram_stream import send_streaming, split_message
 
 # Загрузка переменных окружения
 load_dotenv(find_dotenv())
@@ -22,65 +27,66 @@ class KindTraining(StatesGroup):
 
 # Константы
 GIGACHAT_API = os.getenv('ACCESS_TOKEN')
-EXCEL_FILE = "user_data.xlsx"
-MEMORY_COLUMN = "memory"
-USER_ID_COLUMN = "user_id"
-
-# Инициализация GigaChat
-chat = GigaChat(credentials=GIGACHAT_API, verify_ssl_certs=False)
-
-gpt_speaking_router = Router()
-
-def load_user_data() -> Dict[int, list]:
-    try:
-        df = pd.read_excel(EXCEL_FILE, index_col=USER_ID_COLUMN, engine="openpyxl")
-        # Преобразование словаря из строки обратно в словарь
-        user_data = {
-            user_id: eval(memory_str)
-            for user_id, memory_str in df[MEMORY_COLUMN].items()
-        }
-    except FileNotFoundError:
-        user_data = {}
-    return user_data
-
-
-def save_user_data(user_data: Dict[int, list]):
-    # Преобразование словаря в строку для сохранения
-    data_to_save = {
-        user_id: str(memory)
-        for user_id, memory in user_data.items()
-    }
-    df = pd.DataFrame.from_dict(data_to_save, orient='index', columns=[MEMORY_COLUMN])
-    df.index.name = USER_ID_COLUMN
-    df.to_excel(EXCEL_FILE, engine="openpyxl")
+# Потоковая отправка ответа: сообщение появляется с первым фрагментом и дописывается по мере генерации
+GPT_STREAMING = os.getenv('GPT_STREAMING', '1') == '1'
+NOT_REGISTERED_TEXT = "Пожалуйста, сначала зарегистрируйтесь через /start."
+GPT_TIMEOUT_TEXT = "GigaChat сейчас перегружен и не ответил вовремя, попробуйте чуть позже."
 
+gpt_speaking_router = Router(name="gpt_speaking")
 
 def get_user_memory(user_id: int) -> list:
-    user_data = load_user_data()
-    if user_id not in user_data:
-        user_data[user_id] = []
-        save_user_data(user_data)
-    return user_data[user_id]
+    return conversation_store.get(user_id)
 
 
 def clear_user_memory(user_id: int):
-    user_data = load_user_data()
-    if user_id in user_data:
-        user_data[user_id] = []  # Очищаем историю, устанавливая пустой список
-        save_user_data(user_data)
+    conversation_store.clear(user_id)
 
-system_template = "You are a helpful AI that helps runners reach new heights. Talk in Russian."
-system_message_prompt = SystemMessagePromptTemplate.from_template(system_template)
+system_template = "You are a helpful AI that helps runners reach new heights. Talk in Russian.{summary}"
 human_template = "{user_message}"
-human_message_prompt = HumanMessagePromptTemplate.from_template(human_template)
 
-prompt = ChatPromptTemplate.from_messages(
-    [
-        system_message_prompt,
-        MessagesPlaceholder(variable_name="history"),
-        human_message_prompt,
-    ]
-)
+# LangChain и клиент GigaChat тяжёлые, поэтому загружаются при первом запросе к модели, а не при старте бота
+_chat = None
+_prompt = None
+
+
+def get_chat():
+    global _chat
+    if _chat is None:
+        from langchain_gigachat import GigaChat
+        _chat = GigaChat(credentials=GIGACHAT_API, verify_ssl_certs=False)
+    return _chat
+
+
+def get_prompt():
+    global _prompt
+    if _prompt is None:
+        from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+        from langchain_core.prompts.chat import SystemMessagePromptTemplate, HumanMessagePromptTemplate
+        _prompt = ChatPromptTemplate.from_messages(
+            [
+                SystemMessagePromptTemplate.from_template(system_template),
+                MessagesPlaceholder(variable_name="history"),
+                HumanMessagePromptTemplate.from_template(human_template),
+            ]
+        )
+    return _prompt
+
+summary_template = ("Кратко перескажи диалог бегуна с ассистентом-тренером. Сохрани цели, параметры, "
+                    "самочувствие, жалобы и договорённости, опусти сами тексты тренировок. Не больше 150 слов.")
+
+
+async def summarize_history(previous_summary: str, messages: list) -> str:
+    dialog = "\n".join(f"{message['role']}: {message['content']}" for message in messages)
+    if previous_summary:
+        dialog = f"Предыдущая сводка: {previous_summary}\n\n{dialog}"
+    # Сводка готовится в фоне и не должна занимать слоты, нужные запросам пользователей
+    response = await llm_pool.run(lambda: get_chat().ainvoke([("system", summary_template), ("human", dialog)]),
+                                  priority=PRIORITY_BACKGROUND)
+    return response.content
+
+
+history_window = HistoryWindow(conversation_store, summarize_history)
+register_collector("history_window", history_window.stats)
 
 kind_of_training_keyboard = InlineKeyboardMarkup(
     inline_keyboard=[
@@ -91,28 +97,188 @@ kind_of_training_keyboard = InlineKeyboardMarkup(
     ]
 )
 
-def get_gpt_response(user_id: int, message: str) -> str:
-    # Получаем историю из хранилища
-    user_history = get_user_memory(user_id)
+# Виды тренировок из kind_of_training_keyboard
+TRAINING_TYPES = {
+    "interval_training": "интервальную",
+    "long_training": "длительную",
+    "speed_training": "скоростную",
+    "refresh_training": "восстановительную",
+}
+ADVICE_KINDS = ("equipment", "nutrition", *TRAINING_TYPES)
+# Кнопки и команды, которые запрашивают GigaChat: их повторы update_scheduler присоединяет к первому запросу
+GPT_CALLBACKS = (*TRAINING_TYPES, *(f"fresh:{kind}" for kind in ADVICE_KINDS))
+GPT_COMMANDS = ("/get_equipment", "/get_nutrition")
+
+
+def refresh_keyboard(kind: str) -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(
+        inline_keyboard=[[InlineKeyboardButton(text="Другой вариант", callback_data=f"fresh:{kind}")]]
+    )
 
-    chain = (
+
+def advice_request(kind: str, user_data: dict, stats: Optional[TrainingStats] = None) -> Tuple[dict, str]:
+    # Запрос строится из округлённых данных профиля, они же служат ключом кэша ответов
+    if kind == "equipment":
+        inputs = normalize_profile(user_data, ("age", "weight", "height"))
+        user_message = (f"дай совет про экипировку для бега, имея следующие данные:"
+                        f"\nвозраст - {inputs['age']},"
+                        f"\nвес - {inputs['weight']},"
+                        f"\nрост - {inputs['height']}")
+    elif kind == "nutrition":
+        inputs = normalize_profile(user_data, ("age", "weight", "height", "training_frequency"))
+        user_message = (f"дай совет про то, чем лучше питаться исходя из следующих данных:"
+                        f"\nвозраст - {inputs['age']},"
+                        f"\nвес - {inputs['weight']},"
+                        f"\nрост - {inputs['height']},"
+                        f"\nчастота тренировок - {inputs['training_frequency']}")
+    else:
+        inputs = normalize_profile(user_data, ("age", "weight", "height", "experience_running",
+                                               "target_distance", "training_frequency"))
+        # Сводка по записанным тренировкам делает ответ личным. Её показатели округляются, как и поля
+        # профиля, и входят в ключ: бегуны с близкими профилем и нагрузкой получают один план
+        figures = prompt_figures(stats) if stats is not None else {}
+        figures = normalize_profile(figures, figures)
+        inputs.update(figures)
+        user_message = (f"Составь {TRAINING_TYPES[kind]} тренировку для бега, имея следующие данные человека:"
+                        f" возраст - {inputs['age']},"
+                        f" вес - {inputs['weight']},"
+                        f" рост - {inputs['height']},"
+                        f" опыт бега в (месяцах) - {inputs['experience_running']},"
+                        f" цель пробежать - {inputs['target_distance']},"
+                        f" желаемая частота тренировок - {inputs['training_frequency']}"
+                        f"{describe_for_prompt(figures)}")
+    return inputs, user_message
+
+
+def build_chain(user_id: Optional[int], with_history: bool = True):
+    from langchain_core.runnables import RunnablePassthrough
+
+    # Получаем из хранилища сводку и последние сообщения в пределах бюджета токенов
+    summary, user_history = history_window.build(user_id) if with_history else ("", [])
+    summary_text = f"\n\nКраткое содержание предыдущего диалога: {summary}" if summary else ""
+
+    return (
             RunnablePassthrough.assign(
-                history=lambda _: user_history
+                history=lambda _: user_history,
+                summary=lambda _: summary_text
             )
-            | prompt
-            | chat
+            | get_prompt()
+            | get_chat()
     )
-    response = chain.invoke({"user_message": message})
 
-    user_data = load_user_data()
-    user_data[user_id].extend([
+
+def save_exchange(user_id: int, message: str, response: str):
+    conversation_store.append(user_id, [
         {"role": "user", "content": message},
-        {"role": "assistant", "content": response.content}
+        {"role": "assistant", "content": response}
     ])
-    save_user_data(user_data)
 
+
+async def get_gpt_response(user_id: int, message: str, with_history: bool = True) -> str:
+    chain = build_chain(user_id, with_history)
+    response = await llm_pool.run(lambda: chain.ainvoke({"user_message": message}))
+    save_exchange(user_id, message, response.content)
     return response.content
 
+
+async def stream_gpt_response(user_id: int, message: str, with_history: bool = True) -> AsyncIterator[str]:
+    chain = build_chain(user_id, with_history)
+    parts = []
+    async for chunk in llm_pool.stream(lambda: chain.astream({"user_message": message})):
+        if chunk.content:
+            parts.append(chunk.content)
+            yield chunk.content
+    # В историю попадает только полностью полученный ответ
+    save_exchange(user_id, message, "".join(parts))
+
+
+async def send_gpt_response(message: Message, user_id: int, user_message: str, reply: bool = False,
+                            with_history: bool = True) -> str:
+    if GPT_STREAMING:
+        return await send_streaming(message, stream_gpt_response(user_id, user_message, with_history), reply=reply)
+
+    response = await get_gpt_response(user_id, user_message, with_history)
+    for part in split_message(response):
+        if reply:
+            await message.reply(part)
+        else:
+            await message.answer(part)
+    return response
+
+
+async def generate_advice(key, user_message: str):
+    # Фоновая генерация без истории диалога, результат сразу попадает в кэш
+    chain = build_chain(None, with_history=False)
+    response = await llm_pool.run(lambda: chain.ainvoke({"user_message": user_message}), priority=PRIORITY_BACKGROUND)
+    response_cache.put(key, response.content)
+
+
+def refresh_in_background(key, user_message: str):
+    prefetcher.submit(key, lambda: generate_advice(key, user_message))
+
+
+async def prefetch_plans(user_id: int):
+    # Все четыре вида тренировок готовятся заранее, чтобы кнопка отвечала сразу
+    user_data = profile_store.get(user_id)
+    if user_data is None:
+        return
+    stats = await training_stats.get(user_id)
+    for kind in TRAINING_TYPES:
+        inputs, user_message = advice_request(kind, user_data, stats)
+        key = response_cache.make_key(kind, inputs)
+        cached = await response_cache.load(key, peek=True)
+        if cached is None or cached.stale:
+            refresh_in_background(key, user_message)
+
+
+def submit_plans(user_id: int):
+    prefetcher.submit(("plans", user_id), lambda: prefetch_plans(user_id))
+
+
+def on_profile_changed(profile: dict):
+    submit_plans(profile['user_id'])
+
+
+def on_workout(record: dict):
+    # Новая тренировка может изменить округлённую статистику в запросе, тогда нужен новый план
+    submit_plans(int(record['user_id']))
+
+
+profile_store.add_listener(on_profile_changed)
+workout_store.add_listener(on_workout)
+
+
+async def send_advice(message: Message, user_id: int, kind: str, fresh: bool = False) -> Optional[str]:
+    user_data = profile_store.get(user_id)
+    if user_data is None:
+        await message.answer(NOT_REGISTERED_TEXT)
+        return None
+    stats = await training_stats.get(user_id) if kind in TRAINING_TYPES else None
+    inputs, user_message = advice_request(kind, user_data, stats)
+    key = response_cache.make_key(kind, inputs)
+
+    if fresh:
+        response_cache.bypassed += 1
+    else:
+        entry = await response_cache.load(key)
+        if entry is not None:
+            cached = entry.response
+            if entry.stale:
+                # Отвечаем устаревшим ответом сразу, новый подготовится в фоне
+                refresh_in_background(key, user_message)
+            save_exchange(user_id, user_message, cached)
+            parts = split_message(cached)
+            for index, part in enumerate(parts):
+                # Под готовым ответом кнопка, по которой можно получить новый
+                await message.answer(part, reply_markup=refresh_keyboard(kind) if index == len(parts) - 1 else None)
+            return cached
+
+    # Ответ зависит только от профиля, а не от истории диалога, иначе его нельзя было бы отдать другим
+    response = await send_gpt_response(message, user_id, user_message, with_history=False)
+    if response:
+        response_cache.put(key, response)
+    return response
+
 @gpt_speaking_router.message(Command("gpt_use"))
 async def command_start_handler(message: Message) -> None:
     await message.answer(f"Привет, {message.from_user.full_name}! Я помогу тебе достичь новых высот в беге. Задавай свои вопросы!")
@@ -129,37 +295,29 @@ async def get_personal_training(message:Message):
                          "(интервальная, темповая, длительная, восстановительная)?", reply_markup=kind_of_training_keyboard)
 
 
-@gpt_speaking_router.callback_query(
-    F.data.in_(["interval_training", "long_training", "speed_training", "refresh_training"]))
+@gpt_speaking_router.callback_query(F.data.in_(list(TRAINING_TYPES)))
 async def make_training(callback_query: CallbackQuery):
+    await answer_advice(callback_query, callback_query.data)
+
+
+@gpt_speaking_router.callback_query(F.data.startswith("fresh:"))
+async def refresh_advice(callback_query: CallbackQuery):
+    kind = callback_query.data.split(":", 1)[1]
+    if kind not in ADVICE_KINDS:
+        await callback_query.answer()
+        return
+    await answer_advice(callback_query, kind, fresh=True)
+
+
+async def answer_advice(callback_query: CallbackQuery, kind: str, fresh: bool = False):
     user_id = callback_query.from_user.id
     try:
-        df = pd.read_excel("user_registration_data.xlsx")
-        df['user_id'] = pd.to_numeric(df['user_id'], errors='coerce')
-        user_data = df[df['user_id'] == user_id].iloc[0] 
-
-        training_type_mapping = {
-            "interval_training": "интервальную",
-            "long_training": "длительную",
-            "speed_training": "скоростную",
-            "refresh_training": "восстановительную",
-        }
-
-        training_type = training_type_mapping.get(callback_query.data, "неизвестного типа")
-
-        user_message = (f"Составь {training_type} тренировку для бега, имея следующие данные человека:"
-                        f" возраст - {user_data['age']},"
-                        f" вес - {user_data['weight']},"
-                        f" рост - {user_data['height']},"
-                        f" опыт бега в (месяцах) - {user_data['experience_running']},"
-                        f" цель пробежать - {user_data['target_distance']},"
-                        f" желаемая частота тренировок - {user_data['training_frequency']}")
-        response = get_gpt_response(user_id, user_message)
-        await callback_query.message.answer(response)  
-        await callback_query.answer()  
-
-    except FileNotFoundError:
-        await callback_query.message.answer("Ошибка: Файл user_registration_data.xlsx не найден.")
+        # Повторное нажатие, пока ответ готовится, update_scheduler присоединяет к этому запросу (GPT_CALLBACKS)
+        await send_advice(callback_query.message, user_id, kind, fresh=fresh)
+        await callback_query.answer()
+
+    except asyncio.TimeoutError:
+        await callback_query.message.answer(GPT_TIMEOUT_TEXT)
         await callback_query.answer()
     except (KeyError, IndexError, ValueError) as e:
         print(f"Error processing user data: {e}")
@@ -172,46 +330,20 @@ async def make_training(callback_query: CallbackQuery):
 
 @gpt_speaking_router.message(Command("get_equipment"))
 async def get_equipment(message:Message):
-    user_id = message.from_user.id
-    try:
-        df = pd.read_excel("user_registration_data.xlsx")
-        df['user_id'] = pd.to_numeric(df['user_id'], errors='coerce')
-        user_data = df[df['user_id'] == user_id].iloc[0]
-
-        user_message = (f"дай совет про экипировку для бега, имея следующие данные:"
-                        f"\nвозраст - {user_data["age"]},"
-                        f"\nвес - {user_data["weight"]},"
-                        f"\nрост - {user_data["height"]}")
-        response = get_gpt_response(user_id, user_message)
-        await message.answer(response)
-
-    except FileNotFoundError:
-        await message.answer("Ошибка: Файл user_registration_data.xlsx не найден.")
-    except (KeyError, IndexError, ValueError) as e:
-        print(f"Error processing user data: {e}")
-        await message.answer("Ошибка: Не удалось обработать данные пользователя.")
-    except Exception as e:
-        print(f"An unexpected error occurred: {e}")
-        await message.answer("Произошла непредвиденная ошибка.")
+    await answer_advice_command(message, "equipment")
 
 @gpt_speaking_router.message(Command("get_nutrition"))
 async def get_nutrition(message:Message):
+    await answer_advice_command(message, "nutrition")
+
+
+async def answer_advice_command(message: Message, kind: str):
     user_id = message.from_user.id
     try:
-        df = pd.read_excel("user_registration_data.xlsx")
-        df['user_id'] = pd.to_numeric(df['user_id'], errors='coerce')
-        user_data = df[df['user_id'] == user_id].iloc[0]
+        await send_advice(message, user_id, kind)
 
-        user_message = (f"дай совет про то, чем лучше питаться исходя из следующих данных:"
-                        f"\nвозраст - {user_data["age"]},"
-                        f"\nвес - {user_data["weight"]},"
-                        f"\nрост - {user_data["height"]},"
-                        f"\nчастота тренировок - {user_data["training_frequency"]}")
-        response = get_gpt_response(user_id, user_message)
-        await message.answer(response)
-
-    except FileNotFoundError:
-        await message.answer("Ошибка: Файл user_registration_data.xlsx не найден.")
+    except asyncio.TimeoutError:
+        await message.answer(GPT_TIMEOUT_TEXT)
     except (KeyError, IndexError, ValueError) as e:
         print(f"Error processing user data: {e}")
         await message.answer("Ошибка: Не удалось обработать данные пользователя.")
@@ -224,5 +356,8 @@ async def get_nutrition(message:Message):
 async def gpt_conversation(message: Message):
     user_id = message.from_user.id
     user_message = message.text
-    response = get_gpt_response(user_id, user_message)
-    await message.reply(response)
+    try:
+        # Тот же вопрос, отправленный ещё раз в ожидании ответа, update_scheduler присоединяет к этому
+        await send_gpt_response(message, user_id, user_message, reply=True)
+    except asyncio.TimeoutError:
+        await message.reply(GPT_TIMEOUT_TEXT)
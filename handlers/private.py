@@ -1,57 +1,156 @@
-import pandas as pd
-import matplotlib.pyplot as plt
+import asyncio
+import time
+from dataclasses import replace
+from typing import List, Optional
 from aiogram import Bot, Dispatcher, types, Router, F
-from aiogram.filters import CommandStart, Command
+from aiogram.filters import CommandStart, Command, CommandObject
+from aiogram.fsm.context import FSMContext
 from aiogram.types import Message, ReplyKeyboardMarkup, KeyboardButton, BufferedInputFile
 
-from io import BytesIO
+from common.workout_store import workout_store
+from common.chart_cache import chart_cache
+from common.training_stats import training_stats, window_start, WINDOW_ALIASES, WINDOW_TITLES
+from common.charts import (chart_renderer, render_line_plot, render_scatter_plot, render_dashboard, render_report_pdf,
+                           ChartQueueFull)
+from common.chart_data import LineSeries, ScatterSeries, line_series, scatter_series
+from common.profile_store import profile_store
+from common.digest import weekly_digest, DIGEST_ENABLED, DIGEST_ACTIVE_DAYS
+from common.report_store import report_store
 
-def generate_grafic(user_id: int, column_name: str, column_name2: str = None):
+CHARTS_BUSY_TEXT = "Сейчас строится слишком много графиков, попробуйте через минуту."
+# Отчёты, которые еженедельно готовятся заранее
+REPORT_TYPES = ("dashboard", "report_pdf")
+
+# Период графиков, выбранный пользователем (week, month, all), хранится в
+# хранилище FSM под отдельным destiny: переживает перезапуск, общий для всех
+# воркеров и не стирается state.clear() в /tracking и регистрации
+SETTINGS_DESTINY = "settings"
+
+
+def settings_context(state: FSMContext) -> FSMContext:
+    return FSMContext(storage=state.storage, key=replace(state.key, destiny=SETTINGS_DESTINY))
+
+
+async def get_window(state: FSMContext) -> str:
+    data = await settings_context(state).get_data()
+    return data.get("chart_window", "all")
+
+
+async def set_window(state: FSMContext, window: str):
+    await settings_context(state).update_data(chart_window=window)
+
+
+def chart_key(chart_type: str, window: str) -> str:
+    # Граница периода входит в ключ кэша: на следующий день в окно попадают другие тренировки
+    if window == "all":
+        return chart_type
+    return f"{chart_type}:{window}:{window_start(window).date().isoformat()}"
+
+
+def parse_window(text: Optional[str]) -> Optional[str]:
+    return WINDOW_ALIASES.get((text or "").strip().lower())
+
+
+async def generate_grafic(user_id: int, column_name: str, column_name2: str = None, window: str = "all"):
     try:
-        df = pd.read_excel("user_tracking_data.xlsx")
-        df['user_id'] = pd.to_numeric(df['user_id'], errors='coerce')
+        # Читаем только записи этого пользователя и только за выбранный период
+        df = await workout_store.read(user_id, since=window_start(window))
+        if df.empty:
+            print(f"Нет данных для пользователя {user_id}")
+            return None
 
+        # Длинная история агрегируется и прореживается, на график уходит ограниченное число точек
         if column_name2:
-            user_data = df.loc[df['user_id'] == user_id, [column_name, column_name2]]
-            if user_data.empty:
-                print(f"Нет данных для пользователя {user_id}")
-                return None
-            return user_data
+            return scatter_series(df, column_name, column_name2)
         else:
-            user_data = df.loc[df['user_id'] == user_id, column_name]
-            if user_data.empty:
-                print(f"Нет данных для пользователя {user_id}")
-                return None
-            return user_data
-
-    except FileNotFoundError:
-        print("Файл user_tracking_data.xlsx не найден.")
-        return None
+            return line_series(df, column_name)
+
     except Exception as e:
         print(f"Произошла ошибка при чтении файла: {e}")
         return None
-async def send_speed_pulse_histogram(message: types.Message, data: pd.DataFrame, xlabel: str, ylabel: str, title: str):
-    if data.empty:
+async def send_chart_photo(message: types.Message, png: bytes, filename: str, chart_type: str = None, version: int = None):
+    sent = await message.answer_photo(photo=BufferedInputFile(png, filename=filename))
+    if chart_type is None:
+        return
+    chart_cache.put(message.from_user.id, chart_type, version, png)
+    if sent.photo:
+        chart_cache.set_file_id(message.from_user.id, chart_type, version, sent.photo[-1].file_id)
+
+
+async def send_cached_chart(message: types.Message, chart_type: str, version: int) -> bool:
+    # Новых тренировок не было - отдаём готовый график, по возможности уже загруженный в Telegram
+    entry = chart_cache.get(message.from_user.id, chart_type, version)
+    if entry is None:
+        return False
+    if entry.file_id:
+        await message.answer_photo(photo=entry.file_id)
+    else:
+        await send_chart_photo(message, entry.png, f"{chart_type}.png", chart_type, version)
+    return True
+
+
+async def send_speed_pulse_histogram(message: types.Message, series: ScatterSeries, xlabel: str, ylabel: str, title: str,
+                                     chart_type: str = None, version: int = None):
+    if not series.x and series.density is None:
       await message.answer("Недостаточно данных для построения гистограммы.")
       return
 
-    plt.figure()
+    # Облако точек, а для большого числа тренировок - плотность по клеткам
+    try:
+        png = await chart_renderer.render(render_scatter_plot, series, xlabel, ylabel, title)
+    except ChartQueueFull:
+        await message.answer(CHARTS_BUSY_TEXT)
+        return
 
-    # Scatter plot с группировкой по диапазонам
-    plt.scatter(data["pace"], data["pulse"], alpha=0.7)
+    await send_chart_photo(message, png, "histogram.png", chart_type, version)
 
-    plt.xlabel(xlabel)
-    plt.ylabel(ylabel)
-    plt.title(title)
-    plt.grid(True)
 
-    buf = BytesIO()
-    plt.savefig(buf, format='png')
-    buf.seek(0)
+async def send_report_document(message: types.Message, pdf: bytes, version: int, chart_type: str = "report_pdf"):
+    sent = await message.answer_document(document=BufferedInputFile(pdf, filename="report.pdf"))
+    # В кэше графиков вместо картинки лежат байты PDF
+    chart_cache.put(message.from_user.id, chart_type, version, pdf)
+    if sent.document:
+        chart_cache.set_file_id(message.from_user.id, chart_type, version, sent.document.file_id)
+
+
+async def send_cached_report(message: types.Message, version: int, chart_type: str = "report_pdf") -> bool:
+    entry = chart_cache.get(message.from_user.id, chart_type, version)
+    if entry is None:
+        return False
+    if entry.file_id:
+        await message.answer_document(document=entry.file_id)
+    else:
+        await send_report_document(message, entry.png, version, chart_type)
+    return True
+
 
-    await message.answer_photo(photo=BufferedInputFile(buf.read(), filename="histogram.png"))
-    plt.close()
-    buf.close()
+def format_stats(stats, window: str = "all") -> List[str]:
+    lines = [f"- Тренировок: {stats.workouts}",
+            f"- Общая дистанция: {stats.total_distance:.1f} км",
+            f"- Дистанция за эту неделю: {stats.current_week_distance():.1f} км",
+            f"- Средний темп: {stats.average_pace:.1f} км/ч",
+            f"- Средний пульс: {stats.average_pulse:.0f} ударов/мин",
+            f"- Сожжено калорий: {stats.total_calories:.0f}",
+            f"- Самая длинная пробежка: {stats.longest_distance:.1f} км",
+            f"- Лучший темп: {stats.best_pace:.1f} км/ч"]
+    # Серия недель имеет смысл только по всей истории
+    if window == "all":
+        lines.append(f"- Недель подряд с тренировками: {stats.current_week_streak()} (рекорд: {stats.best_week_streak})")
+    return lines
+
+
+async def build_report(user_id: int, report_type: str, window: str = "all") -> Optional[bytes]:
+    # Одно чтение тренировок за период на все графики отчёта
+    df = await workout_store.read(user_id, since=window_start(window))
+    if df.empty:
+        return None
+    profile = profile_store.get(user_id) or {}
+    title = f"Прогресс пользователя {profile.get('name') or user_id} {WINDOW_TITLES[window]}"
+    columns = [line_series(df, column) for column in ("distance", "pulse", "pace")] + [scatter_series(df, "pace", "pulse")]
+    if report_type == "dashboard":
+        return await chart_renderer.render(render_dashboard, *columns, title)
+    summary = format_stats(await training_stats.for_window(user_id, window), window)
+    return await chart_renderer.render(render_report_pdf, *columns, title, summary)
 
 
 keyboard = ReplyKeyboardMarkup(
@@ -63,74 +162,194 @@ keyboard = ReplyKeyboardMarkup(
         [
             KeyboardButton(text="График:\nскорость/пульс"),
         ],
+        [
+            KeyboardButton(text="Отчёт:\nвсе графики"),
+            KeyboardButton(text="Отчёт:\nPDF"),
+        ],
+        [
+            KeyboardButton(text="Период: неделя"),
+            KeyboardButton(text="Период: месяц"),
+            KeyboardButton(text="Период: всё время"),
+        ],
     ],
     resize_keyboard=True,
     one_time_keyboard=True,
     input_field_placeholder="Выберите вариант"
 )
 
-private_router = Router()
+private_router = Router(name="private")
 
 @private_router.message(Command("report_achievements"))
-async def start_cmd(message: types.Message):
-    await message.answer(f"Выберите какой отчет вы хотите", reply_markup=keyboard)
-
-async def send_plot(message: types.Message, data: pd.DataFrame | pd.Series, xlabel: str, ylabel: str, title: str):
-    plt.figure()
-
-    if isinstance(data, pd.DataFrame):
-        # Если data - DataFrame, используем столбцы для осей
-        plt.plot(data.iloc[:, 0], data.iloc[:, 1])
-        plt.xlabel(xlabel)
-        plt.ylabel(ylabel)
-    elif isinstance(data, pd.Series):
-        # Если data - Series, используем индексы для оси X
-        x_values = range(1, len(data) + 1)
-        plt.plot(x_values, data.values)
-        plt.xlabel(xlabel)
-        plt.ylabel(ylabel)
-        plt.xticks(x_values)
+async def start_cmd(message: types.Message, command: CommandObject, state: FSMContext):
+    # Период можно указать сразу: /report_achievements месяц
+    window = parse_window(command.args)
+    if window:
+        await set_window(state, window)
     else:
-        await message.answer("Ошибка: Неподдерживаемый тип данных для графика.")
-        plt.close()
+        window = await get_window(state)
+    await message.answer(f"Выберите какой отчет вы хотите (графики {WINDOW_TITLES[window]})",
+                         reply_markup=keyboard)
+
+@private_router.message(F.text.startswith("Период: "))
+async def choose_window(message: types.Message, state: FSMContext):
+    window = parse_window(message.text.split(":", 1)[1])
+    if window is None:
+        await message.answer("Доступные периоды: неделя, месяц, всё время.")
         return
+    await set_window(state, window)
+    await message.answer(f"Графики и отчёты будут строиться {WINDOW_TITLES[window]}.", reply_markup=keyboard)
 
-    plt.title(title)
-    plt.grid(True)
+@private_router.message(Command("stats"))
+async def stats_cmd(message: types.Message, command: CommandObject):
+    # /stats неделя | месяц | всё; за всё время отвечаем из готовых агрегатов, за период - по срезу записей
+    window = parse_window(command.args) or "all"
+    stats = await training_stats.for_window(message.from_user.id, window)
+    if not stats.workouts:
+        if window == "all":
+            await message.answer("У вас пока нет записанных тренировок. Добавьте первую через /tracking.")
+        else:
+            await message.answer(f"Нет тренировок {WINDOW_TITLES[window]}.")
+        return
+    await message.answer(f"Ваша статистика {WINDOW_TITLES[window]}:\n" + "\n".join(format_stats(stats, window)))
 
-    buf = BytesIO()
-    plt.savefig(buf, format='png')
-    buf.seek(0)
+async def send_plot(message: types.Message, series: LineSeries, ylabel: str, title: str,
+                    chart_type: str = None, version: int = None):
+    # Рисуем в пуле воркеров, чтобы не блокировать обработку других пользователей
+    try:
+        png = await chart_renderer.render(render_line_plot, series, ylabel, title)
+    except ChartQueueFull:
+        await message.answer(CHARTS_BUSY_TEXT)
+        return
 
-    await message.answer_photo(photo=BufferedInputFile(buf.read(), filename="plot.png"))
-    plt.close()
-    buf.close()
+    await send_chart_photo(message, png, "plot.png", chart_type, version)
 
 
 @private_router.message(F.text == "График:\nдистанция/тренировки")
-async def report_distance(message: types.Message):
+async def report_distance(message: types.Message, state: FSMContext):
     user_id = message.from_user.id
-    df = generate_grafic(user_id=user_id, column_name="distance")
+    window = await get_window(state)
+    key = chart_key("distance", window)
+    version = await workout_store.version(user_id)
+    if await send_cached_chart(message, key, version):
+        return
+    df = await generate_grafic(user_id=user_id, column_name="distance", window=window)
     if df is not None:
-        await send_plot(message, df, "Количество записанных измерений", "Дистанция", f"Дистанция/тренировки для пользователя {message.from_user.first_name}")
+        await send_plot(message, df, "Дистанция", f"Дистанция/тренировки для пользователя {message.from_user.first_name} {WINDOW_TITLES[window]}",
+                        chart_type=key, version=version)
     else:
         await message.answer("Недостаточно данных для построения графика.")
 
 @private_router.message(F.text == "График:\nпульс/тренировки")
-async def report_pulse(message: types.Message):
+async def report_pulse(message: types.Message, state: FSMContext):
     user_id = message.from_user.id
-    df = generate_grafic(user_id=user_id, column_name="pulse")
+    window = await get_window(state)
+    key = chart_key("pulse", window)
+    version = await workout_store.version(user_id)
+    if await send_cached_chart(message, key, version):
+        return
+    df = await generate_grafic(user_id=user_id, column_name="pulse", window=window)
     if df is not None:
-        await send_plot(message, df, "Количество записанных измерений", "Пульс", f"Пульс/тренировки для пользователя {message.from_user.first_name}")
+        await send_plot(message, df, "Пульс", f"Пульс/тренировки для пользователя {message.from_user.first_name} {WINDOW_TITLES[window]}",
+                        chart_type=key, version=version)
     else:
         await message.answer("Недостаточно данных для построения графика.")
 
 @private_router.message(F.text == "График:\nскорость/пульс")
-async def report_speed_pulse(message: types.Message):
+async def report_speed_pulse(message: types.Message, state: FSMContext):
     user_id = message.from_user.id
-    df = generate_grafic(user_id=user_id, column_name="pace", column_name2="pulse")
+    window = await get_window(state)
+    key = chart_key("speed_pulse", window)
+    version = await workout_store.version(user_id)
+    if await send_cached_chart(message, key, version):
+        return
+    df = await generate_grafic(user_id=user_id, column_name="pace", column_name2="pulse", window=window)
 
     if df is not None:
-        await send_speed_pulse_histogram(message, df, "Скорость", "Пульс", f"Зависимость пульса от скорости для пользователя {message.from_user.first_name}")
+        await send_speed_pulse_histogram(message, df, "Скорость", "Пульс", f"Зависимость пульса от скорости для пользователя {message.from_user.first_name} {WINDOW_TITLES[window]}",
+                                         chart_type=key, version=version)
     else:
-        await message.answer("Недостаточно данных для построения графика.")
\ No newline at end of file
+        await message.answer("Недостаточно данных для построения графика.")
+
+
+@private_router.message(F.text == "Отчёт:\nвсе графики")
+async def report_dashboard(message: types.Message, state: FSMContext):
+    user_id = message.from_user.id
+    window = await get_window(state)
+    key = chart_key("dashboard", window)
+    version = await workout_store.version(user_id)
+    if await send_cached_chart(message, key, version):
+        return
+    prepared = await load_prepared_report(user_id, "dashboard", window, version)
+    if prepared is not None:
+        await send_chart_photo(message, prepared, "dashboard.png", key, version)
+        return
+    try:
+        png = await build_report(user_id, "dashboard", window)
+    except ChartQueueFull:
+        await message.answer(CHARTS_BUSY_TEXT)
+        return
+    if png is None:
+        await message.answer("Недостаточно данных для построения графика.")
+        return
+    await send_chart_photo(message, png, "dashboard.png", key, version)
+
+@private_router.message(F.text == "Отчёт:\nPDF")
+async def report_pdf(message: types.Message, state: FSMContext):
+    user_id = message.from_user.id
+    window = await get_window(state)
+    key = chart_key("report_pdf", window)
+    version = await workout_store.version(user_id)
+    if await send_cached_report(message, version, key):
+        return
+    prepared = await load_prepared_report(user_id, "report_pdf", window, version)
+    if prepared is not None:
+        await send_report_document(message, prepared, version, key)
+        return
+    try:
+        pdf = await build_report(user_id, "report_pdf", window)
+    except ChartQueueFull:
+        await message.answer(CHARTS_BUSY_TEXT)
+        return
+    if pdf is None:
+        await message.answer("Недостаточно данных для построения отчёта.")
+        return
+    await send_report_document(message, pdf, version, key)
+
+
+async def load_prepared_report(user_id: int, report_type: str, window: str, version: int) -> Optional[bytes]:
+    # Еженедельная рассылка готовит отчёты только за всё время
+    if window != "all":
+        return None
+    return await asyncio.to_thread(report_store.load, user_id, report_type, version)
+
+
+async def digest_users() -> List[int]:
+    # Отчёты готовятся только тем, кто записывал тренировки в последние DIGEST_ACTIVE_DAYS дней
+    return await asyncio.to_thread(workout_store.user_ids, time.time() - DIGEST_ACTIVE_DAYS * 86400)
+
+
+async def prepare_reports(user_id: int):
+    # Отчёт строится заново, только если с прошлой подготовки появились тренировки
+    version = await workout_store.version(user_id)
+    for report_type in REPORT_TYPES:
+        if chart_cache.has(user_id, report_type, version) or report_store.has(user_id, report_type, version):
+            continue
+        while True:
+            try:
+                report = await build_report(user_id, report_type)
+                break
+            except ChartQueueFull:
+                # Пул занят запросами пользователей, они важнее
+                await asyncio.sleep(1)
+        if report is not None:
+            # На диск, а не в кэш графиков: рассылка не должна вытеснять графики, запрошенные пользователями
+            await asyncio.to_thread(report_store.save, user_id, report_type, version, report)
+
+
+async def start_digest():
+    if DIGEST_ENABLED:
+        await weekly_digest.start(digest_users, prepare_reports)
+
+
+async def stop_digest():
+    await weekly_digest.close()
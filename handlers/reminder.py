@@ -1,50 +1,41 @@
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from aiogram import Bot, Router
+from aiogram.exceptions import TelegramForbiddenError
 from aiogram.types import Message
 from aiogram.filters import Command
-import datetime
-
-scheduler = AsyncIOScheduler()
+from common.outbox import outbox_priority, PRIORITY_BULK
+from common.reminder_engine import reminder_engine
 
 # Роутер для напоминаний
-reminder_router = Router()
+reminder_router = Router(name="reminder")
 
 REMINDER_TEXT = "Вы не забыли про тренировку?)"
 
 async def send_reminder(bot: Bot, chat_id: int):
+    # Напоминания идут в низкоприоритетной полосе очереди отправки и пропускают вперёд ответы пользователям
+    token = outbox_priority.set(PRIORITY_BULK)
     try:
         await bot.send_message(chat_id=chat_id, text=REMINDER_TEXT)
-        print(f"Reminder sent to chat {chat_id}")
+    except TelegramForbiddenError:
+        # Пользователь заблокировал бота - больше не пытаемся ему писать
+        reminder_engine.unsubscribe(chat_id)
     except Exception as e:
-        print(f"Error sending reminder: {e}")
+        print(f"Error sending reminder to chat {chat_id}: {e}")
+    finally:
+        outbox_priority.reset(token)
 
 
-def set_interval_reminder(bot: Bot, chat_id: int):
-    existing_job = scheduler.get_job(str(chat_id))
-    if existing_job:
+def set_interval_reminder(chat_id: int):
+    if not reminder_engine.subscribe(chat_id):
         print(f"Reminder already exists for chat {chat_id}")
-        return
-
-    scheduler.add_job(
-        send_reminder,
-        'interval',
-        minutes=5,
-        args=[bot, chat_id],
-        id=str(chat_id)
-    )
-    print(f"Reminder set for chat {chat_id} every 5 minutes")
 
 
 def stop_interval_reminder(chat_id: int):
-    try:
-        scheduler.remove_job(str(chat_id))
-        print(f"Reminder stopped for chat {chat_id}")
-    except Exception as e:
-        print(f"Error stopping reminder: {e}")
+    if not reminder_engine.unsubscribe(chat_id):
+        print(f"No reminder to stop for chat {chat_id}")
 
 @reminder_router.message(Command("start_reminders"))
-async def command_start_reminder(message: Message, bot: Bot):
-    set_interval_reminder(bot, message.chat.id)
+async def command_start_reminder(message: Message):
+    set_interval_reminder(message.chat.id)
     await message.answer("Напоминания включены! Каждые 5 минут я буду спрашивать, не забыли ли вы про тренировку.")
 
 @reminder_router.message(Command("stop_reminders"))
@@ -53,7 +44,11 @@ async def command_stop_reminder(message: Message):
     await message.answer("Напоминания отключены!")
 
 
-# Запуск APScheduler (должен быть перед bot.infinity_polling())
-async def start_scheduler():
-    scheduler.start()
-    print("Scheduler started.")
\ No newline at end of file
+# Восстанавливает подписки из базы и запускает диспетчер (до start_polling)
+async def start_scheduler(bot: Bot):
+    await reminder_engine.start(lambda chat_id: send_reminder(bot, chat_id))
+    print(f"Scheduler started, {reminder_engine.subscribers} subscriptions restored.")
+
+
+async def stop_scheduler():
+    await reminder_engine.close()
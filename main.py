@@ -1,16 +1,41 @@
 import os, asyncio
-from aiogram import Bot, Dispatcher, types
 from dotenv import load_dotenv, find_dotenv
-from handlers.private import private_router
+# Настройки модулей читаются при импорте, поэтому .env загружается до них
+load_dotenv(find_dotenv())
+# STARTUP_PROFILE=1 - замер импортов, поэтому профилировщик импортируется раньше остальных модулей
+from common.startup_profile import report_startup
+from aiogram import Bot, Dispatcher, types
+from handlers.private import private_router, start_digest, stop_digest, keyboard
 from common.bot_cmd_list import private
 from FSM.registration import reg_router
 from FSM.tracking import track_router
-from handlers.gpt_train import gpt_speaking_router
-from handlers.reminder import reminder_router, start_scheduler
-load_dotenv(find_dotenv())
+from handlers.gpt_train import gpt_speaking_router, get_chat, get_prompt, GPT_CALLBACKS, GPT_COMMANDS
+from handlers.reminder import reminder_router, start_scheduler, stop_scheduler
+from common.conversation_store import conversation_store
+from common.profile_store import profile_store
+from common.workout_store import workout_store
+from common.training_stats import training_stats
+from common.charts import chart_renderer
+from common.track_import import track_importer
+from common.outbox import outbox
+from common.prefetch import prefetcher
+from common.response_cache import response_cache
+from common.bot_factory import create_bot
+from common.update_scheduler import update_scheduler
+from common.metrics import MetricsMiddleware, start_metrics_server, METRICS_PORT
+from common.fsm_storage import SQLiteStorage
+from common.webhook import run_master, serve_worker, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET
+from common.workers import WORKER_ID
+
+# polling - один процесс, webhook - главный процесс и WORKERS воркеров за одним портом
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+# Тяжёлые библиотеки (pandas, LangChain) догружаются в фоне после старта, а не в первом запросе пользователя
+WARM_UP_IMPORTS = os.getenv('WARM_UP_IMPORTS', '1') == '1'
 
-bot = Bot(token=os.getenv('TOKEN_API'))
-dp = Dispatcher()
+# Единственный экземпляр бота и HTTP-сессии, в хендлеры он приходит через параметр bot
+bot = create_bot(os.getenv('TOKEN_API'))
+# Состояния FSM хранятся в SQLite: переживают перезапуск и доступны всем воркерам
+dp = Dispatcher(storage=SQLiteStorage())
 
 dp.include_router(private_router)
 dp.include_router(reg_router)
@@ -18,14 +43,98 @@ dp.include_router(track_router)
 dp.include_router(reminder_router)
 dp.include_router(gpt_speaking_router)
 
+# Очереди апдейтов по чатам с общим пределом параллельности вместо задачи на каждый апдейт
+update_scheduler.reserve_texts(button.text for row in keyboard.keyboard for button in row)
+# Повторы запросов к GigaChat присоединяются к первому, пока он не выполнен
+update_scheduler.coalesce(callbacks=GPT_CALLBACKS, commands=GPT_COMMANDS)
+dp.update.outer_middleware(update_scheduler)
+
+# Задержки, ошибки и число обрабатываемых апдейтов по каждому роутеру и хендлеру
+dp.message.middleware(MetricsMiddleware())
+dp.callback_query.middleware(MetricsMiddleware())
+
 ALLOWED_UPDATES = ["message", "edited_message", "callback_query"]
 
+_warm_up_task = None
+
+
+def warm_up():
+    import pandas
+    get_chat()
+    get_prompt()
+
+
+async def start_services():
+    global _warm_up_task
+    await conversation_store.start()
+    await profile_store.start()
+    await workout_store.start()
+    await training_stats.start()
+    await start_scheduler(bot)
+    await start_digest()
+    # METRICS_PORT=0 отключает эндпоинт /metrics, у каждого воркера свой порт
+    metrics_runner = await start_metrics_server(port=METRICS_PORT + WORKER_ID) if METRICS_PORT else None
+    report_startup("бот готов принимать апдейты")
+    if WARM_UP_IMPORTS:
+        _warm_up_task = asyncio.create_task(asyncio.to_thread(warm_up))
+    return metrics_runner
+
+
+async def stop_services(metrics_runner):
+    # Дообрабатываем принятые апдейты и сбрасываем несохранённые данные на диск перед выходом
+    await update_scheduler.close()
+    await conversation_store.close()
+    await profile_store.close()
+    await workout_store.close()
+    await training_stats.close()
+    await stop_scheduler()
+    await stop_digest()
+    await prefetcher.close()
+    await response_cache.close()
+    await outbox.close()
+    await bot.session.close()
+    chart_renderer.close()
+    track_importer.close()
+    if metrics_runner is not None:
+        await metrics_runner.cleanup()
+
 
 # Запуск бота
 async def main()->None:
-    await start_scheduler()
+    metrics_runner = await start_services()
     await bot.delete_webhook(drop_pending_updates=True)
     await bot.set_my_commands(commands=private, scope=types.BotCommandScopeAllPrivateChats())
-    await dp.start_polling(bot, allowed_updates=ALLOWED_UPDATES)
+    try:
+        # Поллинг только раскладывает апдейты по очередям, параллельность задаёт update_scheduler
+        await dp.start_polling(bot, allowed_updates=ALLOWED_UPDATES, handle_as_tasks=False)
+    finally:
+        await stop_services(metrics_runner)
+
+
+async def webhook_master()->None:
+    # Старый xlsx с тренировками импортируется до запуска воркеров, чтобы они не делали это одновременно
+    await asyncio.to_thread(workout_store.import_legacy)
+    await bot.set_webhook(WEBHOOK_URL + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET or None,
+                          allowed_updates=ALLOWED_UPDATES, drop_pending_updates=True)
+    await bot.set_my_commands(commands=private, scope=types.BotCommandScopeAllPrivateChats())
+    try:
+        await run_master()
+    finally:
+        await bot.session.close()
+
+
+async def webhook_worker()->None:
+    metrics_runner = await start_services()
+    await dp.emit_startup(bot=bot)
+    try:
+        await serve_worker(dp, bot)
+    finally:
+        await dp.emit_shutdown(bot=bot)
+        await stop_services(metrics_runner)
+
 
-asyncio.run(main())
\ No newline at end of file
+if __name__ == "__main__":
+    if BOT_MODE == 'webhook':
+        asyncio.run(webhook_worker() if 'WORKER_ID' in os.environ else webhook_master())
+    else:
+        asyncio.run(main())
@@ -0,0 +1,64 @@
+import asyncio
+
+from aiogram import Bot, Dispatcher, F, Router
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.fsm.context import FSMContext
+from aiogram.types import Update
+
+from bench.fake_telegram import FakeTelegram
+from common.update_scheduler import UpdateScheduler
+
+CHAT_ID = 42
+USER = {"id": CHAT_ID, "is_bot": False, "first_name": "test"}
+CHAT = {"id": CHAT_ID, "type": "private"}
+
+
+def message(update_id: int, text: str) -> dict:
+    return {"update_id": update_id, "message": {"message_id": update_id, "date": 0, "chat": CHAT,
+                                                "from": USER, "text": text}}
+
+
+def callback(update_id: int, data: str) -> dict:
+    return {"update_id": update_id, "callback_query": {
+        "id": str(update_id), "from": USER, "chat_instance": "1", "data": data,
+        "message": {"message_id": 1, "date": 0, "chat": CHAT, "text": "..."}}}
+
+
+async def feed(*batches: list, scheduler: UpdateScheduler = None) -> tuple:
+    # Апдейты проходят через настоящий Dispatcher с планировщиком, Bot API - заглушка.
+    # /tracking переводит чат в состояние FSM, как настоящая запись тренировки
+    telegram = FakeTelegram(latency=0)
+    url = await telegram.start()
+    bot = Bot("123456:test", session=AiohttpSession(api=TelegramAPIServer.from_base(url)))
+    scheduler = scheduler or UpdateScheduler()
+    handled = []
+
+    router = Router()
+
+    @router.callback_query()
+    async def on_callback(callback_query):
+        handled.append(callback_query.data)
+        await asyncio.sleep(0.05)
+
+    @router.message(F.text)
+    async def on_text(message, state: FSMContext):
+        handled.append(message.text)
+        if message.text == "/tracking":
+            await state.set_state("tracking")
+        await asyncio.sleep(0.05)
+
+    dp = Dispatcher()
+    dp.include_router(router)
+    dp.update.outer_middleware(scheduler)
+    try:
+        # Следующая пачка отправляется после того, как обработана предыдущая
+        for updates in batches:
+            for update in updates:
+                await dp.feed_update(bot, Update.model_validate(update, context={"bot": bot}))
+            await scheduler.join(CHAT_ID)
+        await scheduler.close()
+    finally:
+        await bot.session.close()
+        await telegram.close()
+    return handled, scheduler, telegram
@@ -0,0 +1,70 @@
+import asyncio
+from datetime import datetime
+
+from common.response_cache import ResponseCache
+from common.training_stats import TrainingStats
+from handlers.gpt_train import advice_request
+
+
+def profile(**fields) -> dict:
+    return {"age": 30, "weight": 70, "height": 180, "experience_running": 12, "target_distance": "10 км",
+            "training_frequency": "3 раза в неделю", **fields}
+
+
+def stats(*runs) -> TrainingStats:
+    # runs - (дистанция в км, время в минутах, пульс), все пробежки на текущей неделе
+    result = TrainingStats()
+    recorded_at = datetime.now().isoformat(timespec="seconds")
+    for distance, time, pulse in runs:
+        result.add({"distance": distance, "time": time, "pace": distance / (time / 60), "pulse": pulse,
+                    "recorded_at": recorded_at})
+    return result
+
+
+def test_near_identical_runners_share_training_plan():
+    cache = ResponseCache(path=None)
+    first_inputs, _ = advice_request("interval_training", profile(age=31, weight=71),
+                                     stats((5, 30, 151), (8, 50, 148)))
+    second_inputs, _ = advice_request("interval_training", profile(age=29, weight=69, height=181),
+                                      stats((5.2, 31, 150), (7.8, 48, 149)))
+    cache.put(cache.make_key("interval_training", first_inputs), "план")
+
+    entry = cache.get(cache.make_key("interval_training", second_inputs))
+    assert entry is not None and entry.response == "план"
+
+
+def test_different_training_load_gets_own_plan():
+    cache = ResponseCache(path=None)
+    first_inputs, _ = advice_request("long_training", profile(), stats((5, 30, 150)))
+    second_inputs, _ = advice_request("long_training", profile(), stats((21, 120, 150), (15, 90, 150)))
+    cache.put(cache.make_key("long_training", first_inputs), "план")
+
+    assert cache.get(cache.make_key("long_training", second_inputs)) is None
+
+
+def test_prompt_uses_bucketed_figures():
+    inputs, user_message = advice_request("speed_training", profile(), stats((5.2, 31, 152)))
+    assert inputs["week_distance"] == 5 and inputs["average_pulse"] == 150
+    assert "за последнюю неделю - около 5 км" in user_message
+
+
+def test_plan_survives_restart(tmp_path):
+    # Второй экземпляр кэша с той же базой - перезапуск бота или другой воркер
+    path = str(tmp_path / "responses.db")
+    inputs, _ = advice_request("refresh_training", profile(), stats((5, 30, 150)))
+
+    async def put():
+        cache = ResponseCache(path=path)
+        cache.put(cache.make_key("refresh_training", inputs), "план")
+        await cache.close()
+
+    async def load():
+        cache = ResponseCache(path=path)
+        entry = await cache.load(cache.make_key("refresh_training", inputs))
+        await cache.close()
+        return entry, cache.stats()
+
+    asyncio.run(put())
+    entry, stats_after = asyncio.run(load())
+    assert entry is not None and entry.response == "план" and not entry.stale
+    assert stats_after["hits"] == 1 and stats_after["misses"] == 0 and stats_after["loaded"] == 1
@@ -0,0 +1,49 @@
+import asyncio
+
+from common.update_scheduler import UpdateScheduler
+from handlers.gpt_train import GPT_CALLBACKS, GPT_COMMANDS
+from tests.scheduler_harness import callback, feed, message
+
+
+def gpt_scheduler() -> UpdateScheduler:
+    scheduler = UpdateScheduler()
+    scheduler.coalesce(callbacks=GPT_CALLBACKS, commands=GPT_COMMANDS)
+    return scheduler
+
+
+def test_repeated_gpt_requests_are_coalesced():
+    handled, scheduler, telegram = asyncio.run(feed([
+        callback(1, "interval_training"), callback(2, "interval_training"),
+        message(3, "/get_nutrition"), message(4, "/get_nutrition"),
+    ], scheduler=gpt_scheduler()))
+    assert handled == ["interval_training", "/get_nutrition"]
+    assert scheduler.stats()["coalesced"] == 2
+    # Второе нажатие получает ответ, чтобы кнопка перестала крутиться
+    assert telegram.requests["answercallbackquery"] == 1
+
+
+def test_repeated_gpt_question_is_coalesced():
+    handled, scheduler, _ = asyncio.run(feed([
+        message(1, "Как подготовиться к забегу?"), message(2, "Как подготовиться к забегу?"),
+    ], scheduler=gpt_scheduler()))
+    assert handled == ["Как подготовиться к забегу?"]
+    assert scheduler.stats()["coalesced"] == 1
+
+
+def test_repeated_fsm_answers_are_handled():
+    # Одинаковые ответы в FSM (значения при записи тренировки, кнопки регистрации) - не повторы запроса
+    handled, scheduler, _ = asyncio.run(feed(
+        [message(1, "/tracking"), message(2, "5"), message(3, "5")],
+        [message(4, "5"), message(5, "5"), callback(6, "yes"), callback(7, "yes")],
+        scheduler=gpt_scheduler(),
+    ))
+    assert handled == ["/tracking", "5", "5", "5", "5", "yes", "yes"]
+    stats = scheduler.stats()
+    assert stats["coalesced"] == 0 and stats["duplicates"] == 3
+
+
+def test_same_question_after_answer_is_handled_again():
+    handled, scheduler, _ = asyncio.run(feed([message(1, "10 км")], [message(2, "10 км")],
+                                             scheduler=gpt_scheduler()))
+    assert handled == ["10 км", "10 км"]
+    assert scheduler.stats()["duplicates"] == 0
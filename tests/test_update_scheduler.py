@@ -0,0 +1,11 @@
+import asyncio
+
+from tests.scheduler_harness import callback, feed, message
+
+
+def test_different_updates_keep_order():
+    handled, scheduler, _ = asyncio.run(feed([
+        message(1, "/tracking"), message(2, "10"), message(3, "50"), callback(4, "yes_track"),
+    ]))
+    assert handled == ["/tracking", "10", "50", "yes_track"]
+    assert scheduler.stats()["duplicates"] == 0
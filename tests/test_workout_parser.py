@@ -0,0 +1,58 @@
+import pytest
+
+from common.workout_parser import derive_pace, parse_workout
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("5.2 км 27:30 пульс 152 410 ккал", {"distance": 5.2, "time": 27.5, "pulse": 152, "calories": 410}),
+    ("5,2km 1:05:10 hr 150", {"distance": 5.2, "time": 65.17, "pulse": 150}),
+    ("10 50 12 150 700", {"distance": 10, "time": 50, "pace": 12, "pulse": 150, "calories": 700}),
+    ("пробежал 8 км за 45 минут, 500 калорий", {"distance": 8, "time": 45, "calories": 500}),
+    ("3000 м 1 ч 5 мин", {"distance": 3, "time": 65}),
+    ("темп 5:20 10 км", {"pace": 11.25, "distance": 10}),
+])
+def test_one_message(text, expected):
+    assert parse_workout(text) == expected
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("пульс 150 калории 400", {"pulse": 150, "calories": 400}),
+    ("пульс 150 ккал 400", {"pulse": 150, "calories": 400}),
+    ("калории 400 пульс 150", {"calories": 400, "pulse": 150}),
+    ("дистанция 5 время 30 пульс 140", {"distance": 5, "time": 30, "pulse": 140}),
+    ("время 1 ч темп 12 км/ч", {"time": 60, "pace": 12}),
+    ("пульс150", {"pulse": 150}),
+    ("калории400 пульс150", {"calories": 400, "pulse": 150}),
+    ("дистанция5 время30", {"distance": 5, "time": 30}),
+    ("5km 30m hr 150", {"distance": 5, "time": 30, "pulse": 150}),
+])
+def test_keyword_value_pairs(text, expected):
+    assert parse_workout(text) == expected
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("5км 30м", {"distance": 5, "time": 30}),
+    ("3 км за 20 м", {"distance": 3, "time": 20}),
+    ("1 ч 30 м", {"time": 90}),
+    ("3000 м 20 мин", {"distance": 3, "time": 20}),
+    ("800 метров 4 мин", {"distance": 0.8, "time": 4}),
+    ("дистанция 50 м", {"distance": 0.05}),
+])
+def test_short_m_is_minutes_below_hundred(text, expected):
+    assert parse_workout(text) == expected
+
+
+def test_bare_number_goes_to_asked_field():
+    assert parse_workout("30", expected="time") == {"time": 30}
+    assert parse_workout("27:30", expected="time") == {"time": 27.5}
+    assert parse_workout("150", expected="pulse") == {"pulse": 150}
+
+
+def test_out_of_range_is_not_extracted():
+    assert parse_workout("пульс 300") == {}
+    assert parse_workout("80 км") == {}
+
+
+def test_derive_pace():
+    assert derive_pace(10, 50) == 12
+    assert derive_pace(10, None) is None